@@ -0,0 +1,98 @@
+"""
+Benchmark the per-step overhead of the engine: a workflow of short, pure steps
+(`FunctionRunner`) run on a MemoryStore, so that the time is (mostly) the engine
+itself [context, results, records] and not the actions or the store.
+
+    python benchmarks/step_overhead.py [--steps 50] [--runs 200]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wfengine.base_runner import RunStatus  # noqa: E402
+from wfengine.stores import MemoryStore  # noqa: E402
+from wfengine.wf_runner import WFRunner  # noqa: E402
+from wfengine.workflow import WFResult, Workflow  # noqa: E402
+
+
+def build_workflow(num_steps: int) -> Workflow:
+    """A chain of `upper` steps [the step cache is off, so each step is run]"""
+    steps = [
+        {
+            "id": f"STEP{i}",
+            "action": "FunctionRunner",
+            "desc": f"Step {i}",
+            "parameters": {"func": "upper"},
+            "input_mapping": {"input": "text"},
+            "output_mapping": {"func_result": f"result{i}"},
+            "cache": False,
+        }
+        for i in range(num_steps)
+    ]
+    transitions = [
+        {"from_step": f"STEP{i}", "to_step": f"STEP{i + 1}"}
+        for i in range(num_steps - 1)
+    ]
+    return Workflow(
+        name="BENCH",
+        desc="Per-step engine overhead",
+        first_step="STEP0",
+        steps=steps,
+        transitions=transitions,
+    )
+
+
+def bench_runs(num_steps: int, num_runs: int) -> float:
+    """Mean secs per step over the runs [after a warm-up run]"""
+    runner = WFRunner(
+        workflow=build_workflow(num_steps),
+        store=MemoryStore(),
+        owner="abc@example.com",
+    )
+    runner.run(text="hello")
+    started = time.perf_counter()
+    for _ in range(num_runs):
+        result = runner.run(text="hello")
+    elapsed = time.perf_counter() - started
+    assert result["status"] == RunStatus.COMPLETED, result
+    return elapsed / (num_runs * num_steps)
+
+
+def bench_results(count: int) -> float:
+    """Mean secs to create a step result"""
+    inputs = {"func": "upper", "input": "hello"}
+    started = time.perf_counter()
+    for _ in range(count):
+        WFResult(
+            step_id="STEP0",
+            action="FunctionRunner",
+            inputs=inputs,
+            outputs={"result0": "HELLO"},
+            status=RunStatus.COMPLETED,
+            completion_reason="Step [Completed]",
+        )
+    return (time.perf_counter() - started) / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--steps", type=int, default=50, help="Steps per run")
+    parser.add_argument("--runs", type=int, default=200, help="Number of runs")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)  # Only the engine; not the log handlers
+    per_step = bench_runs(args.steps, args.runs)
+    per_result = bench_results(100_000)
+    print(f"Steps: {args.steps} x {args.runs} runs")  # noqa: T201
+    print(f"Per step overhead  : {per_step * 1e6:8.2f} usecs")  # noqa: T201
+    print(f"Per WFResult       : {per_result * 1e6:8.2f} usecs")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
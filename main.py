@@ -1,8 +1,11 @@
 """Main Module for running a workflow"""
 import argparse
+import json
 import logging
 import os
 import sqlite3
+import sys
+import time
 
 from pathlib import Path
 from typing import Literal
@@ -36,9 +39,7 @@ def parse_args():
     parser.add_argument(
         "--debug", action="store_true", default=False, help="using debug mode"
     )
-    parser.add_argument(
-        "-w", "--workflow", type=str, help="workflow name to run", required=True
-    )
+    parser.add_argument("-w", "--workflow", type=str, help="workflow name to run")
     parser.add_argument(
         "-o",
         "--owner",
@@ -53,6 +54,64 @@ def parse_args():
     parser.add_argument(
         "-t", "--transaction-id", type=str, help="transaction id to use"
     )
+    parser.add_argument(
+        "--commit-mode",
+        type=str,
+        choices=["step", "run", "batch"],
+        help="when the workflow state is committed to the DB [default: step, "
+        "batch with --batch-file]",
+    )
+    parser.add_argument(
+        "--dataflow",
+        action="store_true",
+        default=False,
+        help="run the independent steps in parallel (as per their input/outputs)",
+    )
+    parser.add_argument(
+        "--batch-file",
+        type=Path,
+        help="JSONL file of run requests [resume requests have a transaction_id]",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="number of workers for --batch-file"
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        default=False,
+        help="use worker processes (instead of threads) for --batch-file",
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        default=False,
+        help="queue the run (or resume, or the --batch-file requests) for the workers",
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        metavar="N",
+        help="run N worker processes on the work queue [0: one per CPU]",
+    )
+    parser.add_argument(
+        "--timers",
+        action="store_true",
+        default=False,
+        help="run the timer service that resumes/kills the waiting steps when due "
+        "[fired via the work queue with --enqueue]",
+    )
+    parser.add_argument(
+        "--cancel",
+        action="store_true",
+        default=False,
+        help="cancel the run given by -t [stops before its next step, if running]",
+    )
+    parser.add_argument(
+        "--import-report",
+        action="store_true",
+        default=False,
+        help="print the time taken to import the engine and the action modules",
+    )
     # args = parser.parse_args()
     args, extra_args = parser.parse_known_args()
 
@@ -61,6 +120,8 @@ def parse_args():
         k.replace("--", "").replace("-", "_"): v
         for k, v in zip(extra_args[::2], extra_args[1::2])
     }
+    if not args.workflow and args.serve is None and not args.timers:
+        parser.error("the following arguments are required: -w/--workflow")
     if args.verbose:
         print(f"Arguments = {args}, Extra = {extra_args}")  # noqa: T201
 
@@ -70,37 +131,14 @@ def parse_args():
 def initialize_sqlite(sqlite3_file: Path):
     sqlite3_file.parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(str(sqlite3_file))
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS wf_run (
-            id INTEGER PRIMARY KEY,
-            transaction_id INTEGER NOT NULL,
-            working_dir TEXT NOT NULL,
-            owner TEXT NOT NULL,
-            context TEXT NULLABLE,
-            status TEXT NOT NULL,
-            reason TEXT NULLABLE,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS wf_step_run (
-            wf_id INTEGER,
-            step_name TEXT NOT NULL,
-            input TEXT NULLABLE,
-            output TEXT NULLABLE,
-            status TEXT NOT NULL,
-            reason TEXT NULLABLE,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(wf_id, step_name)
-        )
-        """
-    )
+    # WAL lets readers proceed during writes; NORMAL only fsyncs at checkpoints
+    # which is still durable across application crashes in WAL mode.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # Importing here as the logging needs to be setup before importing wfengine
+    from wfengine.schema import migrate
+
+    migrate(conn)
     return conn
 
 
@@ -111,14 +149,102 @@ if __name__ == "__main__":
 
     args, extra_args = parse_args()
     initialize_logging(verbose=args.verbose, debug=args.debug)
-    sqlite3_dir = Path(os.environ["WF_ROOT_DIR"]) / "data" / "wf.sqlite3"
-    sql_conn = initialize_sqlite(sqlite3_dir)
 
     # Importing after Logging has been setup
+    start_time = time.perf_counter()
     import wfengine as wf
 
+    engine_import_ms = (time.perf_counter() - start_time) * 1000
+    sqlite3_dir = Path(os.environ["WF_ROOT_DIR"]) / "data" / "wf.sqlite3"
+    sql_conn = initialize_sqlite(sqlite3_dir)
+
+    if args.serve is not None:
+        # Run the workers till interrupted [SIGINT/SIGTERM]
+        from wfengine.worker import serve
+
+        sql_conn.close()
+        serve(
+            sqlite3_dir,
+            processes=args.serve or None,
+            commit_policy={"mode": args.commit_mode or "step"},
+            dataflow=args.dataflow,
+        )
+        sys.exit(0)
+
+    if args.timers:
+        # Fire the timers till interrupted [SIGINT/SIGTERM]
+        import signal
+
+        from wfengine.timers import TimerService
+        from wfengine.work_queue import WorkQueue
+
+        sql_conn.close()
+        timer_service = TimerService(
+            sqlite3_dir,
+            queue=WorkQueue(sqlite3_dir) if args.enqueue else None,
+            commit_policy={"mode": args.commit_mode or "step"},
+        )
+        signal.signal(signal.SIGINT, timer_service.stop)
+        signal.signal(signal.SIGTERM, timer_service.stop)
+        timer_service.serve()
+        sys.exit(0)
+
+    if args.batch_file and args.enqueue:
+        from wfengine.work_queue import MessageAction, WorkQueue
+
+        queue = WorkQueue(sqlite3_dir)
+        with args.batch_file.open() as batch_file:
+            for line in batch_file:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                transaction_id = request.pop("transaction_id", None)
+                message = queue.enqueue(
+                    MessageAction.CONTINUE if transaction_id else MessageAction.CREATE,
+                    args.workflow,
+                    request,
+                    transaction_id=transaction_id,
+                    owner=request.pop("owner", args.owner),
+                )
+                print(  # noqa: T201
+                    json.dumps(
+                        {
+                            "message_id": message.id,
+                            "transaction_id": message.transaction_id,
+                        },
+                        default=str,
+                    )
+                )
+        queue.close()
+        sys.exit(0)
+
+    if args.batch_file:
+        # Run the requests in the file, and print the results as they complete
+        from wfengine.batch import run_batch
+
+        sql_conn.close()
+        with args.batch_file.open() as batch_file:
+            requests = (json.loads(line) for line in batch_file if line.strip())
+            for result in run_batch(
+                args.workflow,
+                requests,
+                sqlite3_dir,
+                max_workers=args.workers,
+                processes=args.processes,
+                commit_policy={"mode": args.commit_mode or "batch"},
+                owner=args.owner,
+                metadata={"source": "cli"},
+                dataflow=args.dataflow,
+            ):
+                print(json.dumps(result, default=str))  # noqa: T201
+        sys.exit(0)
+
     orchestrator = wf.WFRunner.from_file(
-        args.workflow, sql_conn, metadata={"source": "cli", "owner": args.owner}
+        args.workflow,
+        sql_conn,
+        metadata={"source": "cli", "owner": args.owner},
+        commit_policy={"mode": args.commit_mode or "step"},
+        dataflow=args.dataflow,
     )
     # Hard-coding to reduce complexity in the cli invocation
     if args.workflow == "test_wf":
@@ -152,7 +278,35 @@ if __name__ == "__main__":
         del args.approvers
         del args.approved_by
 
-    if args.transaction_id:
+    if args.cancel:
+        if not args.transaction_id:
+            raise ValueError("Transaction ID (-t) must be provided to cancel")
+        result = orchestrator.cancel(args.transaction_id)
+        print(f"{result['status'].value}: {result['reason']}")  # noqa: T201
+    elif args.enqueue:
+        from wfengine.work_queue import MessageAction, WorkQueue
+
+        queue = WorkQueue(sqlite3_dir)
+        action = MessageAction.CONTINUE if args.transaction_id else MessageAction.CREATE
+        if args.transaction_id == "last":
+            args.transaction_id = orchestrator.get_last_transaction_id()
+        message = queue.enqueue(
+            action,
+            args.workflow,
+            extra_args,
+            transaction_id=args.transaction_id,
+            owner=orchestrator.owner,
+        )
+        queue.close()
+        print(f"Queued message {message.id} for {message.transaction_id}")  # noqa: T201
+    elif args.transaction_id:
         orchestrator.resume(transaction_id=args.transaction_id, **extra_args)
     else:
         orchestrator.run(**extra_args)
+
+    if args.import_report:
+        # Use `python -X importtime main.py ...` for the per-module breakdown
+        from wfengine.base_runner import BaseRunner
+
+        print(f"Engine import time: {engine_import_ms:.2f} ms")  # noqa: T201
+        print(BaseRunner.import_report())  # noqa: T201
@@ -0,0 +1,122 @@
+"""Tests for the pooled connections of the SQL actions."""
+import threading
+import time
+
+from unittest import mock
+
+import pytest
+
+from wfengine.actions.basic_actions import SqlRunner
+from wfengine.actions.sql_pool import ConnectionPool, close_pools, iter_rows
+from wfengine.base_runner import RunStatus
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    db_url = f"sqlite:///{tmp_path}/sql.db"
+    with ConnectionPool(db_url).connection() as conn:
+        conn.execute("CREATE TABLE t (x INTEGER UNIQUE)")
+    yield db_url
+    close_pools()
+
+
+def rows(db_url):
+    with ConnectionPool(db_url).connection() as conn:
+        return [row["x"] for row in iter_rows(conn, "SELECT x FROM t ORDER BY x")]
+
+
+def test_checkout_waits_for_a_release_then_times_out(db_url):
+    pool = ConnectionPool(db_url, max_size=2, timeout=0.2)
+    first, second = pool.acquire(), pool.acquire()
+    assert pool.stats() == {"size": 2, "idle": 0}
+
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    assert time.monotonic() - started >= 0.2
+
+    # A waiting checkout gets the connection that is released
+    threading.Timer(0.05, pool.release, [first]).start()
+    assert pool.acquire() is first
+    pool.release(first)
+    pool.release(second)
+    assert pool.stats() == {"size": 2, "idle": 2}
+
+
+def test_idle_connections_are_evicted(db_url):
+    pool = ConnectionPool(db_url, max_size=2, idle_timeout=0.05)
+    with pool.connection():
+        pass
+    assert pool.stats() == {"size": 1, "idle": 1}
+
+    time.sleep(0.1)
+    with pool.connection():
+        # The idle connection is closed; a new one is opened
+        assert pool.stats() == {"size": 1, "idle": 0}
+
+
+class RecordingCursor(object):
+    """Cursor that records the number of rows of each fetch"""
+
+    def __init__(self, cursor, fetched):
+        self.cursor, self.fetched = cursor, fetched
+        self.description = cursor.description
+
+    def fetchmany(self, size):
+        rows = self.cursor.fetchmany(size)
+        self.fetched.append(len(rows))
+        return rows
+
+    def close(self):
+        self.cursor.close()
+
+
+def test_rows_are_streamed_fetch_size_at_a_time(db_url):
+    fetched = []
+    with ConnectionPool(db_url).connection() as conn:
+        conn.executemany("INSERT INTO t VALUES (?)", [[x] for x in range(10)])
+        stream = iter_rows(
+            mock.Mock(
+                execute=lambda *args: RecordingCursor(conn.execute(*args), fetched)
+            ),
+            "SELECT x FROM t ORDER BY x",
+            fetch_size=3,
+        )
+        assert next(stream) == {"x": 0}
+        assert fetched == [3]
+        assert [row["x"] for row in stream] == list(range(1, 10))
+    assert fetched == [3, 3, 3, 1, 0]
+
+
+def test_batch_run_fail_fast_rolls_back_the_batch(db_url):
+    result = SqlRunner().batch_run(
+        db_url=db_url,
+        inputs=[
+            "INSERT INTO t VALUES (1)",
+            {"query": "INSERT INTO t VALUES (?)", "params": [2]},
+            "INSERT INTO t VALUES (1)",  # Duplicate
+        ],
+        error_mode="fail_fast",
+    )
+    assert result["status"] == RunStatus.FAILED
+    assert result["reason"].startswith("Query [2] failed")
+    assert rows(db_url) == []
+
+
+def test_batch_run_collect_all_rolls_back_the_failed_query(db_url):
+    result = SqlRunner().batch_run(
+        db_url=db_url,
+        inputs=[
+            "INSERT INTO t VALUES (1)",
+            "INSERT INTO t VALUES (1)",  # Duplicate
+            "INSERT INTO t VALUES (2)",
+        ],
+        error_mode="collect_all",
+    )
+    assert result["status"] == RunStatus.FAILED
+    assert [r["status"] for r in result["results"]] == [
+        RunStatus.COMPLETED,
+        RunStatus.FAILED,
+        RunStatus.COMPLETED,
+    ]
+    assert rows(db_url) == [1, 2]
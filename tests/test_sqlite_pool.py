@@ -0,0 +1,116 @@
+"""Tests for the group commit of the SqlitePool writer."""
+import sqlite3
+import threading
+
+import pytest
+
+from wfengine.commit_policy import CommitPolicy
+from wfengine.stores.sqlite_pool import SqlitePool
+
+
+def make_pool(tmp_path, mode: str) -> SqlitePool:
+    pool = SqlitePool(tmp_path / "wf.db", CommitPolicy(mode=mode))
+    pool.write(
+        lambda conn: conn.execute("CREATE TABLE t (x INTEGER UNIQUE)"), durable=True
+    )
+    return pool
+
+
+def rows(pool: SqlitePool):
+    return pool.read(lambda conn: conn.execute("SELECT x FROM t ORDER BY x").fetchall())
+
+
+def insert(*values):
+    def job(conn):
+        for value in values:
+            conn.execute("INSERT INTO t VALUES (?)", [value])
+
+    return job
+
+
+def test_failed_job_in_a_group_is_rolled_back_alone(tmp_path):
+    pool = make_pool(tmp_path, "step")
+    started, release = threading.Event(), threading.Event()
+
+    def blocker(conn):
+        started.set()
+        release.wait(5)
+
+    def failing(conn):
+        conn.execute("INSERT INTO t VALUES (2)")
+        raise ValueError("halfway")
+
+    errors = {}
+
+    def write(name, job):
+        try:
+            pool.write(job)
+        except Exception as e:
+            errors[name] = e
+
+    threads = [threading.Thread(target=write, args=("blocker", blocker))]
+    threads[0].start()
+    assert started.wait(5)
+    # Queued while the writer is busy; drained and committed as one group
+    for name, job in [("a", insert(1)), ("b", failing), ("c", insert(3))]:
+        threads.append(threading.Thread(target=write, args=(name, job)))
+        threads[-1].start()
+    while pool._queue.qsize() < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert list(errors) == ["b"] and isinstance(errors["b"], ValueError)
+    assert rows(pool) == [(1,), (3,)]
+    pool.close()
+
+
+@pytest.mark.parametrize("mode", ["run", "batch"])
+def test_commit_failure_is_raised_by_the_next_write(tmp_path, mode):
+    pool = make_pool(tmp_path, mode)
+    pool.write(insert(1))  # Acknowledged, but not committed
+
+    flush = pool.commit_policy.flush
+    calls = []
+
+    def failing_flush(conn):
+        if not calls:
+            calls.append(conn)
+            raise sqlite3.OperationalError("disk I/O error")
+        return flush(conn)
+
+    object.__setattr__(pool.commit_policy, "flush", failing_flush)
+    errors = []
+
+    def durable_write():
+        try:
+            pool.write(insert(2), durable=True)
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    other = threading.Thread(target=durable_write)
+    other.start()
+    other.join(5)
+    assert errors  # The durable write of the failed commit
+
+    # The write of this thread was rolled back too; Reported on its next write
+    with pytest.raises(sqlite3.OperationalError, match="disk I/O error"):
+        pool.write(insert(3))
+    pool.write(insert(4), durable=True)
+    assert rows(pool) == [(4,)]
+    pool.close()
+
+
+def test_lock_is_released_after_an_all_failed_group(tmp_path):
+    pool = make_pool(tmp_path, "step")
+    pool.write(insert(1))
+    with pytest.raises(sqlite3.IntegrityError):
+        pool.write(insert(1))
+
+    other = sqlite3.connect(tmp_path / "wf.db", timeout=0.1, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")  # Fails with "database is locked" if held
+    other.execute("ROLLBACK")
+    other.close()
+    assert rows(pool) == [(1,)]
+    pool.close()
@@ -0,0 +1,41 @@
+"""Tests for the delta checkpoints of the SqliteStore."""
+import sqlite3
+from uuid import uuid4
+
+import pytest
+
+from wfengine.base_runner import RunStatus
+from wfengine.schema import migrate
+from wfengine.stores.sqlite_store import SqliteStore
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / "wf.db")
+    migrate(conn)
+    yield conn
+    conn.close()
+
+
+def test_value_changed_in_place_is_checkpointed(conn, tmp_path):
+    store = SqliteStore(sql_conn=conn, commit_policy={"mode": "step"})
+    transaction_id, context = uuid4(), {"items": [1], "meta": {"a": 1}}
+    store.create_run(transaction_id, tmp_path, "me", RunStatus.STARTED, "", context)
+    store.update_run(transaction_id, RunStatus.STARTED, "", context)
+
+    context["items"].append(2)
+    context["meta"]["b"] = 2
+    store.update_run(transaction_id, RunStatus.WAITING, "", context)
+
+    # A new store; The context is restored from the checkpoints in the DB
+    run = SqliteStore(sql_conn=conn).get_run(transaction_id)
+    assert run["context"] == {"items": [1, 2], "meta": {"a": 1, "b": 2}}
+
+
+def test_unchanged_context_writes_no_checkpoint(conn, tmp_path):
+    store = SqliteStore(sql_conn=conn, commit_policy={"mode": "step"})
+    transaction_id, context = uuid4(), {"items": [1]}
+    store.create_run(transaction_id, tmp_path, "me", RunStatus.STARTED, "", context)
+    store.update_run(transaction_id, RunStatus.STARTED, "", {"items": [1]})
+
+    assert conn.execute("SELECT COUNT(*) FROM wf_checkpoint").fetchone()[0] == 0
@@ -1,7 +1,17 @@
 """Export the public API of the wfengine package."""
+import importlib
 
-# Export all actions defined in the sub-package
-from .actions import *  # noqa: F401, F403
+from .version import __version__  # noqa: F401
 
 # Export the WFRunner class
 from .wf_runner import WFRunner  # noqa: F401
+
+
+def __getattr__(name: str):
+    # Export the stores and all the actions defined in the sub-packages
+    # [imported on first access]
+    for package in (".stores", ".actions"):
+        module = importlib.import_module(package, __name__)
+        if name in module.__all__:
+            return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
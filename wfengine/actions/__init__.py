@@ -1,26 +1,24 @@
-from .ap_actions import ErpRunner, ExtractPdfRunner, PaymentRunner
-from .basic_actions import (
-    ApprovalRunner,
-    DelayActionRunner,
-    ForkActionRunner,
-    FunctionRunner,
-    MultiActionRunner,
-    NotificationRunner,
-    SearchRunner,
-    SqlRunner,
-)
+"""
+The builtin actions. The action modules are imported lazily [on first access]
+so that importing the package (or running a workflow that uses only a few of
+the actions) does not pay for importing all of them.
+"""
+import importlib
+
+from wfengine.base_runner import BUILTIN_ACTION_MODULES
 
 __all__ = [
-    "ApprovalRunner",
-    "DelayActionRunner",
-    "ForkActionRunner",
-    "FunctionRunner",
-    "MultiActionRunner",
-    "NotificationRunner",
-    "SearchRunner",
-    "SqlRunner",
-    "ApprovalRunner",
-    "ExtractPdfRunner",
-    "PaymentRunner",
-    "ErpRunner",
+    name
+    for name, module_name in BUILTIN_ACTION_MODULES.items()
+    if module_name.startswith(f"{__name__}.")
 ]
+
+
+def __getattr__(name: str):
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(BUILTIN_ACTION_MODULES[name]), name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,10 +1,12 @@
 """Actions pertaining to the Accounts Payable Workflow."""
 
 import logging
+import time
 
 from typing import Any, Dict, List
 
 from wfengine.base_runner import ActionRegister, BaseRunner, RunStatus
+from wfengine.documents import Document, document_cache, resolve_document
 
 logger = logging.getLogger(__name__)
 
@@ -13,7 +15,9 @@ logger = logging.getLogger(__name__)
 class ExtractPdfRunner(BaseRunner):
     """
     Run PDF Extraction Action: Use pytesseract for OCR and PDFMiner
-    to extract text from the PDF.
+    to extract text from the PDF. The PDF (in the transaction working dir) is
+    memory mapped, and the extracted data is cached by the document content
+    [see DocumentCache]; So a document is extracted once across transactions.
     """
 
     def input_keys(self) -> Dict[str, str]:
@@ -25,6 +29,24 @@ class ExtractPdfRunner(BaseRunner):
     def run(self, **kwargs) -> Dict[str, Any]:
         """Run the extract action."""
         document_type = kwargs.get("document_type")
+        path = resolve_document(kwargs.get("pdf_file"), kwargs.get("working_dir"))
+        if path is None:
+            return self.extract(document_type, None)
+
+        cache = document_cache()
+        with Document(path) as document:
+            data = cache.get(document.digest, str(document_type))
+            if data is not None:
+                return {"data": data, "status": RunStatus.COMPLETED}
+            started = time.perf_counter()
+            result = self.extract(document_type, document)
+            if result["status"] == RunStatus.COMPLETED:
+                secs = time.perf_counter() - started
+                cache.put(document.digest, str(document_type), result["data"], secs)
+        return result
+
+    def extract(self, document_type: str, document: Document | None) -> Dict[str, Any]:
+        """Extract the data from the document [None: the PDF was not found]"""
         if document_type == "INVOICE":
             invoice_data = {"po_number": 123, "inv_amount": 1235.00}
             logger.info(f"Extracted Invoice: {invoice_data}")
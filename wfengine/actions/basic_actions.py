@@ -2,9 +2,16 @@
 
 import logging
 import random
+import sqlite3
+import time
 
-from typing import Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from enum import Enum
+from functools import partial
+from string import Formatter
+from typing import Any, Callable, Dict, List, Set, Tuple
 
+from wfengine.actions.sql_pool import get_pool, iter_query, iter_rows
 from wfengine.base_runner import ActionRegister, BaseRunner, RunStatus
 
 logger = logging.getLogger(__name__)
@@ -35,7 +42,11 @@ class SearchRunner(BaseRunner):
 
 @ActionRegister(label="Run SQL Actions")
 class SqlRunner(BaseRunner):
-    """Run SQL Action: Run the given SQL statement."""
+    """
+    Run SQL Action: Run the given SQL statement on the database [`db_url`] using
+    the pooled connections [see sql_pool]. Sample rows are returned if there is
+    no `db_url`. The queries of a MultiActionRunner are run in one transaction.
+    """
 
     def input_keys(self) -> Dict[str, str]:
         return {
@@ -49,49 +60,212 @@ class SqlRunner(BaseRunner):
     def run(self, **kwargs) -> Dict[str, Any]:
         """Run the SQL action."""
         query = kwargs.get("query")
-        logger.info(f"SQL Action: {query} // {kwargs}")
+        db_url = kwargs.get("db_url")
+        # NOTE: The db_url is not logged [it includes the password]
+        logger.info(f"SQL Action: {query}")
+        if not db_url:
+            return {
+                "query_result": [{"a": 1, "b": 2}, {"a": 2, "b": 3}],
+                "status": RunStatus.COMPLETED,
+            }
+
+        try:
+            rows = list(iter_query(db_url, query, kwargs.get("params")))
+        except sqlite3.Error as e:
+            return {"query_result": [], "status": RunStatus.FAILED, "reason": str(e)}
+        return {"query_result": rows, "status": RunStatus.COMPLETED}
+
+    def batch_run(self, **kwargs) -> Dict[str, Any] | None:
+        """
+        Run the queries [`inputs`] in one transaction on a pooled connection. On
+        a failure, all the queries are rolled back [fail_fast] or only the failed
+        query [collect_all; each query is run in a savepoint].
+        """
+        db_url = kwargs.get("db_url")
+        if not db_url:
+            return None  # Sample rows; nothing to batch
+
+        queries = kwargs.get("inputs") or []
+        error_mode = ErrorMode(kwargs.get("error_mode") or ErrorMode.FAIL_FAST)
+        collect_all = error_mode == ErrorMode.COLLECT_ALL
+        logger.info(f"SQL Batch: {len(queries)} queries in one transaction")
+        results: List[Dict[str, Any]] = []
+        failed: List[int] = []
+        with get_pool(db_url).connection() as conn:
+            conn.execute("BEGIN")
+            for i, query in enumerate(queries):
+                if isinstance(query, dict):
+                    query, params = query.get("query"), query.get("params")
+                else:
+                    params = kwargs.get("params")
+                try:
+                    if collect_all:
+                        conn.execute("SAVEPOINT wf_query")
+                    rows = list(iter_rows(conn, query, params))
+                    if collect_all:
+                        conn.execute("RELEASE wf_query")
+                except sqlite3.Error as e:
+                    if not collect_all:
+                        conn.rollback()
+                        return {
+                            "results": [],
+                            "status": RunStatus.FAILED,
+                            "reason": f"Query [{i}] failed: {e}",
+                        }
+                    conn.execute("ROLLBACK TO wf_query")
+                    conn.execute("RELEASE wf_query")
+                    logger.error(f"Query [{i}] failed: {e}")
+                    failed.append(i)
+                    results.append(
+                        {
+                            "query_result": [],
+                            "status": RunStatus.FAILED,
+                            "reason": str(e),
+                        }
+                    )
+                    continue
+                result: Dict[str, Any] = {"query_result": rows}
+                if collect_all:
+                    result.update(status=RunStatus.COMPLETED, reason="Query completed")
+                results.append(result)
+            conn.commit()
+
+        if failed:
+            return {
+                "results": results,
+                "status": RunStatus.FAILED,
+                "reason": f"{len(failed)} of {len(queries)} actions failed: {failed}",
+            }
         return {
-            "query_result": [{"a": 1, "b": 2}, {"a": 2, "b": 3}],
+            "results": results,
             "status": RunStatus.COMPLETED,
+            "reason": f"{len(queries)} queries run in one transaction",
         }
 
 
+class ErrorMode(str, Enum):
+    """How the failure of one of the actions run in parallel is handled"""
+
+    FAIL_FAST = "fail_fast"  # Cancel the outstanding actions on the first failure
+    COLLECT_ALL = "collect_all"  # Run all the actions, and report per-item statuses
+
+
+DEFAULT_MAX_CONCURRENCY = 8
+"""The default number of actions run in parallel by the MultiActionRunner."""
+
+
 @ActionRegister(label="Run an action on multiple inputs")
 class MultiActionRunner(BaseRunner):
-    """Run the same action on multiple inputs."""
+    """
+    Run the same action on multiple inputs. The actions are run in parallel in a
+    thread pool [optional parameters `max_concurrency`, and `error_mode`: one of
+    fail_fast or collect_all]. The results are returned in the input order.
+    """
 
     def input_keys(self) -> Dict[str, str]:
+        # NOTE: max_concurrency and error_mode are optional parameters.
         return {"action": "Action to execute", "inputs": "Inputs to operate on"}
 
     def output_keys(self) -> List:
         return ["results"]
 
+    def context_keys(self, parameters: Dict[str, Any]) -> Set[str] | None:
+        # The inputs of the action run for each of the inputs [e.g. the db_url]
+        action = parameters.get("action")
+        if not action:
+            return None
+        runner = self.get_action(action)
+        action_keys = runner.context_keys(parameters)
+        if action_keys is None:
+            return None
+        return {"max_concurrency", "error_mode", *runner.input_keys(), *action_keys}
+
     def run(self, **kwargs):  # -> Dict[str, Any]:
         """Run the Multi action."""
         logger.info(f"Multi Action: {kwargs}")
         action = kwargs.get("action")
         inputs = kwargs.get("inputs")
-        results = []
-        for input in inputs:
-            # TODO: Need to run these asynchronously (so that they are run in parallel)
-            action_instance = self.get_action(action)
-            # TODO: Need input mapping here and possibly output mapping as well... for query
-            result = action_instance.run(query=input, **kwargs)
-            status = result.pop("status", RunStatus.UNKNOWN)
-            reason = result.pop("reason", "Step status is unknown")
-            if status.not_successful():
-                return {
-                    "results": results,
-                    "status": status,
-                    "reason": f"Action {action} failed: {result}",
-                }
-            results.append(result)
-        return {"results": results, "status": status, "reason": reason}
+        runner = self.get_action(action)
+        # Actions that can run all the inputs together [e.g. SQL in one transaction]
+        result = runner.batch_run(**kwargs)
+        if result is not None:
+            return result
+        # TODO: Need input mapping here and possibly output mapping as well... for query
+        calls = [
+            (action, partial(runner.run, query=input, **kwargs)) for input in inputs
+        ]
+        return self.run_parallel(calls, **kwargs)
+
+    def run_parallel(
+        self, calls: List[Tuple[str, Callable[[], Dict[str, Any]]]], **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Run the (action name, callable) pairs in a thread pool, and return the
+        results in the same order as the calls.
+        """
+        max_concurrency = int(kwargs.get("max_concurrency") or DEFAULT_MAX_CONCURRENCY)
+        error_mode = ErrorMode(kwargs.get("error_mode") or ErrorMode.FAIL_FAST)
+        results: List[Dict[str, Any] | None] = [None] * len(calls)
+        statuses: List[RunStatus] = [RunStatus.UNKNOWN] * len(calls)
+        reasons: List[str] = ["Step status is unknown"] * len(calls)
+        failure: Dict[str, Any] | None = None
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_concurrency, len(calls))),
+            thread_name_prefix="wf-multi",
+        ) as executor:
+            futures = {executor.submit(func): i for i, (_, func) in enumerate(calls)}
+            for future in as_completed(futures):
+                i = futures[future]
+                action = calls[i][0]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if error_mode == ErrorMode.FAIL_FAST:
+                        for pending in futures:
+                            pending.cancel()
+                        raise e
+                    logger.error(f"Action {action} [{i}] failed: {e}")
+                    result = {"status": RunStatus.FAILED, "reason": str(e)}
+                statuses[i] = result.pop("status", RunStatus.UNKNOWN)
+                reasons[i] = result.pop("reason", reasons[i])
+                if error_mode == ErrorMode.COLLECT_ALL:
+                    results[i] = {**result, "status": statuses[i], "reason": reasons[i]}
+                elif statuses[i].not_successful():
+                    # Outstanding actions that have not started are cancelled
+                    for pending in futures:
+                        pending.cancel()
+                    failure = {
+                        "status": statuses[i],
+                        "reason": f"Action {action} failed: {result}",
+                    }
+                    break
+                else:
+                    results[i] = result
+
+        completed = [r for r in results if r is not None]
+        if failure:
+            return {"results": completed, **failure}
+
+        failed = [i for i, status in enumerate(statuses) if status.not_successful()]
+        if failed:
+            return {
+                "results": completed,
+                "status": statuses[failed[0]],
+                "reason": f"{len(failed)} of {len(calls)} actions failed: {failed}",
+            }
+        # Status of the last action [as when the actions were run sequentially]
+        if not calls:
+            return {"results": [], "status": RunStatus.COMPLETED, "reason": "No inputs"}
+        return {"results": completed, "status": statuses[-1], "reason": reasons[-1]}
 
 
 @ActionRegister(label="Fork Actions")
 class ForkActionRunner(MultiActionRunner):
-    """Fork Action: Allow for forking and joining of workflows."""
+    """
+    Fork Action: Run different actions (by name) in parallel, each with its own
+    inputs. [Parallel branches of steps are defined using `fork`/`join` steps]
+    """
 
     def input_keys(self) -> Dict[str, str]:
         return {"actions": "Actions to execute", "inputs": "Inputs to operate on"}
@@ -109,26 +283,27 @@ class ForkActionRunner(MultiActionRunner):
         if len(actions) != len(inputs):
             raise ValueError("Number of actions and inputs must be same")
 
-        results = []  # type: ignore
-        for action, input in zip(actions, inputs):
-            # TODO: Need to run these asynchronously (so that they are run in parallel)
-            result = action.run(input)
-            status = result.pop("status", RunStatus.UNKNOWN)
-            reason = result.pop("reason", "Step status is unknown")
-            if status.not_successful():
-                return {
-                    "results": results,
-                    "status": status,
-                    "reason": f"Action {action} failed: {result}",
-                }
-            results.append(result)
-        return {"results": results, "status": status, "reason": reason}
+        params = {k: v for k, v in kwargs.items() if k not in ["actions", "inputs"]}
+        calls = [
+            (
+                action,
+                partial(
+                    self.get_action(action).run,
+                    **params,
+                    **(input if isinstance(input, dict) else {"input": input}),
+                ),
+            )
+            for action, input in zip(actions, inputs)
+        ]
+        return self.run_parallel(calls, **kwargs)
 
 
 @ActionRegister(label="Delay Actions")
 class DelayActionRunner(BaseRunner):
     """Delay Action: Allow for introducing a delay in the workflow execution."""
 
+    may_wait = True
+
     def input_keys(self) -> Dict[str, str]:
         return {"delay": "Delay in seconds"}
 
@@ -136,10 +311,20 @@ class DelayActionRunner(BaseRunner):
         return []
 
     def run(self, **kwargs) -> Dict[str, Any]:
-        """Run the Delay action."""
-        # TODO: Cannot sleep for 1 day... Need to setup a time based trigger!
+        """Run the Delay action. The step is resumed by a timer [see TimerService]"""
+        delay = float(kwargs.get("delay") or 0)
         logger.info(f"Delay Action: {kwargs}")
-        return {"status": RunStatus.WAITING}
+        if delay <= 0:
+            return {"status": RunStatus.COMPLETED, "reason": "No delay"}
+        return {
+            "status": RunStatus.WAITING,
+            "resume_at": time.time() + delay,
+            "reason": f"Waiting for {delay} secs",
+        }
+
+    def resume(self, **kwargs) -> Dict[str, Any]:
+        """Resume the workflow [when the delay has elapsed]"""
+        return {"status": RunStatus.COMPLETED, "reason": "Delay completed"}
 
 
 @ActionRegister(label="Notification Actions")
@@ -152,6 +337,9 @@ class NotificationRunner(BaseRunner):
         # return {"recipients": "Email IDs of recipients"}
         return {}
 
+    def context_keys(self, parameters: Dict[str, Any]) -> Set[str] | None:
+        return {"recipients"}
+
     def output_keys(self) -> List:
         return []
 
@@ -168,6 +356,8 @@ class NotificationRunner(BaseRunner):
 class ApprovalRunner(BaseRunner):
     """Approval Action: Allow for getting approvals during a workflow execution."""
 
+    may_wait = True
+
     def input_keys(self) -> Dict[str, str]:
         return {
             "approvers": "Approver Email IDs",
@@ -180,16 +370,23 @@ class ApprovalRunner(BaseRunner):
     def output_keys(self) -> List:
         return []
 
+    def context_keys(self, parameters: Dict[str, Any]) -> Set[str] | None:
+        # Set by the resume [approved_by] and the previous run [pending_approvers]
+        return {"approved_by", "pending_approvers"}
+
     def run(self, **kwargs) -> Dict[str, Any]:
         """Run the Approval action. Wait for the approval to be completed via Email/UI."""
         approvers = kwargs.get("approvers")
         if approvers:
             logger.info(f"Waiting for approval from {approvers}: {kwargs}")
+            timeout = kwargs.get("timeout")
             return {
                 "status": RunStatus.WAITING,
                 "approved": False,
                 "pending_approvers": approvers,
                 "reason": "Waiting for approval",
+                # The run is killed if not approved in time [see TimerService]
+                "timeout_at": time.time() + float(timeout) if timeout else None,
             }
         else:
             return {
@@ -202,7 +399,6 @@ class ApprovalRunner(BaseRunner):
     def resume(self, **kwargs) -> Dict[str, Any]:
         """Resume the workflow with the transaction_id"""
         # TODO: Handle escalations, rejections, etc.
-        # Timeout will need to be handled by an external trigger
         logger.info(f"Approval Action: {kwargs}")
         approved_by = kwargs.get("approved_by")
         pending_approvers = kwargs.get("pending_approvers", [])
@@ -220,16 +416,41 @@ class ApprovalRunner(BaseRunner):
         }
 
 
+NON_DETERMINISTIC_FUNCS = {"gen_rand"}
+"""The functions whose results must not be cached"""
+
+
 @ActionRegister(label="Run General Function Actions")
 class FunctionRunner(BaseRunner):
     """Run General Function Actions"""
 
+    cacheable = True
+
     def input_keys(self) -> Dict[str, str]:
         return {"func": "Function to execute", "input": "Input to operate on"}
 
     def output_keys(self) -> List:
         return ["func_result"]
 
+    def context_keys(self, parameters: Dict[str, Any]) -> Set[str] | None:
+        if parameters.get("func") != "format":
+            return set()
+        # The fields of the template [e.g. `{input}`, `{data[name]}`]
+        template = parameters.get("template")
+        if not isinstance(template, str):
+            return None
+        fields = [field for _, field, _, _ in Formatter().parse(template) if field]
+        return {field.split(".")[0].split("[")[0] for field in fields}
+
+    def cache_inputs(self, **kwargs) -> Dict[str, Any] | None:
+        func = kwargs.get("func")
+        if func in NON_DETERMINISTIC_FUNCS:
+            return None
+        if func == "format":
+            # The template can refer to any of the inputs
+            return super().cache_inputs(**kwargs)
+        return {"func": func, "input": kwargs.get("input")}
+
     def run(self, **kwargs) -> Dict[str, Any]:
         """Run the function."""
         func = kwargs.get("func")
@@ -0,0 +1,179 @@
+"""
+Connection pools for the SQL actions, keyed by the database URL. SQLite is the
+reference backend [`sqlite:///<path>`]; other databases need their driver.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = int(os.getenv("WF_SQL_POOL_SIZE", "4"))
+"""Max. connections per database URL [WF_SQL_POOL_SIZE]"""
+
+DEFAULT_IDLE_TIMEOUT = float(os.getenv("WF_SQL_POOL_IDLE", "300"))
+"""Secs after which an idle connection is closed [WF_SQL_POOL_IDLE]"""
+
+DEFAULT_FETCH_SIZE = 500
+"""Rows fetched at a time by the query iterators"""
+
+
+def connect(db_url: str) -> sqlite3.Connection:
+    """Open a connection [autocommit; the transactions are explicit]"""
+    scheme, _, path = db_url.partition("://")
+    if scheme != "sqlite":
+        raise ValueError(f"Unsupported database URL scheme: {scheme}")
+    # sqlite:///relative.db, sqlite:////absolute.db or sqlite:// [in memory]
+    path = path[1:] if path.startswith("/") else path
+    return sqlite3.connect(
+        path or ":memory:",
+        timeout=30.0,
+        isolation_level=None,
+        check_same_thread=False,  # Used by one thread at a time [see the pool]
+    )
+
+
+class ConnectionPool(object):
+    """
+    Pool of (up to `max_size`) connections to a database. The idle connections
+    are re-used (most recently used first) and closed after `idle_timeout` secs.
+    When all the connections are in use, `connection` waits for up to `timeout`
+    secs for one to be released.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        max_size: int = DEFAULT_POOL_SIZE,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        timeout: float = 30.0,
+    ) -> None:
+        self.db_url = db_url
+        self.max_size = max(1, max_size)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle: List[Tuple[float, sqlite3.Connection]] = []
+        self._size = 0  # Open connections [idle + in use]
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Check out a connection; any open transaction is rolled back on release"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def acquire(self) -> sqlite3.Connection:
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                self.evict_idle()
+                if self._idle:
+                    return self._idle.pop()[1]
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"No free connection in {self.timeout} secs [{self.max_size}]"
+                    )
+                self._cond.wait(remaining)
+        try:
+            return connect(self.db_url)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            self._idle.append((time.monotonic(), conn))
+            self._cond.notify()
+
+    def evict_idle(self) -> None:
+        """Close the connections idle for more than `idle_timeout` [lock held]"""
+        expired_at = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][0] < expired_at:
+            _, conn = self._idle.pop(0)
+            conn.close()
+            self._size -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle)}
+
+    def close(self) -> None:
+        """Close the idle connections [the ones in use are closed on release]"""
+        with self._cond:
+            for _, conn in self._idle:
+                conn.close()
+            self._size -= len(self._idle)
+            self._idle.clear()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_url: str) -> ConnectionPool:
+    """The (process-wide) pool for the database URL"""
+    with _pools_lock:
+        pool = _pools.get(db_url)
+        if pool is None:
+            pool = _pools[db_url] = ConnectionPool(db_url)
+        return pool
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+
+def iter_rows(
+    conn: sqlite3.Connection,
+    query: str,
+    params: Sequence[Any] | Dict[str, Any] | None = None,
+    fetch_size: int = DEFAULT_FETCH_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """Stream the rows of the query [as dicts], `fetch_size` rows at a time"""
+    cursor = conn.execute(query, params or [])
+    try:
+        columns = [column[0] for column in cursor.description or []]
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(columns, row))
+    finally:
+        cursor.close()
+
+
+def iter_query(
+    db_url: str,
+    query: str,
+    params: Sequence[Any] | Dict[str, Any] | None = None,
+    fetch_size: int = DEFAULT_FETCH_SIZE,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the rows of the query on a pooled connection. The connection is held
+    till the iterator is exhausted (or closed); use `contextlib.closing` if the
+    iteration may stop early.
+    """
+    with get_pool(db_url).connection() as conn:
+        yield from iter_rows(conn, query, params, fetch_size)
@@ -1,16 +1,45 @@
 """Base Runner module; Can be a workflow or an action (step)."""
 from __future__ import annotations
 
+import importlib
 import logging
+import sys
+import time
 
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import Any, ClassVar, Dict, List, Type
+from importlib.metadata import entry_points
+from typing import Any, ClassVar, Dict, List, Set, Type
 
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
+ACTION_ENTRY_POINT_GROUP = "wfengine.actions"
+"""
+Entry point group for third party actions. The entry point name is the action
+key and the value is the `module:ClassName` that defines it. For example:
+[project.entry-points."wfengine.actions"]
+OcrRunner = "acme_actions.ocr:OcrRunner"
+"""
+
+BUILTIN_ACTION_MODULES: Dict[str, str] = {
+    "SearchRunner": "wfengine.actions.basic_actions",
+    "SqlRunner": "wfengine.actions.basic_actions",
+    "MultiActionRunner": "wfengine.actions.basic_actions",
+    "ForkActionRunner": "wfengine.actions.basic_actions",
+    "DelayActionRunner": "wfengine.actions.basic_actions",
+    "NotificationRunner": "wfengine.actions.basic_actions",
+    "ApprovalRunner": "wfengine.actions.basic_actions",
+    "FunctionRunner": "wfengine.actions.basic_actions",
+    "ExtractPdfRunner": "wfengine.actions.ap_actions",
+    "VerifyInvoiceRunner": "wfengine.actions.ap_actions",
+    "ErpRunner": "wfengine.actions.ap_actions",
+    "PaymentRunner": "wfengine.actions.ap_actions",
+    "WFRunner": "wfengine.wf_runner",
+}
+"""The modules defining the builtin actions; imported only when first used."""
+
 
 class RunStatus(str, Enum):
     """Step Status"""
@@ -51,6 +80,27 @@ class ActionRegister(object):
 
 class BaseRunner(BaseModel, ABC):
     actions: ClassVar[Dict[str, Dict[str, Any]]] = {}
+    """The registered (imported) actions"""
+
+    action_modules: ClassVar[Dict[str, str]] = dict(BUILTIN_ACTION_MODULES)
+    """Action key -> module that defines it [for the lazily imported actions]"""
+
+    import_times: ClassVar[Dict[str, float]] = {}
+    """Module -> Time (secs) taken to import the action module"""
+
+    _entry_points_loaded: ClassVar[bool] = False
+
+    may_wait: ClassVar[bool] = False
+    """
+    True if the action can return WAITING [i.e. suspend the workflow]. Such steps
+    are never run ahead of the preceding steps by the dataflow scheduler.
+    """
+
+    cacheable: ClassVar[bool] = False
+    """
+    True if the action is deterministic; i.e. its (successful) outputs can be
+    reused for the same inputs [see StepCache]. Steps can override this.
+    """
 
     @property
     def name(self):
@@ -77,9 +127,48 @@ class BaseRunner(BaseModel, ABC):
         """Resume the workflow with the transaction_id"""
         raise NotImplementedError("Resumption is not supported")
 
+    async def arun(self, **kwargs) -> Dict[str, Any]:
+        """
+        Run the workflow or step/action [async]. By default, the (sync) `run` is
+        offloaded to a worker thread; I/O bound actions can override this.
+        """
+        # NOTE: asyncio is imported here [and in the other coroutines] as it is
+        # slow to import and only needed (already loaded) on an event loop
+        import asyncio
+
+        return await asyncio.to_thread(self.run, **kwargs)
+
+    async def aresume(self, **kwargs) -> Dict[str, Any]:
+        """Resume the workflow with the transaction_id [async]"""
+        import asyncio
+
+        return await asyncio.to_thread(self.resume, **kwargs)
+
+    def context_keys(self, parameters: Dict[str, Any]) -> Set[str] | None:
+        """
+        The (optional) workflow variables read by the action, besides its input
+        keys [e.g. set on resume]. None if it may read any of the variables.
+        """
+        return set()
+
+    def batch_run(self, **kwargs) -> Dict[str, Any] | None:
+        """
+        Run the action on all the `inputs` together [e.g. in one transaction], for
+        the MultiActionRunner. None if not supported; the inputs are run one by one.
+        """
+        return None
+
+    def cache_inputs(self, **kwargs) -> Dict[str, Any] | None:
+        """
+        The inputs that determine the outputs of the action [the cache key]. None
+        if the outputs must not be cached for these inputs.
+        """
+        # The working dir is per transaction [the files in it are not in the key]
+        return {key: value for key, value in kwargs.items() if key != "working_dir"}
+
     def get_action(self, action_key: str) -> BaseRunner:
         """Get the step with the given ID."""
-        action_info = BaseRunner.actions.get(action_key, None)
+        action_info = BaseRunner.get_action_info(action_key)
         if not action_info:
             raise ValueError(f"Action Key {action_key} not found")
         return action_info["class"]()
@@ -90,3 +179,75 @@ class BaseRunner(BaseModel, ABC):
             "class": action_class,
             "label": action_label,
         }
+
+    @staticmethod
+    def register_action_module(action_key: str, module_name: str) -> None:
+        """Register the module for an action; imported when the action is used."""
+        BaseRunner.action_modules[action_key] = module_name
+
+    @staticmethod
+    def get_action_info(action_key: str) -> Dict[str, Any] | None:
+        """
+        Get the registered action; the module defining the action is imported
+        (and hence registered) on first use.
+        """
+        action_info = BaseRunner.actions.get(action_key)
+        if action_info:
+            return action_info
+
+        if action_key not in BaseRunner.action_modules:
+            BaseRunner.load_entry_points()
+        module_name = BaseRunner.action_modules.get(action_key)
+        if module_name:
+            BaseRunner.import_action_module(module_name)
+        return BaseRunner.actions.get(action_key)
+
+    @staticmethod
+    def import_action_module(module_name: str) -> None:
+        """Import the module (registering its actions) and record the time taken."""
+        start_time = time.perf_counter()
+        importlib.import_module(module_name)
+        if module_name not in BaseRunner.import_times:
+            BaseRunner.import_times[module_name] = time.perf_counter() - start_time
+            logger.debug(
+                f"Imported action module {module_name} in "
+                f"{BaseRunner.import_times[module_name] * 1000:.2f} ms"
+            )
+
+    @staticmethod
+    def load_entry_points() -> None:
+        """Register the modules for the third party actions [Only once]"""
+        if BaseRunner._entry_points_loaded:
+            return
+        BaseRunner._entry_points_loaded = True
+        for entry_point in entry_points(group=ACTION_ENTRY_POINT_GROUP):
+            logger.debug(f"Action entry point: {entry_point.name} => {entry_point}")
+            BaseRunner.action_modules.setdefault(entry_point.name, entry_point.module)
+
+    @staticmethod
+    def load_all_actions() -> Dict[str, Dict[str, Any]]:
+        """Import all the known actions [e.g. to list them on the UI]"""
+        BaseRunner.load_entry_points()
+        for module_name in sorted(set(BaseRunner.action_modules.values())):
+            BaseRunner.import_action_module(module_name)
+        return BaseRunner.actions
+
+    @staticmethod
+    def import_report() -> str:
+        """Report on the time taken to import the action modules."""
+        lines = [
+            f"{secs * 1000:10.2f} ms  {module_name}"
+            for module_name, secs in sorted(
+                BaseRunner.import_times.items(), key=lambda x: -x[1]
+            )
+        ]
+        # Modules imported directly [e.g. when loading a cached definition]
+        lines.extend(
+            f"{'--':>10}     {module_name} [imported directly]"
+            for module_name in sorted(set(BaseRunner.action_modules.values()))
+            if module_name in sys.modules and module_name not in BaseRunner.import_times
+        )
+        total = sum(BaseRunner.import_times.values()) * 1000
+        return "\n".join(
+            ["Action module import times:", *lines, f"{total:10.2f} ms  [Total]"]
+        )
@@ -0,0 +1,105 @@
+"""Batch module; run (or resume) many workflow instances in one process/pool."""
+from __future__ import annotations
+
+import logging
+
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator
+
+from wfengine.commit_policy import CommitPolicy
+from wfengine.stores import SqlitePool
+
+if TYPE_CHECKING:  # pragma: no cover
+    from wfengine.wf_runner import WFRunner
+
+logger = logging.getLogger(__name__)
+
+IN_FLIGHT_PER_WORKER = 4
+"""Requests submitted (but not completed) per worker; bounds the memory used."""
+
+_worker_runner: WFRunner | None = None
+"""The runner [template] in each of the worker processes"""
+
+
+def stream_results(
+    executor: Executor,
+    func: Callable[[int, Dict[str, Any]], Dict[str, Any]],
+    requests: Iterable[Dict[str, Any]],
+    max_in_flight: int,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Submit `func(index, request)` for each of the requests, and yield the results
+    as they complete. At most `max_in_flight` requests are pending at any time
+    [so that the requests can be streamed from a large file].
+    """
+    pending = set()
+    for index, request in enumerate(requests):
+        pending.add(executor.submit(func, index, request))
+        if len(pending) >= max_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def init_worker(
+    wf_name: str, db_file: str, commit_policy: Dict[str, Any], kwargs: Dict[str, Any]
+) -> None:
+    """Load the workflow and open the DB once per worker process."""
+    from wfengine.wf_runner import WFRunner
+
+    global _worker_runner
+    pool = SqlitePool(db_file, commit_policy=CommitPolicy(**commit_policy))
+    Finalize(pool, pool.close, exitpriority=10)
+    _worker_runner = WFRunner.from_file(wf_name, pool, **kwargs)
+
+
+def run_worker_request(index: int, request: Dict[str, Any]) -> Dict[str, Any]:
+    return _worker_runner.run_request(index, request)
+
+
+def run_batch(
+    wf_name: str,
+    requests: Iterable[Dict[str, Any]],
+    db_file: Path,
+    max_workers: int = 8,
+    processes: bool = False,
+    commit_policy: Dict[str, Any] | None = None,
+    **kwargs,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Run (or resume) the workflow for each of the requests; the results are
+    yielded as they complete. The workflow is loaded once [per process] and the
+    runs share a SqlitePool [group commits as per the `commit_policy`].
+    With `processes`, the requests are run in a pool of worker processes
+    [for CPU bound actions], else in a pool of threads.
+    """
+    commit_policy = commit_policy or {}
+    if not processes:
+        from wfengine.wf_runner import WFRunner
+
+        pool = SqlitePool(str(db_file), commit_policy=CommitPolicy(**commit_policy))
+        try:
+            runner = WFRunner.from_file(wf_name, pool, **kwargs)
+            yield from runner.run_many(requests, max_workers=max_workers)
+        finally:
+            pool.close()
+        return
+
+    logger.info(f"Running batch [{wf_name}] in {max_workers} worker processes")
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=init_worker,
+        initargs=(wf_name, str(db_file), commit_policy, kwargs),
+    ) as executor:
+        yield from stream_results(
+            executor,
+            run_worker_request,
+            requests,
+            max_in_flight=max_workers * IN_FLIGHT_PER_WORKER,
+        )
@@ -0,0 +1,169 @@
+"""Checkpoint module; compact (delta encoded, compressed) workflow context storage."""
+from __future__ import annotations
+
+import json
+import logging
+import pickle
+import zlib
+
+from enum import Enum
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, model_validator
+
+logger = logging.getLogger(__name__)
+
+# Optional (faster) codecs; used only when they are installed
+try:
+    import msgpack  # type: ignore
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import zstandard  # type: ignore
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+FORMAT_VERSION = 1
+"""Version of the encoded format. Stored as the first byte of the payload."""
+
+
+class Serializer(str, Enum):
+    """How the values are serialized into bytes"""
+
+    JSON = "json"
+    MSGPACK = "msgpack"  # Needs the `msgpack` package
+
+
+class Compression(str, Enum):
+    """How the serialized bytes are compressed"""
+
+    NONE = "none"
+    ZLIB = "zlib"
+    ZSTD = "zstd"  # Needs the `zstandard` package
+
+
+# The IDs stored in the header byte. NEVER change these!
+SERIALIZER_IDS = {Serializer.JSON: 0, Serializer.MSGPACK: 1}
+COMPRESSION_IDS = {Compression.NONE: 0, Compression.ZLIB: 1, Compression.ZSTD: 2}
+
+
+class CheckpointCodec(BaseModel):
+    """
+    Encode/Decode the workflow context (and step inputs/outputs) into bytes.
+    The payload is self describing [2 byte header: format version and the
+    serializer/compression used], so the settings can be changed at any time
+    without affecting the existing checkpoints.
+    """
+
+    serializer: Serializer = Serializer.JSON
+    """The serializer to use for new checkpoints"""
+
+    compression: Compression = (
+        Compression.ZSTD if zstandard is not None else Compression.ZLIB
+    )
+    """The compression to use for payloads above `compress_threshold`"""
+
+    compress_threshold: int = 512
+    """Payloads smaller than this (in bytes) are not compressed"""
+
+    full_every: int = 16
+    """Write a full checkpoint after these many deltas [bounds the resume cost]"""
+
+    @model_validator(mode="after")
+    def check_available(self) -> CheckpointCodec:
+        if self.serializer == Serializer.MSGPACK and msgpack is None:
+            raise ValueError("msgpack serializer needs the `msgpack` package")
+        if self.compression == Compression.ZSTD and zstandard is None:
+            raise ValueError("zstd compression needs the `zstandard` package")
+        return self
+
+    def encode(self, value: Any) -> bytes:
+        """Serialize and (optionally) compress the value."""
+        if self.serializer == Serializer.MSGPACK:
+            payload = msgpack.packb(value, use_bin_type=True)
+        else:
+            payload = json.dumps(value, separators=(",", ":")).encode()
+
+        compression = Compression.NONE
+        if len(payload) >= self.compress_threshold:
+            compression = self.compression
+            if compression == Compression.ZSTD:
+                payload = zstandard.ZstdCompressor().compress(payload)
+            elif compression == Compression.ZLIB:
+                payload = zlib.compress(payload)
+
+        flags = (SERIALIZER_IDS[self.serializer] << 4) | COMPRESSION_IDS[compression]
+        return bytes([FORMAT_VERSION, flags]) + payload
+
+    def decode(self, data: bytes | str | None) -> Any:
+        """Decode the value. Plain JSON text [stored by older versions] is allowed."""
+        if data is None:
+            return None
+        if isinstance(data, str):
+            return json.loads(data)
+
+        version, flags = data[0], data[1]
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported checkpoint format version: {version}")
+        payload = data[2:]
+        match flags & 0x0F:
+            case 1:
+                payload = zlib.decompress(payload)
+            case 2:
+                if zstandard is None:
+                    raise ValueError("zstd checkpoint needs the `zstandard` package")
+                payload = zstandard.ZstdDecompressor().decompress(payload)
+        if flags >> 4 == SERIALIZER_IDS[Serializer.MSGPACK]:
+            if msgpack is None:
+                raise ValueError("msgpack checkpoint needs the `msgpack` package")
+            return msgpack.unpackb(payload, raw=False)
+        return json.loads(payload)
+
+
+def diff_context(prev: Dict[str, Any], curr: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the delta [changed keys, deleted keys] to go from `prev` to `curr`."""
+    changed = {k: v for k, v in curr.items() if k not in prev or prev[k] != v}
+    deleted: List[str] = [k for k in prev if k not in curr]
+    return {"set": changed, "del": deleted}
+
+
+def context_snapshot(context: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Snapshot of the context to diff against [see `diff_snapshot`]. The values are
+    kept pickled; so a value changed in place (e.g. a list appended to) after the
+    snapshot still shows up as changed [a copy of the dict would share it].
+    """
+    return {key: _fingerprint(value) for key, value in context.items()}
+
+
+def diff_snapshot(snapshot: Dict[str, Any], curr: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the delta [see `diff_context`] to go from the snapshot to `curr`."""
+    changed = {
+        k: v for k, v in curr.items() if snapshot.get(k, _MISSING) != _fingerprint(v)
+    }
+    deleted: List[str] = [k for k in snapshot if k not in curr]
+    return {"set": changed, "del": deleted}
+
+
+_MISSING = object()
+
+
+def _fingerprint(value: Any) -> Any:
+    try:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        # Can not be pickled; Never equal to the snapshot [always written]
+        return object()
+
+
+def apply_delta(context: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply the delta (from `diff_context`) on the context [in place]."""
+    for key in delta.get("del", []):
+        context.pop(key, None)
+    context.update(delta.get("set", {}))
+    return context
+
+
+def is_empty_delta(delta: Dict[str, Any]) -> bool:
+    return not delta["set"] and not delta["del"]
@@ -0,0 +1,69 @@
+"""Commit policy module; controls how often the workflow state is flushed to disk."""
+from __future__ import annotations
+
+import logging
+import time
+
+from enum import Enum
+from typing import Any
+
+from pydantic import BaseModel, PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+
+class CommitMode(str, Enum):
+    """When the pending writes are committed"""
+
+    STEP = "step"  # Commit after every row written (Safest, slowest)
+    RUN = "run"  # Commit only at durability points [WAITING, FAILED, Run end]
+    BATCH = "batch"  # Commit every `max_rows` rows or `max_ms` milliseconds
+
+
+class CommitPolicy(BaseModel):
+    """Group-commit policy for the workflow state writes."""
+
+    mode: CommitMode = CommitMode.STEP
+    """The commit mode"""
+
+    max_rows: int = 100
+    """[BATCH] Commit once these many rows are pending"""
+
+    max_ms: int = 1000
+    """[BATCH] Commit once the oldest pending row is older than this"""
+
+    _pending: int = PrivateAttr(default=0)
+    _first_pending_at: float = PrivateAttr(default=0.0)
+
+    @property
+    def pending(self) -> int:
+        """Number of rows written but not yet committed."""
+        return self._pending
+
+    def record(self, conn: Any, durable: bool = False, rows: int = 1) -> bool:
+        """
+        Record `rows` writes on the connection and commit if the policy says so.
+        `durable` marks a durability point (WAITING, FAILED, Run end) where the
+        writes are always flushed irrespective of the mode.
+        Returns True if a commit was done.
+        """
+        if not self._pending:
+            self._first_pending_at = time.monotonic()
+        self._pending += rows
+
+        if durable or self.mode == CommitMode.STEP:
+            return self.flush(conn)
+        if self.mode == CommitMode.BATCH:
+            elapsed_ms = (time.monotonic() - self._first_pending_at) * 1000
+            if self._pending >= self.max_rows or elapsed_ms >= self.max_ms:
+                return self.flush(conn)
+        return False
+
+    def flush(self, conn: Any) -> bool:
+        """Commit all the pending writes."""
+        if not self._pending:
+            return False
+        logger.debug(f"Committing {self._pending} pending writes [{self.mode.value}]")
+        conn.commit()
+        self._pending = 0
+        return True
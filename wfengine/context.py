@@ -0,0 +1,40 @@
+"""Context module; views over the workflow context that avoid copying dicts."""
+from __future__ import annotations
+
+from typing import Any, Iterator, Mapping
+
+
+class LayeredContext(Mapping[str, Any]):
+    """
+    Read-only view over a list of mappings (layers). The later layers take
+    precedence; i.e. it resolves exactly like `{**layer1, **layer2, ...}` but
+    without building the merged dictionary.
+    """
+
+    __slots__ = ("layers",)
+
+    def __init__(self, *layers: Mapping[str, Any]) -> None:
+        self.layers = layers
+
+    def __getitem__(self, key: str) -> Any:
+        for layer in reversed(self.layers):
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        return any(key in layer for layer in self.layers)
+
+    def __iter__(self) -> Iterator[str]:
+        seen = set()
+        for layer in reversed(self.layers):
+            for key in layer:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"LayeredContext({dict(self)})"
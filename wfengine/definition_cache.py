@@ -0,0 +1,127 @@
+"""Definition cache module; avoids re-validating unchanged workflow definitions."""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pickle  # nosec: Only our own cache files are loaded
+import threading
+
+from pathlib import Path
+from typing import Dict, Tuple
+
+from wfengine.version import __version__
+from wfengine.workflow import DEFAULT_EVAL_MODE, DEFAULT_STEP_TIMEOUT, Workflow
+
+logger = logging.getLogger(__name__)
+
+_memory_cache: Dict[Tuple[str, int, int], Tuple[str, Workflow]] = {}
+_memory_lock = threading.Lock()
+_engine_fingerprint: str | None = None
+
+
+def engine_fingerprint() -> str:
+    """
+    Return a fingerprint of the engine [version + the source files]. A compiled
+    definition embeds the actions and the keys computed from them; So any change
+    to the engine/actions code must invalidate the cache.
+    """
+    global _engine_fingerprint
+    if _engine_fingerprint is None:
+        package_dir = Path(__file__).parent
+        digest = hashlib.sha256(__version__.encode())
+        for src_file in sorted(package_dir.rglob("*.py")):
+            stat = src_file.stat()
+            digest.update(f"{src_file}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        _engine_fingerprint = digest.hexdigest()[:16]
+    return _engine_fingerprint
+
+
+def settings_fingerprint() -> str:
+    """
+    Return a fingerprint of the environment derived defaults that are embedded
+    in a compiled definition [WF_CONDITION_MODE, WF_STEP_TIMEOUT]
+    """
+    settings = f"{DEFAULT_EVAL_MODE.value}:{DEFAULT_STEP_TIMEOUT}"
+    return hashlib.sha256(settings.encode()).hexdigest()[:8]
+
+
+def cache_dir() -> Path:
+    """The directory for the compiled definitions [WF_DEF_CACHE_DIR]"""
+    default_dir = Path(os.getenv("WF_ROOT_DIR", os.getcwd())) / ".wfcache"
+    return Path(os.getenv("WF_DEF_CACHE_DIR", default_dir)) / "definitions"
+
+
+def load_workflow(def_file: Path, use_disk=True) -> Workflow:
+    """
+    Load the workflow from the definition file; validated only if there is no
+    compiled definition for the (definition content, engine, settings) in the
+    memory or the disk cache.
+    """
+    stat = def_file.stat()
+    stat_key = (str(def_file), stat.st_size, stat.st_mtime_ns)
+    with _memory_lock:
+        cached = _memory_cache.get(stat_key)
+    if cached:
+        logger.debug(f"Definition cache hit [memory]: {def_file}")
+        return cached[1]
+
+    def_bytes = def_file.read_bytes()
+    content_hash = hashlib.sha256(def_bytes).hexdigest()[:32]
+    cache_key = f"{content_hash}-{engine_fingerprint()}{settings_fingerprint()}"
+    with _memory_lock:
+        for key, (other_key, workflow) in list(_memory_cache.items()):
+            if key[0] == stat_key[0]:
+                del _memory_cache[key]  # Stale (file has been modified)
+                if other_key == cache_key:  # Touched, but content is unchanged
+                    _memory_cache[stat_key] = (cache_key, workflow)
+                    return workflow
+
+    cache_file = cache_dir() / f"{def_file.stem}-{cache_key}.pkl"
+    workflow = load_compiled(cache_file) if use_disk else None
+    if workflow is None:
+        logger.info(f"Validating workflow definition: {def_file}")
+        workflow = Workflow(**json.loads(def_bytes))
+        if use_disk:
+            save_compiled(cache_file, workflow)
+    else:
+        logger.debug(f"Definition cache hit [disk]: {cache_file}")
+
+    with _memory_lock:
+        _memory_cache[stat_key] = (cache_key, workflow)
+    return workflow
+
+
+def load_compiled(cache_file: Path) -> Workflow | None:
+    if not cache_file.is_file():
+        return None
+    try:
+        with open(cache_file, "rb") as f:
+            workflow = pickle.load(f)  # noqa: S301 # nosec
+        return workflow if isinstance(workflow, Workflow) else None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable compiled definition {cache_file}: {e}")
+        return None
+
+
+def save_compiled(cache_file: Path, workflow: Workflow) -> None:
+    """Save the compiled definition and remove the stale ones for the same file."""
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "wb") as f:
+            pickle.dump(workflow, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+        def_stem = cache_file.name.rsplit("-", 2)[0]
+        for stale_file in cache_file.parent.glob(f"{def_stem}-*-*.pkl"):
+            stale_stem = stale_file.name.rsplit("-", 2)[0]
+            if stale_file != cache_file and stale_stem == def_stem:
+                stale_file.unlink(missing_ok=True)
+    except Exception as e:  # The cache is an optimization; never fail the load
+        logger.warning(f"Unable to save compiled definition {cache_file}: {e}")
+
+
+def clear_memory_cache() -> None:
+    with _memory_lock:
+        _memory_cache.clear()
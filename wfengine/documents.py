@@ -0,0 +1,210 @@
+"""Documents module; memory mapped documents and a content-addressed cache."""
+from __future__ import annotations
+
+import hashlib
+import logging
+import mmap
+import os
+import threading
+
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from wfengine.checkpoint import CheckpointCodec
+from wfengine.definition_cache import engine_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DOC_CACHE_BYTES = int(os.getenv("WF_DOC_CACHE_BYTES", str(256 * 1024 * 1024)))
+"""Max. size of the document cache [WF_DOC_CACHE_BYTES; default 256 MB]"""
+
+
+class Document(object):
+    """
+    A document file, memory mapped (read-only); The pages are read on demand by
+    the OS and shared by the processes reading the same file. Use as a context
+    manager so that the mapping is released.
+    """
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        # NOTE: An empty file cannot be mapped
+        self._mmap = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.size
+            else None
+        )
+        self._digest: str | None = None
+
+    @property
+    def data(self) -> memoryview:
+        """The document content [without copying it; release before `close`]"""
+        return memoryview(self._mmap if self._mmap is not None else b"")
+
+    @property
+    def digest(self) -> str:
+        """BLAKE2b digest of the content; the key of the document cache"""
+        if self._digest is None:
+            content = self._mmap if self._mmap is not None else b""
+            self._digest = hashlib.blake2b(content, digest_size=32).hexdigest()
+        return self._digest
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> Document:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def resolve_document(file_name: str | None, working_dir: str | None) -> Path | None:
+    """The path of the document [relative to the transaction working dir]"""
+    if not file_name:
+        return None
+    path = Path(file_name)
+    if not path.is_absolute() and working_dir:
+        path = Path(working_dir) / path
+    if not path.is_file():
+        logger.info(f"Document not found: {path}")  # e.g. An optional document
+        return None
+    return path
+
+
+def doc_cache_dir() -> Path:
+    """The directory for the document cache [WF_DOC_CACHE_DIR]"""
+    default_dir = Path(os.getenv("WF_ROOT_DIR", os.getcwd())) / ".wfcache"
+    return Path(os.getenv("WF_DOC_CACHE_DIR", default_dir)) / "documents"
+
+
+class DocumentCache(object):
+    """
+    Content-addressed cache of the results extracted from the documents, keyed
+    by the content digest [and the kind of extraction, e.g. the document type]
+    and the engine fingerprint [so a change to the extraction code invalidates
+    it]; So a document is extracted once, irrespective of its name/transaction.
+    The results are files in the cache dir [shared by the processes]; the least
+    recently used are evicted once the cache is over `max_bytes`. The hits are
+    reported with the extraction time they saved.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path | str | None = None,
+        max_bytes: int = DEFAULT_DOC_CACHE_BYTES,
+    ) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir else doc_cache_dir()
+        self.max_bytes = max_bytes
+        self.codec = CheckpointCodec()
+        self.version = engine_fingerprint()
+        self._lock = threading.Lock()
+        self._total_bytes: int | None = None  # Estimate; computed on the first put
+        self._stats: Dict[str, float] = {
+            "hits": 0,
+            "misses": 0,
+            "puts": 0,
+            "evictions": 0,
+            "saved_secs": 0.0,
+        }
+
+    def cache_file(self, digest: str, kind: str) -> Path:
+        return self.cache_dir / digest[:2] / f"{digest}.{kind}.{self.version}.bin"
+
+    def get(self, digest: str, kind: str) -> Any | None:
+        """Return the cached result for the document, or None"""
+        cache_file = self.cache_file(digest, kind)
+        try:
+            entry = self.codec.decode(cache_file.read_bytes())
+            os.utime(cache_file)  # Most recently used
+        except FileNotFoundError:
+            entry = None
+        except Exception as e:
+            logger.warning(
+                f"Ignoring unreadable document cache entry {cache_file}: {e}"
+            )
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["saved_secs"] += entry["secs"]
+            saved_secs = self._stats["saved_secs"]
+        logger.info(
+            f"Document cache hit [{kind}] {digest[:16]}: saved {entry['secs']:.3f} "
+            f"secs [total {saved_secs:.3f} secs]"
+        )
+        return entry["result"]
+
+    def put(self, digest: str, kind: str, result: Any, secs: float) -> None:
+        """Cache the result that took `secs` to extract"""
+        cache_file = self.cache_file(digest, kind)
+        try:
+            data = self.codec.encode({"result": result, "secs": secs})
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+            tmp_file.write_bytes(data)
+            os.replace(tmp_file, cache_file)
+        except Exception as e:  # The cache is an optimization; never fail the step
+            logger.warning(f"Unable to save document cache entry {cache_file}: {e}")
+            return
+
+        with self._lock:
+            self._stats["puts"] += 1
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self.entries())
+            else:
+                self._total_bytes += len(data)
+            if self._total_bytes > self.max_bytes:
+                self.evict()
+
+    def entries(self) -> List[Tuple[float, int, Path]]:
+        """The cache files [last used time, size, path]"""
+        entries = []
+        for cache_file in self.cache_dir.glob("*/*.bin"):
+            try:
+                stat = cache_file.stat()
+            except FileNotFoundError:
+                continue  # Evicted by another process
+            entries.append((stat.st_mtime, stat.st_size, cache_file))
+        return entries
+
+    def evict(self) -> None:
+        """Evict the least recently used entries, till 90% of `max_bytes`"""
+        entries = sorted(self.entries())
+        total_bytes = sum(size for _, size, _ in entries)
+        target_bytes = int(self.max_bytes * 0.9)
+        evicted = 0
+        for _, size, cache_file in entries:
+            if total_bytes <= target_bytes:
+                break
+            cache_file.unlink(missing_ok=True)
+            total_bytes -= size
+            evicted += 1
+        self._total_bytes = total_bytes
+        self._stats["evictions"] += evicted
+        logger.info(f"Document cache: evicted {evicted} entries [{total_bytes} bytes]")
+
+    def stats(self) -> Dict[str, float]:
+        """The hit/miss counters and the total extraction time saved by the hits"""
+        with self._lock:
+            return dict(self._stats)
+
+
+_default_cache: DocumentCache | None = None
+_default_lock = threading.Lock()
+
+
+def document_cache() -> DocumentCache:
+    """The process-wide document cache [WF_DOC_CACHE_DIR, WF_DOC_CACHE_BYTES]"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = DocumentCache()
+    return _default_cache
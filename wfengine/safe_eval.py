@@ -0,0 +1,177 @@
+"""Safe Eval module; a whitelist-only evaluator for the condition expressions."""
+from __future__ import annotations
+
+import ast
+import operator
+
+from typing import Any, Callable, Dict, Mapping, Set
+
+Evaluator = Callable[[Mapping[str, Any]], Any]
+
+BIN_OPS: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+UNARY_OPS: Dict[type, Callable[[Any], Any]] = {
+    ast.Not: operator.not_,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+COMPARE_OPS: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+
+SAFE_FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    "len": len,
+    "min": min,
+    "max": max,
+    "abs": abs,
+    "sum": sum,
+    "any": any,
+    "all": all,
+    "round": round,
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": bool,
+}
+"""The only functions that can be called from a safe expression."""
+
+SAFE_CONSTANTS = {"True": True, "False": False, "None": None}
+
+
+def compile_safe(expression: str) -> Evaluator:
+    """
+    Compile the expression into a closure that evaluates it against a mapping.
+    Raises ValueError if the expression uses anything outside the whitelist
+    [attributes, lambdas, comprehensions, calls to non-whitelisted functions...]
+    """
+    tree = ast.parse(expression, mode="eval")
+    return _compile_node(tree.body)
+
+
+def referenced_names(expression: str) -> Set[str]:
+    """Return the names of the variables referenced in the expression."""
+    tree = ast.parse(expression, mode="eval")
+    return {
+        node.id
+        for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+    }
+
+
+def _compile_node(node: ast.AST) -> Evaluator:  # noqa: C901
+    match node:
+        case ast.Constant(value=value):
+            return lambda ctx: value
+        case ast.Name(id=name) if name in SAFE_CONSTANTS:
+            constant = SAFE_CONSTANTS[name]
+            return lambda ctx: constant
+        case ast.Name(id=name):
+
+            def load_name(ctx: Mapping[str, Any]) -> Any:
+                try:
+                    return ctx[name]
+                except KeyError:
+                    raise NameError(f"name '{name}' is not defined") from None
+
+            return load_name
+        case ast.BoolOp(op=ast.And(), values=values):
+            and_funcs = [_compile_node(v) for v in values]
+
+            def and_op(ctx: Mapping[str, Any]) -> Any:
+                result = True
+                for func in and_funcs:
+                    result = func(ctx)
+                    if not result:
+                        return result
+                return result
+
+            return and_op
+        case ast.BoolOp(op=ast.Or(), values=values):
+            or_funcs = [_compile_node(v) for v in values]
+
+            def or_op(ctx: Mapping[str, Any]) -> Any:
+                result = False
+                for func in or_funcs:
+                    result = func(ctx)
+                    if result:
+                        return result
+                return result
+
+            return or_op
+        case ast.BinOp(left=left, op=op, right=right) if type(op) in BIN_OPS:
+            bin_op, lhs, rhs = (
+                BIN_OPS[type(op)],
+                _compile_node(left),
+                _compile_node(right),
+            )
+            return lambda ctx: bin_op(lhs(ctx), rhs(ctx))
+        case ast.UnaryOp(op=op, operand=operand) if type(op) in UNARY_OPS:
+            unary_op, arg = UNARY_OPS[type(op)], _compile_node(operand)
+            return lambda ctx: unary_op(arg(ctx))
+        case ast.Compare(left=left, ops=ops, comparators=comparators):
+            if not all(type(op) in COMPARE_OPS for op in ops):
+                raise ValueError(f"Unsupported comparison: {ast.unparse(node)}")
+            first = _compile_node(left)
+            pairs = [
+                (COMPARE_OPS[type(op)], _compile_node(c))
+                for op, c in zip(ops, comparators)
+            ]
+            if len(pairs) == 1:
+                cmp_op, rhs = pairs[0]
+                return lambda ctx: cmp_op(first(ctx), rhs(ctx))
+
+            def compare(ctx: Mapping[str, Any]) -> bool:
+                lhs_value = first(ctx)
+                for cmp_op, rhs in pairs:
+                    rhs_value = rhs(ctx)
+                    if not cmp_op(lhs_value, rhs_value):
+                        return False
+                    lhs_value = rhs_value
+                return True
+
+            return compare
+        case ast.Subscript(value=value, slice=index) if not isinstance(
+            index, ast.Slice
+        ):
+            container, key = _compile_node(value), _compile_node(index)
+            return lambda ctx: container(ctx)[key(ctx)]
+        case ast.IfExp(test=test, body=body, orelse=orelse):
+            test_f, body_f, else_f = (
+                _compile_node(test),
+                _compile_node(body),
+                _compile_node(orelse),
+            )
+            return lambda ctx: body_f(ctx) if test_f(ctx) else else_f(ctx)
+        case ast.List(elts=elts) | ast.Tuple(elts=elts) | ast.Set(elts=elts):
+            builder = {ast.List: list, ast.Tuple: tuple, ast.Set: set}[type(node)]
+            item_funcs = [_compile_node(e) for e in elts]
+            return lambda ctx: builder(f(ctx) for f in item_funcs)
+        case ast.Dict(keys=keys, values=values) if None not in keys:
+            kv_funcs = [
+                (_compile_node(k), _compile_node(v)) for k, v in zip(keys, values)
+            ]
+            return lambda ctx: {k(ctx): v(ctx) for k, v in kv_funcs}
+        case ast.Call(func=ast.Name(id=fname), args=args, keywords=[]) if (
+            fname in SAFE_FUNCTIONS
+        ):
+            func, arg_funcs = SAFE_FUNCTIONS[fname], [_compile_node(a) for a in args]
+            return lambda ctx: func(*[a(ctx) for a in arg_funcs])
+
+    raise ValueError(f"Unsupported expression in safe mode: {ast.unparse(node)}")
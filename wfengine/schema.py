@@ -0,0 +1,330 @@
+"""Schema module; owns the DDL for the workflow state DB and its migrations."""
+from __future__ import annotations
+
+import logging
+import sqlite3
+
+from typing import Callable, List, Tuple
+from uuid import UUID
+
+from wfengine.base_runner import RunStatus
+
+logger = logging.getLogger(__name__)
+
+Migration = Tuple[int, str, Callable[[sqlite3.Connection], None]]
+
+
+def uuid_to_blob(value) -> bytes | None:
+    """Convert a UUID (or its string form) into the 16 byte representation."""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return value
+    return (value if isinstance(value, UUID) else UUID(str(value))).bytes
+
+
+def blob_to_uuid(value) -> UUID | None:
+    """Convert the stored 16 byte representation back to a UUID."""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return UUID(bytes=value)
+    return UUID(str(value))  # Rows written before the BLOB migration
+
+
+def _create_base_tables(conn: sqlite3.Connection) -> None:
+    """v1: The original tables [Existing DBs already have these]"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS wf_run (
+            id INTEGER PRIMARY KEY,
+            transaction_id INTEGER NOT NULL,
+            working_dir TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            context TEXT NULLABLE,
+            status TEXT NOT NULL,
+            reason TEXT NULLABLE,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS wf_step_run (
+            wf_id INTEGER,
+            step_name TEXT NOT NULL,
+            input TEXT NULLABLE,
+            output TEXT NULLABLE,
+            status TEXT NOT NULL,
+            reason TEXT NULLABLE,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(wf_id, step_name)
+        )
+        """
+    )
+
+
+def _store_uuids_as_blobs(conn: sqlite3.Connection) -> None:
+    """v2: Store the transaction IDs as 16 byte BLOBs instead of 36 char TEXT"""
+    conn.create_function("uuid_blob", 1, uuid_to_blob, deterministic=True)
+    conn.execute(
+        """
+        CREATE TABLE wf_run_v2 (
+            id INTEGER PRIMARY KEY,
+            transaction_id BLOB NOT NULL UNIQUE,
+            working_dir TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            context TEXT NULLABLE,
+            status TEXT NOT NULL,
+            reason TEXT NULLABLE,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO wf_run_v2 (
+            id, transaction_id, working_dir, owner, context, status, reason,
+            created_at, updated_at
+        )
+        SELECT
+            id, uuid_blob(transaction_id), working_dir, owner, context, status,
+            reason, created_at, updated_at
+        FROM wf_run
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE wf_step_run_v2 (
+            wf_id BLOB NOT NULL,
+            step_name TEXT NOT NULL,
+            input TEXT NULLABLE,
+            output TEXT NULLABLE,
+            status TEXT NOT NULL,
+            reason TEXT NULLABLE,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(wf_id, step_name)
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO wf_step_run_v2 (
+            wf_id, step_name, input, output, status, reason, created_at, updated_at
+        )
+        SELECT
+            uuid_blob(wf_id), step_name, input, output, status, reason,
+            created_at, updated_at
+        FROM wf_step_run
+        """
+    )
+    conn.execute("DROP TABLE wf_run")
+    conn.execute("DROP TABLE wf_step_run")
+    conn.execute("ALTER TABLE wf_run_v2 RENAME TO wf_run")
+    conn.execute("ALTER TABLE wf_step_run_v2 RENAME TO wf_step_run")
+
+
+def _add_lookup_indexes(conn: sqlite3.Connection) -> None:
+    """v3: Indexes for the resume path [last transaction, waiting steps]"""
+    # The rowid is implicitly part of the index; so `ORDER BY created_at, id`
+    # is served directly from the index.
+    conn.execute("CREATE INDEX idx_wf_run_created_at ON wf_run (created_at)")
+    # Only the (few) waiting steps are kept in this partial index. Queries must
+    # use the literal status value for SQLite to pick this index.
+    conn.execute(
+        f"""
+        CREATE INDEX idx_wf_step_run_waiting ON wf_step_run (wf_id, step_name)
+        WHERE status = '{RunStatus.WAITING.value}'
+        """
+    )
+
+
+def _add_context_checkpoints(conn: sqlite3.Connection) -> None:
+    """v4: Delta encoded context checkpoints [wf_run.context is the base]"""
+    conn.execute(
+        "ALTER TABLE wf_run ADD COLUMN checkpoint_seq INTEGER NOT NULL DEFAULT 0"
+    )
+    conn.execute(
+        """
+        CREATE TABLE wf_checkpoint (
+            wf_id BLOB NOT NULL,
+            seq INTEGER NOT NULL,
+            delta BLOB NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (wf_id, seq)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _add_work_queue(conn: sqlite3.Connection) -> None:
+    """v5: Durable work queue for the CREATE/CONTINUE messages [see WorkQueue]"""
+    conn.execute(
+        """
+        CREATE TABLE wf_queue (
+            id INTEGER PRIMARY KEY,
+            action TEXT NOT NULL,
+            workflow TEXT NOT NULL,
+            wf_id BLOB NOT NULL,
+            owner TEXT,
+            payload BLOB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'Queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at REAL NOT NULL,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            result TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    # Partial indexes; the queries must use the same status literals
+    conn.execute(
+        "CREATE INDEX idx_wf_queue_ready ON wf_queue(available_at) "
+        "WHERE status = 'Queued'"
+    )
+    conn.execute(
+        "CREATE INDEX idx_wf_queue_leased ON wf_queue(lease_expires_at) "
+        "WHERE status = 'Leased'"
+    )
+    conn.execute(
+        "CREATE INDEX idx_wf_queue_wf_id ON wf_queue(wf_id, id) "
+        "WHERE status IN ('Queued', 'Leased')"
+    )
+
+
+def _add_timers(conn: sqlite3.Connection) -> None:
+    """v6: Durable timers for the waiting steps [see TimerService]"""
+    conn.execute(
+        """
+        CREATE TABLE wf_timer (
+            id INTEGER PRIMARY KEY,
+            wf_id BLOB NOT NULL,
+            workflow TEXT NOT NULL,
+            step_id TEXT NOT NULL,
+            action TEXT NOT NULL,
+            due_at REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'Pending',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    # Partial indexes; the queries must use the same status literal
+    conn.execute(
+        "CREATE INDEX idx_wf_timer_due ON wf_timer(due_at) WHERE status = 'Pending'"
+    )
+    conn.execute(
+        "CREATE INDEX idx_wf_timer_wf_id ON wf_timer(wf_id, step_id) "
+        "WHERE status = 'Pending'"
+    )
+
+
+def _add_cancel_requests(conn: sqlite3.Connection) -> None:
+    """v7: Flag the runs to be cancelled at the next step [see WFRunner.cancel]"""
+    conn.execute(
+        "ALTER TABLE wf_run ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0"
+    )
+
+
+def _add_step_cache(conn: sqlite3.Connection) -> None:
+    """v8: The disk tier of the step result cache [see StepCache]"""
+    conn.execute(
+        """
+        CREATE TABLE wf_step_cache (
+            cache_key TEXT PRIMARY KEY,
+            action TEXT NOT NULL,
+            outputs BLOB NOT NULL,
+            expires_at REAL,
+            last_used_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX idx_wf_step_cache_expires ON wf_step_cache(expires_at)")
+    conn.execute("CREATE INDEX idx_wf_step_cache_used ON wf_step_cache(last_used_at)")
+
+
+def _add_step_context_seq(conn: sqlite3.Connection) -> None:
+    """v9: The context checkpoint a step run read [the input is the step inputs]"""
+    conn.execute("ALTER TABLE wf_step_run ADD COLUMN context_seq INTEGER")
+
+
+def _add_context_snapshots(conn: sqlite3.Connection) -> None:
+    """v10: The replaced base contexts that the step runs still refer to"""
+    conn.execute(
+        """
+        CREATE TABLE wf_context_snapshot (
+            wf_id BLOB NOT NULL,
+            seq INTEGER NOT NULL,
+            context BLOB NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (wf_id, seq)
+        ) WITHOUT ROWID
+        """
+    )
+
+
+def _add_timer_attempts(conn: sqlite3.Connection) -> None:
+    """v11: The failed attempts to fire a timer [retried with a backoff]"""
+    conn.execute("ALTER TABLE wf_timer ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+
+MIGRATIONS: List[Migration] = [
+    (1, "Create wf_run and wf_step_run tables", _create_base_tables),
+    (2, "Store transaction IDs as 16 byte BLOBs", _store_uuids_as_blobs),
+    (3, "Add indexes for the resume lookups", _add_lookup_indexes),
+    (4, "Add delta encoded context checkpoints", _add_context_checkpoints),
+    (5, "Add the durable work queue", _add_work_queue),
+    (6, "Add the timers for the waiting steps", _add_timers),
+    (7, "Add the cancel requests for the runs", _add_cancel_requests),
+    (8, "Add the step result cache", _add_step_cache),
+    (9, "Add the context checkpoint of the step runs", _add_step_context_seq),
+    (10, "Keep the base contexts referred by the step runs", _add_context_snapshots),
+    (11, "Add the attempts of the timers", _add_timer_attempts),
+]
+"""The forward migrations, in order. Only append to this list!"""
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Return the current schema version of the DB [0 if not initialized]."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn: sqlite3.Connection, target: int | None = None) -> int:
+    """Apply all pending migrations (up to `target`) and return the new version."""
+    conn.commit()  # Start from a clean slate; each migration is one transaction
+    version = get_schema_version(conn)
+    conn.commit()
+    for mig_version, description, mig_func in MIGRATIONS:
+        if mig_version <= version or (target and mig_version > target):
+            continue
+        logger.info(f"Applying DB migration [{mig_version}]: {description}")
+        try:
+            conn.execute("BEGIN")
+            mig_func(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                [mig_version, description],
+            )
+            conn.commit()
+        except sqlite3.Error as err:
+            conn.rollback()
+            logger.error(f"DB migration [{mig_version}] failed: {err}")
+            raise err
+        version = mig_version
+    return version
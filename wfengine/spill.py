@@ -0,0 +1,323 @@
+"""
+Spill module; large step outputs are written to the transaction working dir and
+the context holds a (small) reference to them, read lazily by the later steps.
+"""
+from __future__ import annotations
+
+import bisect
+import logging
+import mmap
+import os
+import struct
+import uuid
+
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from wfengine.checkpoint import CheckpointCodec
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPILL_BYTES = int(os.getenv("WF_SPILL_BYTES", str(1024 * 1024)))
+"""Outputs larger than this (encoded) are spilled to disk [WF_SPILL_BYTES; 0: never]"""
+
+SPILL_CHUNK_ROWS = 1000
+"""Items (rows) per chunk of a spilled list"""
+
+SPILL_REF_KEY = "$spill"
+"""The key identifying a spill reference in the context"""
+
+SPILL_MAGIC = b"WFSPILL1"
+FOOTER = struct.Struct("<Q")  # Offset of the index [at the end of the file]
+
+_codec = CheckpointCodec()
+
+
+def size_exceeds(value: Any, limit: int) -> bool:
+    """
+    True if the (rough, uncompressed) size of the value may exceed the limit; A
+    cheap check before encoding the value [stops as soon as it is exceeded]
+    """
+    size = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, (str, bytes)):
+            size += len(item)
+        elif isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+        else:
+            size += 8
+        if size > limit:
+            return True
+    return False
+
+
+def is_spill_ref(value: Any) -> bool:
+    return type(value) is dict and SPILL_REF_KEY in value
+
+
+def encode_chunk(rows: List[Any]) -> bytes:
+    """Encode the rows; column-wise, if they are dicts with the same keys"""
+    first = rows[0]
+    if type(first) is dict and all(
+        type(row) is dict and row.keys() == first.keys() for row in rows
+    ):
+        columns = list(first)
+        return _codec.encode(
+            {"c": columns, "v": [[row[c] for row in rows] for c in columns]}
+        )
+    return _codec.encode({"r": rows})
+
+
+def decode_chunk(data: bytes) -> List[Any]:
+    chunk = _codec.decode(data)
+    if "r" in chunk:
+        return chunk["r"]
+    return [dict(zip(chunk["c"], values)) for values in zip(*chunk["v"])]
+
+
+def write_spill(path: Path, value: List[Any] | Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Write the value to the spill file: the magic, the (length prefixed) chunks,
+    the index [offsets and item counts of the chunks] and the index offset.
+    A list is written in chunks of `SPILL_CHUNK_ROWS`; a dict, as one chunk.
+    Returns the spill reference [without the file name].
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    is_list = not isinstance(value, dict)
+    chunks = (
+        [
+            value[i : i + SPILL_CHUNK_ROWS]
+            for i in range(0, len(value), SPILL_CHUNK_ROWS)
+        ]
+        if is_list
+        else [[value]]
+    )
+    offsets: List[int] = []
+    counts: List[int] = []
+    tmp_file = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(SPILL_MAGIC)
+        for chunk in chunks:
+            data = encode_chunk(chunk)
+            offsets.append(f.tell())
+            counts.append(len(chunk))
+            f.write(struct.pack("<I", len(data)))
+            f.write(data)
+        index_offset = f.tell()
+        f.write(_codec.encode({"offsets": offsets, "counts": counts}))
+        f.write(FOOTER.pack(index_offset))
+        size = f.tell()
+    os.replace(tmp_file, path)
+    return {"kind": "list" if is_list else "dict", "items": sum(counts), "bytes": size}
+
+
+class SpillFile(object):
+    """A (memory mapped) spill file; the chunks are decoded on demand."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(SPILL_MAGIC)] != SPILL_MAGIC:
+            raise ValueError(f"Not a spill file: {path}")
+        (index_offset,) = FOOTER.unpack(self._mmap[-FOOTER.size :])
+        index = _codec.decode(self._mmap[index_offset : -FOOTER.size])
+        self.offsets: List[int] = index["offsets"]
+        self.counts: List[int] = index["counts"]
+        self.starts: List[int] = []  # Index of the first item of each chunk
+        start = 0
+        for count in self.counts:
+            self.starts.append(start)
+            start += count
+        self.length = start
+
+    def chunk(self, index: int) -> List[Any]:
+        offset = self.offsets[index]
+        (length,) = struct.unpack("<I", self._mmap[offset : offset + 4])
+        return decode_chunk(self._mmap[offset + 4 : offset + 4 + length])
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+class SpilledList(Sequence):
+    """
+    Lazy, read-only list over a spilled output. Iterating decodes one chunk at a
+    time; `len` and indexing only decode the chunk holding the item.
+    """
+
+    def __init__(self, ref: Dict[str, Any], path: Path) -> None:
+        self.ref = ref
+        self.path = path
+        self._file: SpillFile | None = None
+        self._cached: Tuple[int, List[Any]] | None = None  # The last decoded chunk
+
+    @property
+    def file(self) -> SpillFile:
+        if self._file is None:
+            self._file = SpillFile(self.path)
+        return self._file
+
+    def __len__(self) -> int:
+        return self.ref["items"]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("spilled list index out of range")
+        chunk_index = bisect.bisect_right(self.file.starts, index) - 1
+        if self._cached is None or self._cached[0] != chunk_index:
+            self._cached = (chunk_index, self.file.chunk(chunk_index))
+        return self._cached[1][index - self.file.starts[chunk_index]]
+
+    def __iter__(self) -> Iterator[Any]:
+        for chunk_index in range(len(self.file.counts)):
+            yield from self.file.chunk(chunk_index)
+
+    def iter_chunks(self) -> Iterator[List[Any]]:
+        """Iterate over the items, `SPILL_CHUNK_ROWS` at a time"""
+        for chunk_index in range(len(self.file.counts)):
+            yield self.file.chunk(chunk_index)
+
+    def close(self) -> None:
+        """Release the mapping [reopened, if the list is read again]"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._cached = None
+
+    def __enter__(self) -> SpilledList:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        # NOTE: So the mapping does not outlive the step inputs holding the list
+        self.close()
+
+    def __repr__(self) -> str:
+        return f"SpilledList({self.ref[SPILL_REF_KEY]}, items={len(self)})"
+
+
+class SpilledDict(Mapping):
+    """Lazy, read-only dict over a spilled output [loaded on first access]"""
+
+    def __init__(self, ref: Dict[str, Any], path: Path) -> None:
+        self.ref = ref
+        self.path = path
+        self._value: Dict[str, Any] | None = None
+
+    @property
+    def value(self) -> Dict[str, Any]:
+        if self._value is None:
+            spill_file = SpillFile(self.path)
+            try:
+                self._value = spill_file.chunk(0)[0]
+            finally:
+                spill_file.close()
+        return self._value
+
+    def __getitem__(self, key: str) -> Any:
+        return self.value[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.value)
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def __repr__(self) -> str:
+        return f"SpilledDict({self.ref[SPILL_REF_KEY]})"
+
+
+def spill_outputs(
+    outputs: Dict[str, Any],
+    working_dir: Path | str | None,
+    step_id: str,
+    threshold: int = DEFAULT_SPILL_BYTES,
+) -> Dict[str, Any]:
+    """
+    Replace the list/dict outputs larger than `threshold` (encoded) with spill
+    references, written to (new) files in `<working_dir>/outputs`. Lazy values
+    passed through by the step are replaced by their (existing) references.
+    """
+    for key, value in outputs.items():
+        if isinstance(value, (SpilledList, SpilledDict)):
+            outputs[key] = value.ref
+            continue
+        if not threshold or not working_dir or not value:
+            continue
+        if type(value) not in (list, tuple, dict) or not size_exceeds(value, threshold):
+            continue
+        try:
+            size = len(_codec.encode(value))
+        except (TypeError, ValueError):
+            continue  # Not serializable; Left as is
+        if size <= threshold:
+            continue
+        # NOTE: Unique; a re-run must not replace a file still mapped (or referred)
+        file_name = f"outputs/{step_id}.{key}.{uuid.uuid4().hex[:12]}.wfspill"
+        ref = write_spill(Path(working_dir) / file_name, value)
+        outputs[key] = {SPILL_REF_KEY: file_name, **ref}
+        logger.info(
+            f"Spilled output {step_id}.{key} [{size} bytes, {ref['items']} items]"
+        )
+    return outputs
+
+
+def load_spilled(
+    ref: Dict[str, Any], working_dir: Path | str | None
+) -> SpilledList | SpilledDict:
+    """The lazy value for the spill reference"""
+    path = Path(working_dir or "") / ref[SPILL_REF_KEY]
+    if ref.get("kind") == "dict":
+        return SpilledDict(ref, path)
+    return SpilledList(ref, path)
+
+
+class SpillResolvingView(Mapping):
+    """Read-only view over the variables; the spill references are read lazily"""
+
+    __slots__ = ("values", "working_dir")
+
+    def __init__(self, values: Mapping[str, Any], working_dir: Path | str | None):
+        self.values = values
+        self.working_dir = working_dir
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.values[key]
+        return load_spilled(value, self.working_dir) if is_spill_ref(value) else value
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.values
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+def resolve_spilled(
+    values: Dict[str, Any], working_dir: Path | str | None
+) -> Dict[str, Any]:
+    """
+    The values with the spill references replaced by the lazy values [a copy;
+    only if there are any references]
+    """
+    if not any(is_spill_ref(value) for value in values.values()):
+        return values
+    return {
+        key: load_spilled(value, working_dir) if is_spill_ref(value) else value
+        for key, value in values.items()
+    }
@@ -0,0 +1,251 @@
+"""Step cache module; reuses the results of the deterministic actions."""
+from __future__ import annotations
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+from wfengine.checkpoint import CheckpointCodec
+from wfengine.definition_cache import engine_fingerprint
+from wfengine.schema import migrate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = int(os.getenv("WF_STEP_CACHE_SIZE", "1024"))
+"""Max. entries in the memory tier of the step cache [WF_STEP_CACHE_SIZE; 0: none]"""
+
+DEFAULT_CACHE_TTL = float(os.getenv("WF_STEP_CACHE_TTL", "3600"))
+"""Secs a cached step result is valid [WF_STEP_CACHE_TTL; 0: no expiry]"""
+
+DEFAULT_CACHE_DB = os.getenv("WF_STEP_CACHE_DB")
+"""The SQLite file for the step cache disk tier [WF_STEP_CACHE_DB; unset: none]"""
+
+DEFAULT_CACHE_ROWS = int(os.getenv("WF_STEP_CACHE_ROWS", "100000"))
+"""Max. entries in the disk tier of the step cache [WF_STEP_CACHE_ROWS]"""
+
+
+_action_fingerprints: Dict[type, str] = {}
+
+
+def action_fingerprint(action_class: type) -> str:
+    """
+    Return a fingerprint of the module defining the action [file, size, mtime];
+    So a change to an action outside the engine (e.g. an entry point) also
+    invalidates its results. A reloaded module has new classes [fingerprinted
+    again], else the code that runs is the code fingerprinted.
+    """
+    fingerprint = _action_fingerprints.get(action_class)
+    if fingerprint is None:
+        version = f"{action_class.__module__}.{action_class.__qualname__}"
+        try:
+            source_file = Path(inspect.getfile(action_class))
+            stat = source_file.stat()
+            version += f":{source_file}:{stat.st_size}:{stat.st_mtime_ns}"
+        except (TypeError, OSError):
+            pass  # e.g. Defined interactively; Only the name
+        fingerprint = hashlib.blake2b(version.encode(), digest_size=8).hexdigest()
+        _action_fingerprints[action_class] = fingerprint
+    return fingerprint
+
+
+class StepCache(object):
+    """
+    Two tier (memory LRU + SQLite) cache of the action outputs, keyed by the
+    action name and a hash of its inputs [see `WFStep.cache`]. A memory miss is
+    looked up on disk, and promoted to memory on a hit. The entries expire after
+    `ttl` secs, and the least recently used ones are evicted beyond the size
+    limits of either tier. The keys include the engine fingerprint and that of
+    the action's module so that a change to the engine/actions code invalidates
+    the cached results.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_CACHE_SIZE,
+        ttl: float | None = DEFAULT_CACHE_TTL,
+        db_file: Path | str | None = None,
+        max_rows: int = DEFAULT_CACHE_ROWS,
+        evict_every: int = 100,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl or None
+        self.max_rows = max_rows
+        self.evict_every = evict_every
+        self.codec = CheckpointCodec()
+        self.namespace = engine_fingerprint()
+
+        self._memory: OrderedDict[str, Tuple[float | None, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "puts": 0,
+            "evictions": 0,
+        }
+
+        self._conn: sqlite3.Connection | None = None
+        if db_file:
+            # NOTE: Used by the runners in all the threads [serialized by the lock]
+            self._conn = sqlite3.connect(
+                str(db_file),
+                timeout=30.0,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            migrate(self._conn)
+
+    def key(
+        self, action: str, inputs: Dict[str, Any], action_class: type | None = None
+    ) -> str | None:
+        """The cache key for the action inputs [None, if they are not serializable]"""
+        version = action_fingerprint(action_class) if action_class else None
+        try:
+            payload = json.dumps(
+                [self.namespace, action, version, inputs],
+                sort_keys=True,
+                separators=(",", ":"),
+            )
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Step cache: {action} inputs are not cacheable: {e}")
+            return None
+        return (
+            f"{action}:{hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()}"
+        )
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        """Return (a copy of) the cached outputs, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, data = entry
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return self.codec.decode(data)
+                del self._memory[key]
+
+            row = None
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT outputs, expires_at FROM wf_step_cache "
+                    "WHERE cache_key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    [key, now],
+                ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+
+            data, expires_at = row
+            self._conn.execute(
+                "UPDATE wf_step_cache SET last_used_at = ? WHERE cache_key = ?",
+                [now, key],
+            )
+            self._stats["disk_hits"] += 1
+            self.put_memory(key, expires_at, data)
+        return self.codec.decode(data)
+
+    def put(self, key: str, outputs: Dict[str, Any]) -> None:
+        """Cache the outputs [skipped if they are not serializable]"""
+        try:
+            data = self.codec.encode(outputs)
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Step cache: outputs of {key} are not cacheable: {e}")
+            return
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._stats["puts"] += 1
+            self.put_memory(key, expires_at, data)
+            if self._conn is None:
+                return
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO wf_step_cache
+                    (cache_key, action, outputs, expires_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [key, key.rsplit(":", 1)[0], data, expires_at, now],
+            )
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self.evict_disk(now)
+
+    def put_memory(self, key: str, expires_at: float | None, data: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (expires_at, data)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def evict_disk(self, now: float) -> None:
+        """Delete the expired entries, and the least recently used beyond `max_rows`"""
+        cursor = self._conn.execute(
+            "DELETE FROM wf_step_cache WHERE expires_at <= ?", [now]
+        )
+        evicted = cursor.rowcount
+        (rows,) = self._conn.execute("SELECT COUNT(*) FROM wf_step_cache").fetchone()
+        if rows > self.max_rows:
+            cursor = self._conn.execute(
+                """
+                DELETE FROM wf_step_cache WHERE cache_key IN (
+                    SELECT cache_key FROM wf_step_cache
+                    ORDER BY last_used_at LIMIT ?
+                )
+                """,
+                [rows - self.max_rows],
+            )
+            evicted += cursor.rowcount
+        self._stats["evictions"] += evicted
+        if evicted:
+            logger.debug(f"Step cache: evicted {evicted} entries from disk")
+
+    def stats(self) -> Dict[str, int]:
+        """The hit/miss/eviction counters [and the entries in memory]"""
+        with self._lock:
+            return {**self._stats, "memory_entries": len(self._memory)}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM wf_step_cache")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_default_cache: StepCache | None = None
+_default_lock = threading.Lock()
+
+
+def default_step_cache() -> StepCache | None:
+    """
+    The process-wide step cache used by the runners [configured by the WF_STEP_CACHE_*
+    environment variables]. None if both the tiers are disabled.
+    """
+    global _default_cache
+    if DEFAULT_CACHE_SIZE <= 0 and not DEFAULT_CACHE_DB:
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = StepCache(db_file=DEFAULT_CACHE_DB)
+    return _default_cache
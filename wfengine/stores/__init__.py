@@ -0,0 +1,26 @@
+"""
+Stores for persisting the workflow run state. The store modules are imported
+lazily [on first access], so that only the backend in use is loaded.
+"""
+import importlib
+
+STORE_MODULES = {
+    "StateStore": "base_store",
+    "FileStore": "file_store",
+    "MemoryStore": "memory_store",
+    "SqlitePool": "sqlite_pool",
+    "SqliteStore": "sqlite_store",
+}
+"""Store class name => module [in this package]"""
+
+__all__ = list(STORE_MODULES)
+
+
+def __getattr__(name: str):
+    if name not in STORE_MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f".{STORE_MODULES[name]}", __name__), name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
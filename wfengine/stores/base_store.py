@@ -0,0 +1,209 @@
+"""Base Store module; the interface for persisting the workflow run state."""
+from __future__ import annotations
+
+import logging
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Set
+from uuid import UUID
+
+from pydantic import BaseModel, PrivateAttr
+
+from wfengine.base_runner import RunStatus
+from wfengine.workflow import WFResult
+
+if TYPE_CHECKING:  # pragma: no cover
+    from wfengine.timers import TimerAction
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore(BaseModel, ABC):
+    """Stores the workflow runs (transactions) and the step runs within them."""
+
+    _timers_ignored: bool = PrivateAttr(default=False)
+    _cancel_requests: Set[UUID] = PrivateAttr(default_factory=set)
+
+    @abstractmethod
+    def create_run(
+        self,
+        transaction_id: UUID,
+        working_dir: Path,
+        owner: str,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        """Create the record for a new workflow run."""
+
+    @abstractmethod
+    def update_run(
+        self,
+        transaction_id: UUID,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        """Update the workflow run. This is always a durability point."""
+
+    @abstractmethod
+    def get_run(self, transaction_id: UUID) -> Dict[str, Any]:
+        """
+        Return the workflow run as a dictionary with the keys transaction_id,
+        working_dir, owner, context, status & reason. Raise ValueError if not found.
+        """
+
+    def track_run(self, transaction_id: UUID, run: Dict[str, Any]) -> None:
+        """
+        The run [as returned by `get_run`] is continued by this runner; The store
+        may keep its state [e.g. the last checkpoint] till the run ends.
+        """
+
+    def release_run(self, transaction_id: UUID) -> None:
+        """Drop the state kept for the run [it has ended or failed; see track_run]"""
+
+    @abstractmethod
+    def record_step(
+        self, transaction_id: UUID, step_id: str, result: WFResult, resumed=False
+    ) -> None:
+        """Record the step run. `resumed` is True when the step was resumed."""
+
+    @abstractmethod
+    def get_waiting_step(self, transaction_id: UUID) -> str | None:
+        """Return the step ID that is waiting for a trigger (if any)."""
+
+    @abstractmethod
+    def get_last_transaction_id(self) -> UUID | None:
+        """Return the most recently created transaction ID (if any)."""
+
+    def get_runs(self, transaction_ids: List[UUID]) -> Dict[UUID, Dict[str, Any]]:
+        """Return the runs [see `get_run`] by transaction ID; omits the missing runs"""
+        runs = {}
+        for transaction_id in transaction_ids:
+            try:
+                runs[transaction_id] = self.get_run(transaction_id)
+            except ValueError:
+                pass
+        return runs
+
+    def get_waiting_steps(self, transaction_ids: List[UUID]) -> Dict[UUID, str]:
+        """Return the waiting step ID of the runs [that have one]"""
+        steps = {}
+        for transaction_id in transaction_ids:
+            step_id = self.get_waiting_step(transaction_id)
+            if step_id:
+                steps[transaction_id] = step_id
+        return steps
+
+    @contextmanager
+    def deferred_commits(self) -> Iterator[None]:
+        """
+        Commit the writes in the block together at the end [instead of at each
+        durability point]. By default, the pending writes are flushed at the end.
+        """
+        try:
+            yield
+        finally:
+            self.flush()
+
+    def schedule_timer(
+        self,
+        transaction_id: UUID,
+        workflow: str,
+        step_id: str,
+        action: TimerAction,
+        due_at: float,
+    ) -> None:
+        """Schedule a timer for the waiting step [fired by the TimerService]"""
+        if not self._timers_ignored:
+            logger.warning(
+                f"Timers are not supported by {type(self).__name__}; the timers "
+                f"(e.g. {action.value} of {step_id}) are ignored"
+            )
+            self._timers_ignored = True
+
+    def cancel_timers(self, transaction_id: UUID, step_id: str) -> None:
+        """Cancel the pending timers of the step [it is no longer waiting]"""
+
+    def request_cancel(self, transaction_id: UUID) -> None:
+        """
+        Flag the run to be cancelled at the next step [see WFRunner.cancel]. By
+        default, the flag is kept in memory; i.e. seen only by this process.
+        """
+        self._cancel_requests.add(transaction_id)
+
+    def is_cancel_requested(self, transaction_id: UUID) -> bool:
+        return transaction_id in self._cancel_requests
+
+    def flush(self) -> None:
+        """Make all the pending writes durable. No-op by default."""
+
+    @property
+    def thread_safe(self) -> bool:
+        """True if the store can be used by runners in multiple threads."""
+        return True
+
+    @property
+    def offload_io(self) -> bool:
+        """
+        True if the async methods run the (blocking) store calls in a worker
+        thread. Stores that do not block or are bound to a thread override this.
+        """
+        return self.thread_safe
+
+    async def call_async(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call the sync store method without blocking the event loop."""
+        if self.offload_io:
+            import asyncio
+
+            return await asyncio.to_thread(func, *args, **kwargs)
+        return func(*args, **kwargs)
+
+    async def acreate_run(
+        self,
+        transaction_id: UUID,
+        working_dir: Path,
+        owner: str,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        await self.call_async(
+            self.create_run, transaction_id, working_dir, owner, status, reason, context
+        )
+
+    async def aupdate_run(
+        self,
+        transaction_id: UUID,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        await self.call_async(self.update_run, transaction_id, status, reason, context)
+
+    async def aget_run(self, transaction_id: UUID) -> Dict[str, Any]:
+        return await self.call_async(self.get_run, transaction_id)
+
+    async def arecord_step(
+        self, transaction_id: UUID, step_id: str, result: WFResult, resumed=False
+    ) -> None:
+        await self.call_async(
+            self.record_step, transaction_id, step_id, result, resumed=resumed
+        )
+
+    async def aget_waiting_step(self, transaction_id: UUID) -> str | None:
+        return await self.call_async(self.get_waiting_step, transaction_id)
+
+    async def aget_last_transaction_id(self) -> UUID | None:
+        return await self.call_async(self.get_last_transaction_id)
+
+    def close(self) -> None:
+        """Flush and release any resources held by the store."""
+        self.flush()
+
+    @staticmethod
+    def is_durable(result: WFResult) -> bool:
+        """Return True if the step result must be flushed irrespective of policy."""
+        return result.status.is_waiting() or result.status.not_successful()
@@ -0,0 +1,195 @@
+"""File store; an append-only key/value log for the workflow state."""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+
+from pathlib import Path
+from typing import Any, BinaryIO, Dict
+from uuid import UUID
+
+from pydantic import Field, PrivateAttr
+
+from wfengine.base_runner import RunStatus
+from wfengine.commit_policy import CommitPolicy
+from wfengine.stores.base_store import StateStore
+from wfengine.workflow import WFResult
+
+logger = logging.getLogger(__name__)
+
+
+class FileStore(StateStore):
+    """
+    Store the workflow state as an append-only log of JSON lines. Every write
+    appends the latest value for a key [run/<txn_id> or step/<txn_id>/<step_id>].
+    The in-memory index only keeps the offset of the latest value for each key.
+    """
+
+    path: Path
+    """The log file. Created if it does not exist."""
+
+    commit_policy: CommitPolicy = Field(default_factory=CommitPolicy)
+    """When the appended records are fsync'ed to the disk."""
+
+    _index: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _waiting: Dict[str, str] = PrivateAttr(default_factory=dict)
+    _last_transaction_id: str | None = PrivateAttr(default=None)
+    _writer: BinaryIO | None = PrivateAttr(default=None)
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    def model_post_init(self, __context: Any) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.touch(exist_ok=True)
+        self.replay()
+        self._writer = open(self.path, "ab")  # noqa: SIM115
+
+    def replay(self) -> None:
+        """Rebuild the index from the log. A torn (partial) last line is dropped."""
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self.index_record(json.loads(line), valid_size)
+                valid_size += len(line)
+        if valid_size != self.path.stat().st_size:
+            logger.warning(f"Truncating partial record at the end of {self.path}")
+            os.truncate(self.path, valid_size)
+        logger.debug(f"Replayed {len(self._index)} keys from {self.path}")
+
+    def index_record(self, record: Dict[str, Any], offset: int) -> None:
+        key = record["key"]
+        self._index[key] = offset
+        if key.startswith("run/"):
+            if record.get("new"):
+                self._last_transaction_id = key[4:]
+        else:
+            _, txn_id, step_id = key.split("/", 2)
+            if record["value"]["status"] == RunStatus.WAITING.value:
+                self._waiting[txn_id] = step_id
+            elif self._waiting.get(txn_id) == step_id:
+                del self._waiting[txn_id]
+
+    def append(self, record: Dict[str, Any], durable=False) -> None:
+        line = (json.dumps(record) + "\n").encode()
+        with self._lock:
+            offset = self._writer.tell()
+            self._writer.write(line)
+            self.index_record(record, offset)
+            self.commit_policy.record(self, durable=durable)
+
+    def read(self, key: str) -> Dict[str, Any] | None:
+        with self._lock:
+            offset = self._index.get(key)
+            if offset is None:
+                return None
+            self._writer.flush()  # Make sure that the buffered writes are visible
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())["value"]
+
+    def commit(self) -> None:
+        """Called by the commit policy; fsync the appended records."""
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+
+    def create_run(
+        self,
+        transaction_id: UUID,
+        working_dir: Path,
+        owner: str,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        value = {
+            "working_dir": str(working_dir),
+            "owner": owner,
+            "context": context,
+            "status": status.value,
+            "reason": reason,
+        }
+        self.append({"key": f"run/{transaction_id}", "new": True, "value": value})
+
+    def update_run(
+        self,
+        transaction_id: UUID,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        value = self.read(f"run/{transaction_id}")
+        if value is None:
+            raise ValueError(f"Transaction ID not found: {transaction_id}")
+        value.update(status=status.value, reason=reason, context=context)
+        self.append({"key": f"run/{transaction_id}", "value": value}, durable=True)
+
+    def get_run(self, transaction_id: UUID) -> Dict[str, Any]:
+        value = self.read(f"run/{transaction_id}")
+        if value is None:
+            raise ValueError(
+                f"Transaction ID not found: {transaction_id}, Cannot resume"
+            )
+        return {"transaction_id": transaction_id, **value}
+
+    def record_step(
+        self, transaction_id: UUID, step_id: str, result: WFResult, resumed=False
+    ) -> None:
+        value = {
+            "input": result.inputs,
+            "output": result.outputs,
+            "status": result.status.value,
+            "reason": result.completion_reason,
+        }
+        self.append(
+            {"key": f"step/{transaction_id}/{step_id}", "value": value},
+            durable=self.is_durable(result),
+        )
+
+    def get_waiting_step(self, transaction_id: UUID) -> str | None:
+        return self._waiting.get(str(transaction_id))
+
+    def get_last_transaction_id(self) -> UUID | None:
+        txn_id = self._last_transaction_id
+        return UUID(txn_id) if txn_id else None
+
+    def flush(self) -> None:
+        with self._lock:
+            self.commit_policy.flush(self)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer:
+                self.flush()
+                self._writer.close()
+                self._writer = None
+
+    def compact(self) -> None:
+        """Rewrite the log with only the latest value for each key."""
+        with self._lock:
+            self.flush()
+            self._writer.flush()
+            tmp_path = self.path.with_suffix(self.path.suffix + ".compact")
+            last_run_key = f"run/{self._last_transaction_id}"
+            with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+                for key, offset in self._index.items():
+                    src.seek(offset)
+                    record = json.loads(src.readline())
+                    record.pop("new", None)
+                    if key == last_run_key:
+                        continue  # Written last to preserve the last transaction
+                    dst.write((json.dumps(record) + "\n").encode())
+                if self._last_transaction_id:
+                    src.seek(self._index[last_run_key])
+                    record = {**json.loads(src.readline()), "new": True}
+                    dst.write((json.dumps(record) + "\n").encode())
+                dst.flush()
+                os.fsync(dst.fileno())
+            self._writer.close()
+            os.replace(tmp_path, self.path)
+            self._index.clear()
+            self._waiting.clear()
+            self.replay()
+            self._writer = open(self.path, "ab")  # noqa: SIM115
@@ -0,0 +1,92 @@
+"""In-memory store; useful for tests and for benchmarking without any I/O."""
+from __future__ import annotations
+
+import logging
+import threading
+
+from pathlib import Path
+from typing import Any, Dict, Tuple
+from uuid import UUID
+
+from pydantic import PrivateAttr
+
+from wfengine.base_runner import RunStatus
+from wfengine.stores.base_store import StateStore
+from wfengine.workflow import WFResult
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStore(StateStore):
+    """Keep the workflow state in process memory. Nothing survives a restart!"""
+
+    _runs: Dict[UUID, Dict[str, Any]] = PrivateAttr(default_factory=dict)
+    _steps: Dict[Tuple[UUID, str], Dict[str, Any]] = PrivateAttr(default_factory=dict)
+    _waiting: Dict[UUID, str] = PrivateAttr(default_factory=dict)
+    _last_transaction_id: UUID | None = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def offload_io(self) -> bool:
+        return False  # Nothing blocks; no need for a worker thread
+
+    def create_run(
+        self,
+        transaction_id: UUID,
+        working_dir: Path,
+        owner: str,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        with self._lock:
+            self._runs[transaction_id] = {
+                "transaction_id": transaction_id,
+                "working_dir": str(working_dir),
+                "owner": owner,
+                "context": dict(context),
+                "status": status,
+                "reason": reason,
+            }
+            self._last_transaction_id = transaction_id
+
+    def update_run(
+        self,
+        transaction_id: UUID,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        with self._lock:
+            run = self._runs.get(transaction_id)
+            if run is not None:
+                run.update(status=status, reason=reason, context=dict(context))
+
+    def get_run(self, transaction_id: UUID) -> Dict[str, Any]:
+        run = self._runs.get(transaction_id)
+        if not run:
+            raise ValueError(
+                f"Transaction ID not found: {transaction_id}, Cannot resume"
+            )
+        return {**run, "context": dict(run["context"])}
+
+    def record_step(
+        self, transaction_id: UUID, step_id: str, result: WFResult, resumed=False
+    ) -> None:
+        with self._lock:
+            self._steps[(transaction_id, step_id)] = {
+                "input": dict(result.inputs),
+                "output": dict(result.outputs),
+                "status": result.status,
+                "reason": result.completion_reason,
+            }
+            if result.status.is_waiting():
+                self._waiting[transaction_id] = step_id
+            elif self._waiting.get(transaction_id) == step_id:
+                del self._waiting[transaction_id]
+
+    def get_waiting_step(self, transaction_id: UUID) -> str | None:
+        return self._waiting.get(transaction_id)
+
+    def get_last_transaction_id(self) -> UUID | None:
+        return self._last_transaction_id
@@ -0,0 +1,220 @@
+"""Sqlite3 connection pool; allows concurrent workflow runs on one DB file."""
+from __future__ import annotations
+
+import logging
+import queue
+import sqlite3
+import threading
+
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Set, Tuple, TypeVar
+
+from wfengine.commit_policy import CommitMode, CommitPolicy
+from wfengine.schema import migrate
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+WriteJob = Tuple[Callable[[sqlite3.Connection], Any], bool, Future, int]
+"""(func, durable, future, the thread ID of the caller)"""
+
+JobResult = Tuple[Future, bool, int, Any, Exception | None]
+"""(future, durable, thread ID, result, error)"""
+
+
+class SqlitePool(object):
+    """
+    Sqlite3 connection pool with one read connection per thread and a single
+    writer connection owned by a background thread. Writes are queued and
+    executed serially by the writer, so that there is never more than one
+    writer on the DB [and no "database is locked" errors]. The writer commits
+    all the writes it has drained from the queue together (group commit).
+    """
+
+    def __init__(
+        self,
+        db_file: Path | str,
+        commit_policy: CommitPolicy | None = None,
+        max_batch: int = 256,
+        timeout: float = 30.0,
+    ) -> None:
+        self.db_file = str(db_file)
+        self.commit_policy = commit_policy or CommitPolicy()
+        self.max_batch = max_batch
+        self.timeout = timeout
+
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+        self._queue: queue.Queue[WriteJob | None] = queue.Queue()
+        # [Writer thread] The threads with acknowledged, but uncommitted writes and
+        # the error that rolled back the open transaction [in the current batch]
+        self._unsynced: Set[int] = set()
+        self._failed: sqlite3.Error | None = None
+        # Thread ID -> The error that rolled back its acknowledged writes
+        self._lost: Dict[int, Exception] = {}
+        self._lost_lock = threading.Lock()
+
+        # Setup the schema before any of the readers connect
+        self._writer = self.connect()
+        migrate(self._writer)
+        self._writer_thread = threading.Thread(
+            target=self.write_loop, name="wf-sqlite-writer", daemon=True
+        )
+        self._writer_thread.start()
+
+    def connect(self) -> sqlite3.Connection:
+        # NOTE: Each connection is used by one thread only. But, they are closed
+        # from the thread calling close(); hence check_same_thread=False
+        conn = sqlite3.connect(
+            self.db_file, timeout=self.timeout, check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def reader(self) -> sqlite3.Connection:
+        """Return the read connection for the current thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def read(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        """Run `func` with the read connection of the current thread."""
+        conn = self.reader()
+        try:
+            return func(conn)
+        finally:
+            # End the implicit read transaction so that the next read sees new data
+            conn.rollback()
+
+    def write(self, func: Callable[[sqlite3.Connection], T], durable=False) -> T:
+        """
+        Queue `func` for the writer and wait for it to be executed. When `durable`
+        is set, this returns only after the write has been committed. Else, it
+        may be committed later [RUN/BATCH]; If that commit fails, the error is
+        raised by the next write of the thread (its earlier writes are lost).
+        """
+        if not self._writer_thread.is_alive():
+            raise RuntimeError("SqlitePool has been closed")
+        owner = threading.get_ident()
+        with self._lost_lock:
+            lost_error = self._lost.pop(owner, None)
+        if lost_error is not None:
+            raise lost_error
+        future: Future = Future()
+        self._queue.put((func, durable, future, owner))
+        return future.result()
+
+    def write_loop(self) -> None:
+        """The writer thread; Drains the write queue and group commits."""
+        closed = False
+        while not closed:
+            jobs: List[WriteJob] = []
+            try:
+                # Wake up to commit the pending writes when the batch ages out
+                wait = self.commit_policy.max_ms / 1000
+                job = self._queue.get(timeout=wait if self.pending_batch() else None)
+            except queue.Empty:
+                self.commit([], flush=True)
+                continue
+            while job is not None:
+                jobs.append(job)
+                if len(jobs) >= self.max_batch:
+                    break
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            closed = job is None
+            self.commit([self.run_job(job) for job in jobs], flush=closed)
+
+    def run_job(self, job: WriteJob) -> JobResult:
+        """
+        Run the job in a savepoint; A failed job is rolled back on its own and
+        the other jobs in the (group commit) transaction are not affected.
+        """
+        func, durable, future, owner = job
+        conn = self._writer
+        if not conn.in_transaction:
+            conn.execute("BEGIN")  # Else, releasing the savepoint would commit
+        conn.execute("SAVEPOINT wf_job")
+        try:
+            result = func(conn)
+            conn.execute("RELEASE wf_job")
+            return future, durable, owner, result, None
+        except Exception as e:  # Only this job fails; Others continue
+            logger.error(f"Error in sqlite write: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK TO wf_job")
+                conn.execute("RELEASE wf_job")
+            elif isinstance(e, sqlite3.Error):  # Rolled back the whole transaction
+                self._failed = e
+            return future, durable, owner, None, e
+
+    def commit(self, results: List[JobResult], flush=False) -> None:
+        """
+        Commit the writes as per the commit policy and resolve the futures. If
+        the commit fails, the writes in it fail; The threads with the earlier
+        (acknowledged but not committed) writes get the error on the next write.
+        """
+        try:
+            if self._failed is not None:
+                raise self._failed
+            written = [r for r in results if r[4] is None]
+            durable = any(r[1] for r in written)
+            if written:
+                self.commit_policy.record(self._writer, durable, rows=len(written))
+            if flush:
+                self.commit_policy.flush(self._writer)
+        except sqlite3.Error as err:
+            logger.error(f"Error committing sqlite writes: {err}")
+            if self._writer.in_transaction:
+                self._writer.rollback()
+            self.commit_policy.flush(self._writer)  # Nothing is pending now
+            results = [(f, d, o, None, e or err) for f, d, o, _, e in results]
+            with self._lost_lock:
+                self._lost.update((owner, err) for owner in self._unsynced)
+            self._unsynced, self._failed = set(), None
+        else:
+            if self.commit_policy.pending:
+                self._unsynced.update(r[2] for r in results if r[4] is None)
+            else:
+                self._unsynced.clear()
+                if self._writer.in_transaction:
+                    # Nothing written [e.g. all the jobs failed]; Release the lock
+                    self._writer.commit()
+
+        for future, _, _, result, error in results:
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def pending_batch(self) -> bool:
+        """Return True if there are uncommitted writes waiting for a BATCH commit."""
+        return (
+            self.commit_policy.mode == CommitMode.BATCH
+            and self.commit_policy.pending > 0
+        )
+
+    def flush(self) -> None:
+        """Wait for all the queued writes to be committed."""
+        self.write(lambda conn: None, durable=True)
+
+    def close(self) -> None:
+        """Flush the pending writes and close all the connections."""
+        if self._writer_thread.is_alive():
+            self._queue.put(None)
+            self._writer_thread.join()
+            self._writer.close()
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
@@ -0,0 +1,510 @@
+"""Sqlite3 store; the default durable store for the workflow state."""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Tuple
+from uuid import UUID
+
+from pydantic import Field, PrivateAttr
+
+from wfengine.base_runner import RunStatus
+from wfengine.checkpoint import (
+    CheckpointCodec,
+    apply_delta,
+    context_snapshot,
+    diff_snapshot,
+    is_empty_delta,
+)
+from wfengine.commit_policy import CommitPolicy
+from wfengine.schema import blob_to_uuid, uuid_to_blob
+from wfengine.stores.base_store import StateStore
+from wfengine.workflow import WFResult
+
+if TYPE_CHECKING:  # pragma: no cover
+    from wfengine.timers import TimerAction
+
+logger = logging.getLogger(__name__)
+
+MAX_IN_PARAMS = 500
+"""Max. number of parameters in an `IN (...)` list [SQLite limits the variables]"""
+
+
+class SqliteStore(StateStore):
+    """Store the workflow state in the wf_run & wf_step_run tables."""
+
+    sql_conn: Any = None  # Sqlite3 connection
+    """Sqlite3 connection to store the workflow run details."""
+
+    pool: Any = None  # SqlitePool
+    """
+    Connection pool to use instead of `sql_conn`; Needed when the store is
+    shared by workflows running concurrently in multiple threads.
+    """
+
+    commit_policy: CommitPolicy = Field(default_factory=CommitPolicy)
+    """When the writes to the sqlite3 connection are committed [Not for pool]"""
+
+    codec: CheckpointCodec = Field(default_factory=CheckpointCodec)
+    """Codec for the context checkpoints and the step inputs/outputs."""
+
+    # The last checkpoint [seq, context snapshot] of the runs in progress; used for
+    # the deltas.
+    # Kept from create_run/track_run till the run ends [see update_run, release_run]
+    _checkpoints: Dict[UUID, Tuple[int, Dict[str, Any]]] = PrivateAttr(
+        default_factory=dict
+    )
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _local: threading.local = PrivateAttr(default_factory=threading.local)
+
+    def model_post_init(self, __context: Any) -> None:
+        if (self.sql_conn is None) == (self.pool is None):
+            raise ValueError("Exactly one of sql_conn or pool must be specified")
+
+    @property
+    def thread_safe(self) -> bool:
+        # A plain sqlite3 connection can only be used in the thread creating it
+        return self.pool is not None
+
+    def execute(self, sql: str, params: List[Any], durable=False) -> None:
+        """Execute a write; Committed as per the commit policy (or if durable)"""
+        self.execute_all([(sql, params)], durable=durable)
+
+    def execute_all(self, statements: List[Tuple[str, List[Any]]], durable=False):
+        """Execute the writes together [in the same transaction]"""
+        deferred = getattr(self._local, "deferred", None)
+        if deferred is not None:
+            deferred.extend(statements)
+            return
+
+        def run_all(conn) -> None:
+            for sql, params in statements:
+                conn.execute(sql, params)
+
+        if self.pool:
+            self.pool.write(run_all, durable=durable)
+        else:
+            run_all(self.sql_conn)
+            self.commit_policy.record(self.sql_conn, durable=durable)
+
+    @contextmanager
+    def deferred_commits(self) -> Iterator[None]:
+        """
+        Buffer the writes in the block [of this thread] and write them in one
+        transaction at the end. NOTE: The reads do not see the buffered writes.
+        """
+        if getattr(self._local, "deferred", None) is not None:
+            yield  # Nested; written at the end of the outer block
+            return
+        self._local.deferred = []
+        try:
+            yield
+        finally:
+            statements, self._local.deferred = self._local.deferred, None
+            if statements:
+                self.execute_all(statements, durable=True)
+
+    def query(self, sql: str, params: List[Any]) -> List[Dict[str, Any]]:
+        """Execute a query and return the rows as dictionaries."""
+
+        def fetch(conn) -> List[Dict[str, Any]]:
+            cursor = conn.execute(sql, params)
+            return [self.get_row_dict(cursor, row) for row in cursor.fetchall()]
+
+        return self.pool.read(fetch) if self.pool else fetch(self.sql_conn)
+
+    def create_run(
+        self,
+        transaction_id: UUID,
+        working_dir: Path,
+        owner: str,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        """Log the workflow run details to the database."""
+        self.execute(
+            """
+            INSERT INTO wf_run (
+                transaction_id, working_dir, owner, context, status, reason
+            ) VALUES (
+                ?, ?, ?, ?, ?, ?
+            )
+            """,
+            [
+                uuid_to_blob(transaction_id),
+                str(working_dir),
+                owner,
+                self.codec.encode(context),
+                status,
+                reason,
+            ],
+        )
+        with self._lock:
+            self._checkpoints[transaction_id] = (0, context_snapshot(context))
+
+    def update_run(
+        self,
+        transaction_id: UUID,
+        status: RunStatus,
+        reason: str,
+        context: Dict[str, Any],
+    ) -> None:
+        """
+        Update the workflow run details to the database. Only the context keys
+        that changed since the last checkpoint are written [as a delta] except
+        for every `full_every` checkpoint where the full context is written.
+        """
+        wf_id = uuid_to_blob(transaction_id)
+        with self._lock:
+            # NOTE: Popped; so an ended (or failed) update does not leave it behind
+            checkpoint = self._checkpoints.pop(transaction_id, None)
+        if checkpoint is None:
+            checkpoint = self.load_checkpoint(transaction_id)
+        seq, snapshot = checkpoint
+
+        statements = []
+        delta = diff_snapshot(snapshot, context)
+        if is_empty_delta(delta):
+            pass  # Nothing changed; Only the status needs an update
+        elif (seq + 1) % self.codec.full_every == 0:
+            seq += 1
+            statements.extend(self.full_checkpoint(wf_id, seq, context))
+        else:
+            seq += 1
+            statements.append(
+                (
+                    "INSERT INTO wf_checkpoint (wf_id, seq, delta) VALUES (?, ?, ?)",
+                    [wf_id, seq, self.codec.encode(delta)],
+                )
+            )
+        statements.append(
+            (
+                """
+                UPDATE wf_run SET
+                    status = ?, reason = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE
+                    transaction_id = ?
+                """,
+                [status, reason, wf_id],
+            )
+        )
+        try:
+            # Run end (or WAITING/FAILED) is always a durability point
+            self.execute_all(statements, durable=True)
+        except sqlite3.Error as err:
+            logger.error(f"Error updating wf_run: {err}")
+            raise err
+        if status in (RunStatus.STARTED, RunStatus.WAITING):
+            # The run continues [e.g. resumed right away]; the next delta is from here
+            with self._lock:
+                self._checkpoints[transaction_id] = (seq, context_snapshot(context))
+
+    def full_checkpoint(
+        self, wf_id: bytes, seq: int, context: Dict[str, Any]
+    ) -> List[Tuple[str, List[Any]]]:
+        """
+        The statements to write the full context as the new base. The replaced
+        base is kept as a snapshot, as the step runs may refer to it (or to the
+        deltas after it) by `context_seq`; the snapshots and deltas are removed
+        only below the latest snapshot at (or before) the oldest one referred.
+        """
+        # The oldest context_seq of the step runs [the new base if there are none]
+        oldest = (
+            "COALESCE((SELECT MIN(context_seq) FROM wf_step_run WHERE wf_id = ?), ?)"
+        )
+        cutoff = (
+            "(SELECT MAX(seq) FROM wf_context_snapshot "
+            f"WHERE wf_id = ? AND seq <= {oldest})"
+        )
+        return [
+            (
+                "INSERT OR REPLACE INTO wf_context_snapshot (wf_id, seq, context) "
+                "SELECT transaction_id, checkpoint_seq, context FROM wf_run "
+                "WHERE transaction_id = ?",
+                [wf_id],
+            ),
+            (
+                "UPDATE wf_run SET context = ?, checkpoint_seq = ? "
+                "WHERE transaction_id = ?",
+                [self.codec.encode(context), seq, wf_id],
+            ),
+            (
+                f"DELETE FROM wf_checkpoint WHERE wf_id = ? AND seq <= {cutoff}",
+                [wf_id, wf_id, wf_id, seq],
+            ),
+            (
+                f"DELETE FROM wf_context_snapshot WHERE wf_id = ? AND seq < {cutoff}",
+                [wf_id, wf_id, wf_id, seq],
+            ),
+        ]
+
+    def get_context(self, transaction_id: UUID, seq: int) -> Dict[str, Any]:
+        """
+        The run context at the checkpoint `seq` [e.g. the `context_seq` of a step
+        run]; From the latest snapshot (or the base) at or before it and the deltas
+        """
+        wf_id = uuid_to_blob(transaction_id)
+        rows = self.query(
+            "SELECT checkpoint_seq AS seq, context FROM wf_run "
+            "WHERE transaction_id = ? AND checkpoint_seq <= ? "
+            "UNION ALL "
+            "SELECT seq, context FROM wf_context_snapshot WHERE wf_id = ? AND seq <= ? "
+            "ORDER BY seq DESC LIMIT 1",
+            [wf_id, seq, wf_id, seq],
+        )
+        if not rows:
+            raise ValueError(f"Checkpoint {seq} not available: {transaction_id}")
+        context = self.codec.decode(rows[0]["context"]) or {}
+        for delta_row in self.query(
+            "SELECT delta FROM wf_checkpoint WHERE wf_id = ? AND seq > ? AND seq <= ? "
+            "ORDER BY seq",
+            [wf_id, rows[0]["seq"], seq],
+        ):
+            apply_delta(context, self.codec.decode(delta_row["delta"]))
+        return context
+
+    def get_run(self, transaction_id: UUID) -> Dict[str, Any]:
+        """Get the run with the context restored from the last checkpoint."""
+        rows = self.query(
+            "SELECT * FROM wf_run where transaction_id = ?",
+            [uuid_to_blob(transaction_id)],
+        )
+        if not rows:
+            raise ValueError(
+                f"Transaction ID not found: {transaction_id}, Cannot resume"
+            )
+        deltas = self.query(
+            "SELECT seq, delta FROM wf_checkpoint WHERE wf_id = ? AND seq > ? "
+            "ORDER BY seq",
+            [uuid_to_blob(transaction_id), rows[0]["checkpoint_seq"]],
+        )
+        return self.restore_run(rows[0], deltas)
+
+    def get_runs(self, transaction_ids: List[UUID]) -> Dict[UUID, Dict[str, Any]]:
+        """Same as `get_run`, with two queries per `MAX_IN_PARAMS` runs"""
+        runs = {}
+        for chunk in self.chunks(transaction_ids):
+            wf_ids = [uuid_to_blob(transaction_id) for transaction_id in chunk]
+            marks = ", ".join("?" * len(wf_ids))
+            rows = self.query(
+                f"SELECT * FROM wf_run WHERE transaction_id IN ({marks})", wf_ids
+            )
+            deltas: Dict[bytes, List[Dict[str, Any]]] = {}
+            for delta_row in self.query(
+                "SELECT wf_id, seq, delta FROM wf_checkpoint JOIN wf_run "
+                "ON wf_id = transaction_id AND seq > checkpoint_seq "
+                f"WHERE wf_id IN ({marks}) ORDER BY wf_id, seq",
+                wf_ids,
+            ):
+                deltas.setdefault(delta_row["wf_id"], []).append(delta_row)
+            for row in rows:
+                run_deltas = deltas.get(row["transaction_id"], [])
+                run = self.restore_run(row, run_deltas)
+                runs[run["transaction_id"]] = run
+        return runs
+
+    def restore_run(
+        self, row_dict: Dict[str, Any], deltas: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Restore the run context from the base and the deltas [in seq order]; The
+        seq of the last delta applied is `context_seq` [see track_run]
+        """
+        row_dict["transaction_id"] = blob_to_uuid(row_dict["transaction_id"])
+        context = self.codec.decode(row_dict["context"]) or {}
+        seq = row_dict["checkpoint_seq"]
+        for delta_row in deltas:
+            apply_delta(context, self.codec.decode(delta_row["delta"]))
+            seq = delta_row["seq"]
+        row_dict["context"] = context
+        row_dict["context_seq"] = seq
+        return row_dict
+
+    def track_run(self, transaction_id: UUID, run: Dict[str, Any]) -> None:
+        with self._lock:
+            self._checkpoints[transaction_id] = (
+                run["context_seq"],
+                context_snapshot(run["context"]),
+            )
+
+    def release_run(self, transaction_id: UUID) -> None:
+        with self._lock:
+            self._checkpoints.pop(transaction_id, None)
+
+    def load_checkpoint(self, transaction_id: UUID) -> Tuple[int, Dict[str, Any]]:
+        """Load the last checkpoint of the run [when not available in memory]."""
+        run = self.get_run(transaction_id)
+        return run["context_seq"], context_snapshot(run["context"])
+
+    def record_step(
+        self, transaction_id: UUID, step_id: str, result: WFResult, resumed=False
+    ) -> None:
+        if resumed:
+            # We have resumed the workflow; Update the step run of the waiting step
+            self.update_step_run(transaction_id, step_id, result)
+        else:
+            self.log_step_run(transaction_id, step_id, result)
+
+    def context_seq(self, transaction_id: UUID) -> int | None:
+        """
+        The seq of the context checkpoint the run (or resume) started from; with
+        the outputs of the steps run since, it is the context a step read.
+        """
+        with self._lock:
+            checkpoint = self._checkpoints.get(transaction_id)
+        return checkpoint[0] if checkpoint is not None else None
+
+    def log_step_run(self, transaction_id: UUID, step_id: str, result: WFResult):
+        """Log the step run details to the database."""
+        self.execute(
+            """
+            INSERT INTO wf_step_run (
+                wf_id, step_name, input, output, status, reason, context_seq
+            ) VALUES (
+                ?, ?, ?, ?, ?, ?, ?
+            )
+            """,
+            [
+                uuid_to_blob(transaction_id),
+                step_id,
+                self.codec.encode(result.inputs),
+                self.codec.encode(result.outputs),
+                result.status,
+                result.completion_reason,
+                self.context_seq(transaction_id),
+            ],
+            durable=self.is_durable(result),
+        )
+
+    def update_step_run(
+        self, transaction_id: UUID, step_id: str, result: WFResult
+    ) -> None:
+        """Update the step run details to the database when we have resumed"""
+        try:
+            self.execute(
+                """
+                UPDATE wf_step_run SET
+                    input = ?, output = ?, status = ?, reason = ?, context_seq = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE
+                    wf_id = ? AND step_name = ?
+                """,
+                [
+                    self.codec.encode(result.inputs),
+                    self.codec.encode(result.outputs),
+                    result.status,
+                    result.completion_reason,
+                    self.context_seq(transaction_id),
+                    uuid_to_blob(transaction_id),
+                    step_id,
+                ],
+                durable=self.is_durable(result),
+            )
+        except sqlite3.Error as err:
+            logger.error(f"Error updating wf_step_run: {err}")
+            raise err
+
+    def schedule_timer(
+        self,
+        transaction_id: UUID,
+        workflow: str,
+        step_id: str,
+        action: TimerAction,
+        due_at: float,
+    ) -> None:
+        self.execute(
+            """
+            INSERT INTO wf_timer (wf_id, workflow, step_id, action, due_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [uuid_to_blob(transaction_id), workflow, step_id, action.value, due_at],
+        )
+
+    def cancel_timers(self, transaction_id: UUID, step_id: str) -> None:
+        # NOTE: The status is inlined so that the partial pending-timers index is used
+        self.execute(
+            "UPDATE wf_timer SET status = 'Cancelled', updated_at = CURRENT_TIMESTAMP "
+            "WHERE wf_id = ? AND step_id = ? AND status = 'Pending'",
+            [uuid_to_blob(transaction_id), step_id],
+        )
+
+    def request_cancel(self, transaction_id: UUID) -> None:
+        # Durable, so that the runner (in any process) sees it at its next step
+        self.execute(
+            "UPDATE wf_run SET cancel_requested = 1 WHERE transaction_id = ?",
+            [uuid_to_blob(transaction_id)],
+            durable=True,
+        )
+
+    def is_cancel_requested(self, transaction_id: UUID) -> bool:
+        rows = self.query(
+            "SELECT cancel_requested FROM wf_run WHERE transaction_id = ?",
+            [uuid_to_blob(transaction_id)],
+        )
+        return bool(rows and rows[0]["cancel_requested"])
+
+    def get_waiting_step(self, transaction_id: UUID) -> str | None:
+        # NOTE: The status is inlined so that the partial waiting-steps index is used
+        rows = self.query(
+            "SELECT * FROM wf_step_run where wf_id = ? and status = "
+            f"'{RunStatus.WAITING.value}' LIMIT 1",
+            [uuid_to_blob(transaction_id)],
+        )
+        # [LATER] What if two steps are waiting? In that case, we will need a CLI
+        # argument to indicate which step to resume. Anyways, from the front-end,
+        # we will always know that.
+        if not rows:
+            return None
+        row_dict = rows[0]
+        logger.debug(f"Step Run [Waiting] = {row_dict['step_name']} // {row_dict}")
+        return row_dict["step_name"]
+
+    def get_waiting_steps(self, transaction_ids: List[UUID]) -> Dict[UUID, str]:
+        steps = {}
+        for chunk in self.chunks(transaction_ids):
+            marks = ", ".join("?" * len(chunk))
+            rows = self.query(
+                f"SELECT wf_id, step_name FROM wf_step_run WHERE wf_id IN ({marks}) "
+                f"AND status = '{RunStatus.WAITING.value}'",
+                [uuid_to_blob(transaction_id) for transaction_id in chunk],
+            )
+            for row in rows:
+                steps.setdefault(blob_to_uuid(row["wf_id"]), row["step_name"])
+        return steps
+
+    @staticmethod
+    def chunks(transaction_ids: List[UUID]) -> Iterator[List[UUID]]:
+        for start in range(0, len(transaction_ids), MAX_IN_PARAMS):
+            yield transaction_ids[start : start + MAX_IN_PARAMS]
+
+    def get_last_transaction_id(self) -> UUID | None:
+        """Get the last transaction ID from the database."""
+        rows = self.query(
+            "SELECT transaction_id FROM wf_run "
+            "ORDER BY created_at DESC, id DESC LIMIT 1",
+            [],
+        )
+        return None if not rows else blob_to_uuid(rows[0]["transaction_id"])
+
+    def flush(self) -> None:
+        if self.pool:
+            self.pool.flush()
+        else:
+            self.commit_policy.flush(self.sql_conn)
+
+    def close(self) -> None:
+        if self.pool:
+            self.pool.close()
+        else:
+            self.flush()
+
+    def get_row_dict(self, cursor, row):
+        row_dict = {}
+        for idx, col in enumerate(cursor.description):
+            row_dict[col[0]] = row[idx]
+        return row_dict
@@ -0,0 +1,305 @@
+"""Timers module; fire the timers of the waiting steps [delays, approval timeouts]."""
+from __future__ import annotations
+
+import heapq
+import logging
+import sqlite3
+import time
+
+from enum import Enum
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Set, Tuple
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from wfengine.base_runner import RunStatus
+from wfengine.schema import blob_to_uuid, migrate, uuid_to_blob
+
+if TYPE_CHECKING:  # pragma: no cover
+    from wfengine.wf_runner import WFRunner
+    from wfengine.work_queue import WorkQueue
+
+logger = logging.getLogger(__name__)
+
+
+class TimerAction(str, Enum):
+    """What happens when the timer of a waiting step is due"""
+
+    RESUME = "resume"  # Resume the step [e.g. the delay has elapsed]
+    TIMEOUT = "timeout"  # Kill the run [e.g. the approval has timed out]
+
+
+class Timer(BaseModel):
+    """A pending timer [row in the wf_timer table]"""
+
+    id: int
+    transaction_id: UUID
+    workflow: str
+    """The workflow (definition) name; used to load the runner"""
+
+    step_id: str
+    action: TimerAction
+    due_at: float
+    """Epoch time at which the timer fires"""
+
+    attempts: int = 0
+    """The failed attempts to fire the timer"""
+
+
+class TimerService(object):
+    """
+    Fires the due timers. The timers are persisted in the wf_timer table (one row
+    per timer, indexed by the due time) so only the timers due within `horizon`
+    secs are loaded into an in-memory heap; the pending timers are never scanned.
+    The runs are resumed (or killed) directly, or via TIMER messages on the work
+    queue [when a `queue` is specified]. A timer is fired once even with multiple
+    services: A queued timer is marked as Fired in the transaction that queues
+    its message. Else, the timer is leased (pushed out by `lease` secs) while the
+    run is resumed and is fired again only if the service died meanwhile [the
+    timer of a run no longer waiting is ignored]. A failed timer is retried after
+    `retry_delay` secs, doubled on every attempt; after `max_attempts`, the timer
+    and the run (if still waiting) are marked as Failed.
+    """
+
+    def __init__(
+        self,
+        db_file: Path | str,
+        queue: WorkQueue | None = None,
+        commit_policy: Dict[str, Any] | None = None,
+        horizon: float = 60.0,
+        poll_interval: float = 1.0,
+        batch_size: int = 1000,
+        retry_delay: float = 30.0,
+        max_attempts: int = 5,
+        lease: float = 600.0,
+    ) -> None:
+        self.db_file = str(db_file)
+        if queue is not None and Path(queue.db_file) != Path(self.db_file):
+            raise ValueError("The work queue must be in the workflow DB")
+        self.queue = queue
+        # NOTE: STEP; the RUN mode holds the DB write lock for each resumed run
+        self.commit_policy = commit_policy or {"mode": "step"}
+        self.horizon = horizon
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+        self._conn = sqlite3.connect(self.db_file, timeout=30.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        migrate(self._conn)
+        self._heap: List[Tuple[float, int, Timer]] = []
+        self._loaded: Set[int] = set()
+        self._runners: Dict[str, WFRunner] = {}
+        self._pool: Any = None
+        self.stopping = False
+
+    def load(self, now: float) -> int:
+        """Load the timers due within the horizon [that are not already loaded]"""
+        rows = self._conn.execute(
+            """
+            SELECT id, wf_id, workflow, step_id, action, due_at, attempts
+            FROM wf_timer
+            WHERE status = 'Pending' AND due_at <= ?
+            ORDER BY due_at LIMIT ?
+            """,
+            [now + self.horizon, self.batch_size + len(self._loaded)],
+        ).fetchall()
+        loaded = 0
+        for timer_id, wf_id, workflow, step_id, action, due_at, attempts in rows:
+            if timer_id in self._loaded:
+                continue
+            timer = Timer(
+                id=timer_id,
+                transaction_id=blob_to_uuid(wf_id),
+                workflow=workflow,
+                step_id=step_id,
+                action=TimerAction(action),
+                due_at=due_at,
+                attempts=attempts,
+            )
+            heapq.heappush(self._heap, (due_at, timer_id, timer))
+            self._loaded.add(timer_id)
+            loaded += 1
+        return loaded
+
+    def fire_due(self, now: float) -> int:
+        """Fire the timers that are due. Returns the number of timers fired"""
+        fired = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, timer_id, timer = heapq.heappop(self._heap)
+            self._loaded.discard(timer_id)
+            try:
+                if self.queue:
+                    if not self.enqueue(timer):
+                        continue  # Cancelled, or fired by another service
+                else:
+                    if not self.claim(timer, now):
+                        continue
+                    self.fire(timer)
+                    self.set_status(timer, "Fired")
+                fired += 1
+            except Exception as e:
+                logger.error(f"Timer {timer.id} [{timer.action.value}] failed: {e}")
+                self.retry(timer, now, str(e))
+        return fired
+
+    def claim(self, timer: Timer, now: float) -> bool:
+        """Lease the timer [i.e. push it out] while it is fired"""
+        cursor = self._conn.execute(
+            "UPDATE wf_timer SET due_at = ?, updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND status = 'Pending' AND due_at <= ?",
+            [now + self.lease, timer.id, now],
+        )
+        return cursor.rowcount == 1
+
+    def enqueue(self, timer: Timer) -> bool:
+        """Mark the timer as Fired and queue its TIMER message [one transaction]"""
+        from wfengine.work_queue import MessageAction
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self._conn.execute(
+                "UPDATE wf_timer SET status = 'Fired', updated_at = CURRENT_TIMESTAMP "
+                "WHERE id = ? AND status = 'Pending' AND due_at = ?",
+                [timer.id, timer.due_at],
+            )
+            if cursor.rowcount != 1:
+                self._conn.execute("ROLLBACK")
+                return False
+            self.log_fired(timer)
+            self.queue.enqueue(  # type: ignore
+                MessageAction.TIMER,
+                timer.workflow,
+                {"step_id": timer.step_id, "action": timer.action.value},
+                transaction_id=timer.transaction_id,
+                conn=self._conn,
+            )
+            self._conn.execute("COMMIT")
+            return True
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def retry(self, timer: Timer, now: float, reason: str) -> None:
+        """Fire the timer again after a backoff [or fail it, after max_attempts]"""
+        timer.attempts += 1
+        if timer.attempts >= self.max_attempts:
+            self.give_up(timer, reason)
+            return
+        delay = self.retry_delay * 2 ** (timer.attempts - 1)
+        self._conn.execute(
+            "UPDATE wf_timer SET status = 'Pending', due_at = ?, attempts = ?, "
+            "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [now + delay, timer.attempts, timer.id],
+        )
+
+    def give_up(self, timer: Timer, reason: str) -> None:
+        """Mark the timer and the run (and step) waiting for it as Failed"""
+        reason = f"Timer [{timer.action.value}] failed {timer.attempts} times: {reason}"
+        logger.error(f"{reason} // {timer.step_id} / {timer.transaction_id}")
+        wf_id = uuid_to_blob(timer.transaction_id)
+        waiting, failed = RunStatus.WAITING.value, RunStatus.FAILED.value
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "UPDATE wf_timer SET status = 'Failed', attempts = ?, "
+                "updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                [timer.attempts, timer.id],
+            )
+            self._conn.execute(
+                "UPDATE wf_step_run SET status = ?, reason = ?, "
+                "updated_at = CURRENT_TIMESTAMP "
+                "WHERE wf_id = ? AND step_name = ? AND status = ?",
+                [failed, reason, wf_id, timer.step_id, waiting],
+            )
+            self._conn.execute(
+                "UPDATE wf_run SET status = ?, reason = ?, "
+                "updated_at = CURRENT_TIMESTAMP "
+                "WHERE transaction_id = ? AND status = ?",
+                [failed, reason, wf_id, waiting],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def set_status(self, timer: Timer, status: str) -> None:
+        self._conn.execute(
+            "UPDATE wf_timer SET status = ?, updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = ?",
+            [status, timer.id],
+        )
+
+    def log_fired(self, timer: Timer) -> None:
+        logger.info(
+            f"Timer {timer.id} [{timer.action.value}] fired: "
+            f"{timer.workflow} / {timer.step_id} / {timer.transaction_id}"
+        )
+
+    def fire(self, timer: Timer) -> None:
+        """Resume (or kill) the run"""
+        self.log_fired(timer)
+        runner = self.runner_for(timer.workflow)
+        try:
+            runner.fire_timer(str(timer.transaction_id), timer.step_id, timer.action)
+        finally:
+            runner.store.flush()
+
+    def runner_for(self, workflow: str) -> WFRunner:
+        """A (new) runner for the workflow; the definitions are loaded once"""
+        from wfengine.commit_policy import CommitPolicy
+        from wfengine.stores import SqlitePool
+        from wfengine.wf_runner import WFRunner
+
+        if self._pool is None:
+            self._pool = SqlitePool(self.db_file, CommitPolicy(**self.commit_policy))
+        template = self._runners.get(workflow)
+        if template is None:
+            # NOTE: The owner is restored from the run when the timer is fired
+            template = WFRunner.from_file(
+                workflow, self._pool, owner="unknown", metadata={"source": "timer"}
+            )
+            self._runners[workflow] = template
+        return template.model_copy(update={"transaction_id": None, "working_dir": None})
+
+    def next_wakeup(self, now: float) -> float:
+        """Secs to sleep till the next timer is due [or the next DB poll]"""
+        if self._heap:
+            return max(0.0, min(self._heap[0][0] - now, self.poll_interval))
+        return self.poll_interval
+
+    def stop(self, *_) -> None:
+        """Stop the service [safe to call from a signal handler]"""
+        self.stopping = True
+
+    def serve(self) -> None:
+        """Fire the timers till the service is stopped."""
+        logger.info(f"Timer service started on {self.db_file}")
+        next_load = 0.0
+        try:
+            while not self.stopping:
+                now = time.time()
+                if now >= next_load:
+                    self.load(now)
+                    next_load = now + self.poll_interval
+                self.fire_due(now)
+                time.sleep(self.next_wakeup(time.time()))
+        finally:
+            self.close()
+            logger.info("Timer service stopped")
+
+    def pending(self) -> int:
+        """Number of pending timers"""
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM wf_timer WHERE status = 'Pending'"
+        ).fetchone()
+        return row[0]
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        self._conn.close()
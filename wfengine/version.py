@@ -0,0 +1,3 @@
+"""Version of the wfengine package."""
+
+__version__ = "0.1.0"
@@ -1,27 +1,79 @@
 """WF Runner module."""
 from __future__ import annotations
 
-import json
 import logging
 import os
 import sqlite3
+import threading
+import time
 
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict
+from queue import Queue
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Set,
+    Tuple,
+)
 from uuid import UUID, uuid4
 
 from wfengine.base_runner import ActionRegister, BaseRunner, RunStatus
-from wfengine.workflow import WFResult, WFStep, Workflow
+from wfengine.definition_cache import load_workflow
+from wfengine.step_cache import default_step_cache
+from wfengine.stores import SqlitePool, SqliteStore, StateStore
+from wfengine.workflow import ExecutionPlan, JoinMode, WFResult, WFStep, Workflow
+
+if TYPE_CHECKING:  # pragma: no cover
+    from wfengine.timers import TimerAction
 
 logger = logging.getLogger(__name__)
 
+CANCEL_POLL_INTERVAL = 0.5
+"""Min. secs between the checks (store queries) for a cancel request of a run"""
+
+
+@dataclass(slots=True)
+class BranchResult:
+    """The result of running one of the parallel branches of a fork"""
+
+    status: RunStatus
+    reason: str
+
+    join_index: int | None = None
+    """The join step reached by the branch [None if the branch did not reach one]"""
+
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    """The outputs of all the steps executed in the branch"""
+
+
+@dataclass(slots=True)
+class RunState:
+    """The mutable state of a run (or resume) [`wf_context["run_state"]`]"""
+
+    transaction_id: UUID | None
+
+    cancel_checked_at: float = 0.0
+    """When the store was last checked for a cancel request [monotonic]"""
+
+    cancelled: bool = False
+    """A cancel has been requested for the run"""
+
 
 @ActionRegister(label="Run Workflow Actions")
 class WFRunner(BaseRunner):
     """Class to orchestrate/run the given workflow."""
 
-    sql_conn: Any  # Sqlite3 connection
-    """Sqlite3 connection to store the workflow run details."""
+    may_wait = True
+
+    store: StateStore
+    """The store for the workflow run details."""
 
     workflow: Workflow
     transaction_id: UUID | None = None
@@ -33,13 +85,34 @@ class WFRunner(BaseRunner):
     metadata: Dict[str, Any] = {}
     """Any metadata included with the workflow."""
 
+    wf_name: str | None = None
+    """The definition (file) name the workflow is loaded from [see `from_file`]"""
+
+    dataflow: bool = False
+    """
+    Run the steps as soon as the steps they depend on (by input/output keys) have
+    completed, instead of strictly one after the other [see `run_chain`]
+    """
+
+    step_cache: Any = None  # StepCache
+    """
+    The cache for the outputs of the cacheable actions [default: the process-wide
+    `default_step_cache()`; see WFStep.cache]
+    """
+
     @property
     def name(self) -> str:
         return f"WF:{self.workflow.name}"
 
     @staticmethod
-    def from_file(wf_name: str, sql_conn, **kwargs) -> BaseRunner:
-        """Create an WFRunner from a definition file."""
+    def from_file(
+        wf_name: str, store: StateStore | SqlitePool | sqlite3.Connection, **kwargs
+    ) -> BaseRunner:
+        """
+        Create an WFRunner from a definition file. A plain sqlite3 connection is
+        wrapped in a SqliteStore [with the `commit_policy` if specified], as is a
+        SqlitePool [for runners in multiple threads sharing the DB]
+        """
         if not wf_name:
             raise ValueError("Workflow name must be provided")
 
@@ -52,18 +125,23 @@ class WFRunner(BaseRunner):
         logger.info(f"Loading Workflow from {def_file}")
 
         try:
-            with open(def_file) as f:
-                wf_def = json.load(f)
-                workflow = Workflow(**wf_def)
+            # Compiled definitions are cached [keyed by the file content hash]
+            workflow = load_workflow(def_file)
 
             if not kwargs.get("owner"):
                 owner = kwargs.get("metadata", {}).get("owner")
                 if not owner:
                     raise ValueError("Workflow Owner must be specified")
                 kwargs["owner"] = kwargs.get("metadata", {}).pop("owner")
+            if isinstance(store, sqlite3.Connection):
+                commit_policy = kwargs.pop("commit_policy", {})
+                store = SqliteStore(sql_conn=store, commit_policy=commit_policy)
+            elif isinstance(store, SqlitePool):
+                store = SqliteStore(pool=store)
+            kwargs.setdefault("wf_name", wf_name)
             return WFRunner(
                 workflow=workflow,
-                sql_conn=sql_conn,
+                store=store,
                 **kwargs,
             )
         except Exception as e:
@@ -76,146 +154,341 @@ class WFRunner(BaseRunner):
     def output_keys(self):
         return self.workflow.output_keys
 
-    def get_last_transaction_id(self) -> str:
-        """Get the last transaction ID from the database."""
-        cursor = self.sql_conn.cursor()
-        result = cursor.execute(
-            "SELECT transaction_id FROM wf_run ORDER BY created_at DESC LIMIT 1"
-        )
-        row = result.fetchone()
-        return None if not row else row[0]
+    def context_keys(self, parameters: Dict[str, Any]) -> Set[str] | None:
+        # The steps of a sub-workflow may read any of the variables
+        return None
+
+    def get_last_transaction_id(self) -> str | None:
+        """Get the last transaction ID from the store."""
+        transaction_id = self.store.get_last_transaction_id()
+        return str(transaction_id) if transaction_id else None
 
     def log_run(self, status: RunStatus, reason: str, context: Dict[str, Any]):
-        """Log the workflow run details to the database."""
-        cursor = self.sql_conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO wf_run (
-                transaction_id, working_dir, owner, context, status, reason
-            ) VALUES (
-                ?, ?, ?, ?, ?, ?
-            )
-            """,
-            [
-                str(self.transaction_id),
-                str(self.working_dir),
-                self.owner,
-                json.dumps(context),
-                status,
-                reason,
-            ],
+        """Log the workflow run details to the store."""
+        self.store.create_run(
+            self.transaction_id, self.working_dir, self.owner, status, reason, context
         )
-        self.sql_conn.commit()
 
     def update_run(self, status: RunStatus, reason: str, context: Dict[str, Any]):
-        """Update the workflow run details to the database."""
-        cursor = self.sql_conn.cursor()
-        try:
-            cursor.execute(
-                """
-                UPDATE wf_run SET
-                    status = ?, reason = ?, context = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE
-                    transaction_id = ?
-                """,
-                [status, reason, json.dumps(context), str(self.transaction_id)],
-            )
-            self.sql_conn.commit()
-        except sqlite3.Error as err:
-            logger.error(f"Error updating wf_run: {err}")
-            raise err
+        """Update the workflow run details to the store."""
+        self.store.update_run(self.transaction_id, status, reason, context)
 
     def log_step_run(self, step: WFStep, result: WFResult):
-        """Log the step run details to the database."""
-        cursor = self.sql_conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO wf_step_run (
-                wf_id, step_name, input, output, status, reason
-            ) VALUES (
-                ?, ?, ?, ?, ?, ?
-            )
-            """,
-            [
-                str(self.transaction_id),
-                step.id,
-                json.dumps(result.inputs),
-                json.dumps(result.outputs),
-                result.status,
-                result.completion_reason,
-            ],
-        )
-        self.sql_conn.commit()
+        """Log the step run details [and its timers] to the store."""
+        self.schedule_timers(step, result)
+        self.store.record_step(self.transaction_id, step.id, result)
 
     def update_step_run(self, step: WFStep, result: WFResult) -> None:
-        """Update the step run details to the database when we have resumed"""
-        cursor = self.sql_conn.cursor()
-        try:
-            cursor.execute(
-                """
-                UPDATE wf_step_run SET
-                    input = ?, output = ?, status = ?, reason = ?,
-                    updated_at = CURRENT_TIMESTAMP
-                WHERE
-                    wf_id = ? AND step_name = ?
-                """,
-                [
-                    json.dumps(result.inputs),
-                    json.dumps(result.outputs),
-                    result.status,
-                    result.completion_reason,
-                    str(self.transaction_id),
-                    step.id,
-                ],
+        """Update the step run details to the store when we have resumed"""
+        self.schedule_timers(step, result)
+        self.store.record_step(self.transaction_id, step.id, result, resumed=True)
+        if not result.status.is_waiting():
+            self.store.cancel_timers(self.transaction_id, step.id)
+
+    async def arecord_step_run(
+        self, step: WFStep, result: WFResult, resumed=False
+    ) -> None:
+        """Same as `log_step_run`/`update_step_run` using the async store API"""
+        await self.store.call_async(self.schedule_timers, step, result)
+        await self.store.arecord_step(
+            self.transaction_id, step.id, result, resumed=resumed
+        )
+        if resumed and not result.status.is_waiting():
+            await self.store.call_async(
+                self.store.cancel_timers, self.transaction_id, step.id
             )
-            self.sql_conn.commit()
-        except sqlite3.Error as err:
-            logger.error(f"Error updating wf_step_run: {err}")
-            raise err
 
-    def get_row_dict(self, cursor, row):
-        row_dict = {}
-        for idx, col in enumerate(cursor.description):
-            row_dict[col[0]] = row[idx]
-        return row_dict
+    def schedule_timers(self, step: WFStep, result: WFResult) -> None:
+        """
+        Schedule the timers of a waiting step [see TimerService]. The timers are
+        saved before the step so a crash in between only leaves a timer that is
+        ignored when it fires [the step is not waiting].
+        """
+        if not result.status.is_waiting():
+            return
+        from wfengine.timers import TimerAction
+
+        for action, due_at in [
+            (TimerAction.RESUME, result.resume_at),
+            (TimerAction.TIMEOUT, result.timeout_at),
+        ]:
+            if due_at is not None:
+                self.store.schedule_timer(
+                    self.transaction_id,
+                    self.wf_name or self.workflow.name,
+                    step.id,
+                    action,
+                    due_at,
+                )
 
     def restore_transaction(self, transaction_id: UUID | None, **kwargs):
         """Resume a workflow from a previous run."""
-        cursor = self.sql_conn.cursor()
-        result = cursor.execute(
-            "SELECT * FROM wf_run where transaction_id = ?", [str(transaction_id)]
-        )
-        row = result.fetchone()
-        if not row:
-            raise ValueError(
-                f"Transaction ID not found: {transaction_id}, Cannot resume"
-            )
-        row_dict = self.get_row_dict(cursor, row)
-        return row_dict
+        return self.store.get_run(transaction_id)
 
     def get_waiting_step(self, transaction_id: UUID) -> str:
-        cursor = self.sql_conn.cursor()
-        result = cursor.execute(
-            "SELECT * FROM wf_step_run where wf_id = ? and status = ?",
-            [str(transaction_id), RunStatus.WAITING.value],
-        )
-        # [LATER] What if two steps are waiting? In that case, we will need a CLI
-        # argument to indicate which step to resume. Anyways, from the front-end,
-        # we will always know that.
-        row = result.fetchone()
-        if not row:
+        step_id = self.store.get_waiting_step(transaction_id)
+        if not step_id:
             raise ValueError(
                 f"No Step found in waiting state: {transaction_id}, Cannot resume"
             )
-        row_dict = self.get_row_dict(cursor, row)
-        logger.debug(f"Step Run [Waiting] = {row_dict['step_name']} // {row_dict}")
-        return row_dict["step_name"]
+        return step_id
 
     def resume(self, **kwargs) -> Dict[str, Any]:
         transaction_id = kwargs.pop("transaction_id")
         if transaction_id == "last":
             transaction_id = self.get_last_transaction_id()
 
+        transaction_id = self.resume_transaction_id(transaction_id)
+        db_row = self.restore_transaction(transaction_id, **kwargs)
+        curr_step = self.resume_step(
+            transaction_id, self.get_waiting_step(transaction_id)
+        )
+        context = self.restore_context(transaction_id, db_row, kwargs)
+        return self.run_internal(
+            curr_step,
+            status=RunStatus(db_row["status"]),
+            completion_reason=db_row["reason"],
+            **context,
+        )
+
+    async def aresume(self, **kwargs) -> Dict[str, Any]:
+        """Resume the workflow [async]; Same as `resume` using the async store API"""
+        transaction_id = kwargs.pop("transaction_id")
+        if transaction_id == "last":
+            last_transaction_id = await self.store.aget_last_transaction_id()
+            transaction_id = str(last_transaction_id) if last_transaction_id else None
+
+        transaction_id = self.resume_transaction_id(transaction_id)
+        db_row = await self.store.aget_run(transaction_id)
+        curr_step = self.resume_step(
+            transaction_id, await self.store.aget_waiting_step(transaction_id)
+        )
+        context = self.restore_context(transaction_id, db_row, kwargs)
+        return await self.arun_internal(
+            curr_step,
+            status=RunStatus(db_row["status"]),
+            completion_reason=db_row["reason"],
+            **context,
+        )
+
+    def fire_timer(
+        self, transaction_id: str, step_id: str, action: TimerAction
+    ) -> Dict[str, Any]:
+        """
+        Resume the run waiting at the step [or kill it, on a timeout]. The timer
+        is ignored if the run is no longer waiting at the step.
+        """
+        from wfengine.timers import TimerAction
+
+        transaction_id = self.resume_transaction_id(transaction_id)
+        db_row = self.restore_transaction(transaction_id)
+        status = RunStatus(db_row["status"])
+        waiting_step = self.store.get_waiting_step(transaction_id)
+        if not status.is_waiting() or waiting_step != step_id:
+            logger.info(f"Timer ignored; {step_id} is not waiting: {transaction_id}")
+            return {"status": status, "reason": db_row["reason"]}
+
+        curr_step = self.resume_step(transaction_id, step_id)
+        context = self.restore_context(transaction_id, db_row, {})
+        if action == TimerAction.RESUME:
+            return self.run_internal(
+                curr_step, status=status, completion_reason=db_row["reason"], **context
+            )
+
+        reason = f"Step [{step_id}] timed out"
+        self.update_step_run(
+            curr_step, self.stopped_result(curr_step, RunStatus.KILLED, reason)
+        )
+        self.update_run(RunStatus.KILLED, reason, context)
+        wf_context = {"variables": context}
+        return self.run_result(curr_step, RunStatus.KILLED, reason, wf_context)
+
+    def cancel(self, transaction_id: str) -> Dict[str, Any]:
+        """
+        Cancel the run. A waiting run is cancelled right away; a run in progress
+        is stopped (as CANCELLED) before its next step [the steps in progress
+        complete]. Runs that have already ended are left as is.
+        """
+        if transaction_id == "last":
+            transaction_id = self.get_last_transaction_id()
+        if not transaction_id:
+            raise ValueError("Transaction ID must be provided")
+
+        self.transaction_id = UUID(transaction_id)
+        db_row = self.restore_transaction(self.transaction_id)
+        status = RunStatus(db_row["status"])
+        if status not in [RunStatus.STARTED, RunStatus.WAITING]:
+            logger.info(f"Run has already ended [{status}]: {transaction_id}")
+            return {"status": status, "reason": db_row["reason"]}
+
+        self.store.request_cancel(self.transaction_id)
+        if not status.is_waiting():
+            logger.info(f"Cancel requested; stops at the next step: {transaction_id}")
+            return {"status": status, "reason": "Cancel requested"}
+
+        reason = "Workflow cancelled"
+        curr_step = self.resume_step(
+            self.transaction_id, self.get_waiting_step(self.transaction_id)
+        )
+        context = self.restore_context(self.transaction_id, db_row, {})
+        self.update_step_run(
+            curr_step, self.stopped_result(curr_step, RunStatus.CANCELLED, reason)
+        )
+        self.update_run(RunStatus.CANCELLED, reason, context)
+        wf_context = {"variables": context}
+        return self.run_result(curr_step, RunStatus.CANCELLED, reason, wf_context)
+
+    @staticmethod
+    def stopped_result(step: WFStep, status: RunStatus, reason: str) -> WFResult:
+        """The result of a waiting step that is not resumed [the run has ended]"""
+        return WFResult(
+            step_id=step.id,
+            action=step.action.name,
+            inputs={},
+            outputs={},
+            status=status,
+            completion_reason=reason,
+        )
+
+    def run_many(
+        self, requests: Iterable[Dict[str, Any]], max_workers: int = 8
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Run (or resume) many workflow instances sharing this runner's workflow and
+        store. A request with a `transaction_id` resumes that run, else a new run
+        is started [an `owner` in the request overrides the runner's owner]. The
+        results are yielded as they complete, with the `request_index` and the
+        `transaction_id` of each request.
+        """
+        if not self.store.thread_safe:
+            logger.warning(f"Store {self.store} is not thread safe: Running serially")
+            for index, request in enumerate(requests):
+                yield self.run_request(index, request)
+            return
+
+        # NOTE: Imported here; it loads the process pool [not needed by a run]
+        from wfengine.batch import IN_FLIGHT_PER_WORKER, stream_results
+
+        with ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="wf-batch"
+        ) as executor:
+            yield from stream_results(
+                executor,
+                self.run_request,
+                requests,
+                max_in_flight=max_workers * IN_FLIGHT_PER_WORKER,
+            )
+        self.store.flush()
+
+    def run_request(self, index: int, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Run (or resume) one of the requests in `run_many` on a copy of the runner"""
+        request = dict(request)
+        runner = self.model_copy(update={"transaction_id": None, "working_dir": None})
+        if request.get("owner"):
+            runner.owner = request.pop("owner")
+        try:
+            if request.get("transaction_id"):
+                result = runner.resume(**request)
+            else:
+                result = runner.run(**request)
+        except Exception as e:
+            logger.error(f"Request [{index}] failed: {e}")
+            result = {"status": RunStatus.FAILED, "reason": str(e)}
+        transaction_id = str(runner.transaction_id) if runner.transaction_id else None
+        return {"request_index": index, "transaction_id": transaction_id, **result}
+
+    def resume_many(
+        self,
+        requests: Iterable[Tuple[str | UUID, Dict[str, Any]]],
+        batch_size: int = 500,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Resume many waiting runs [e.g. a burst of approvals] given the pairs of
+        (transaction_id, kwargs). For each batch, the runs and their waiting steps
+        are fetched with a few set based queries, the runs are resumed grouped by
+        the waiting step and all the writes are committed in one transaction. The
+        results (with the `request_index` and `transaction_id`) are yielded once
+        the batch is committed. Multiple requests for the same run are resumed
+        one after the other [in the next batches].
+        """
+        pending: List[Tuple[int, str | UUID, Dict[str, Any]]] = []
+        for index, (transaction_id, kwargs) in enumerate(requests):
+            pending.append((index, transaction_id, kwargs))
+            if len(pending) >= batch_size:
+                pending = yield from self.resume_batch(pending)
+        while pending:
+            pending = yield from self.resume_batch(pending)
+
+    def resume_batch(
+        self, requests: List[Tuple[int, str | UUID, Dict[str, Any]]]
+    ) -> Generator[Dict[str, Any], None, List[Tuple[int, str | UUID, Dict[str, Any]]]]:
+        """Resume a batch of `resume_many`; returns the requests left for later"""
+        batch: List[Tuple[int, UUID, Dict[str, Any]]] = []
+        later, results, seen = [], [], set()
+        for index, transaction_id, kwargs in requests:
+            try:
+                transaction_id = UUID(str(transaction_id))
+            except ValueError as e:
+                results.append(self.failed_request(index, transaction_id, e))
+                continue
+            if transaction_id in seen:
+                later.append((index, transaction_id, kwargs))
+            else:
+                seen.add(transaction_id)
+                batch.append((index, transaction_id, kwargs))
+
+        transaction_ids = [transaction_id for _, transaction_id, _ in batch]
+        runs = self.store.get_runs(transaction_ids)
+        waiting_steps = self.store.get_waiting_steps(transaction_ids)
+        batch.sort(key=lambda request: waiting_steps.get(request[1]) or "")
+        logger.info(f"Resuming {len(batch)} runs [{len(later)} later]")
+        with self.store.deferred_commits():
+            for index, transaction_id, kwargs in batch:
+                runner = self.model_copy(
+                    update={"transaction_id": None, "working_dir": None}
+                )
+                try:
+                    db_row = runs.get(transaction_id)
+                    if db_row is None:
+                        raise ValueError(
+                            f"Transaction ID not found: {transaction_id}, Cannot resume"
+                        )
+                    curr_step = runner.resume_step(
+                        transaction_id, waiting_steps.get(transaction_id)
+                    )
+                    context = runner.restore_context(transaction_id, db_row, kwargs)
+                    result = runner.run_internal(
+                        curr_step,
+                        status=RunStatus(db_row["status"]),
+                        completion_reason=db_row["reason"],
+                        **context,
+                    )
+                    results.append(
+                        {
+                            "request_index": index,
+                            "transaction_id": str(transaction_id),
+                            **result,
+                        }
+                    )
+                except Exception as e:
+                    results.append(self.failed_request(index, transaction_id, e))
+
+        yield from sorted(results, key=lambda result: result["request_index"])
+        return later
+
+    @staticmethod
+    def failed_request(
+        index: int, transaction_id: str | UUID, error: Exception
+    ) -> Dict[str, Any]:
+        logger.error(f"Request [{index}] failed: {error}")
+        return {
+            "request_index": index,
+            "transaction_id": str(transaction_id),
+            "status": RunStatus.FAILED,
+            "reason": str(error),
+        }
+
+    def resume_transaction_id(self, transaction_id: str | None) -> UUID:
         if not transaction_id:
             raise ValueError("Transaction ID must be provided")
 
@@ -223,56 +496,206 @@ class WFRunner(BaseRunner):
             f"Workflow resumed: {self.workflow.name} // {self.workflow.first_step} "
             f"// {transaction_id}"
         )
-        # Restore context from the working directory and continue
-        if transaction_id:
-            transaction_id = UUID(transaction_id)
-        db_row = self.restore_transaction(transaction_id, **kwargs)
+        return UUID(transaction_id)
+
+    def restore_context(
+        self, transaction_id: UUID, db_row: Dict[str, Any], kwargs: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Restore the runner state and context from the run [stored] details"""
         self.transaction_id = transaction_id
         self.working_dir = Path(db_row["working_dir"])
         self.owner = db_row["owner"]
-        context = json.loads(db_row["context"])
+        # The run continues here [the store keeps the checkpoint, before the kwargs]
+        self.store.track_run(transaction_id, db_row)
+        context = db_row["context"]
         logger.debug(f"Context: {context} / Kwargs: {kwargs}")
         context.update(kwargs)
+        return context
 
-        curr_step_id = self.get_waiting_step(transaction_id)
-        curr_step = self.workflow.get_step(curr_step_id)
+    def resume_step(self, transaction_id: UUID, step_id: str | None) -> WFStep:
+        if not step_id:
+            raise ValueError(
+                f"No Step found in waiting state: {transaction_id}, Cannot resume"
+            )
+        curr_step = self.workflow.get_step(step_id)
         if not curr_step:
-            raise ValueError(f"Resume Step not found: {curr_step_id}")
+            raise ValueError(f"Resume Step not found: {step_id}")
+        return curr_step
 
+    def run(self, **kwargs) -> Dict[str, Any]:
+        return self.run_transaction(uuid4(), **kwargs)
+
+    def run_transaction(self, transaction_id: UUID, **kwargs) -> Dict[str, Any]:
+        """Run the workflow as a new transaction with the given (unused) ID"""
+        status, completion_reason = self.start_transaction(transaction_id)
+        self.log_run(status, completion_reason, kwargs)
+
+        curr_step: WFStep | None = self.workflow.first_step
         return self.run_internal(
-            curr_step,
-            status=RunStatus(db_row["status"]),
-            completion_reason=db_row["reason"],
-            **context,
+            curr_step, status=status, completion_reason=completion_reason, **kwargs
         )
 
-    def run(self, **kwargs) -> Dict[str, Any]:
+    async def arun(self, **kwargs) -> Dict[str, Any]:
+        """
+        Run the workflow [async]. The actions are awaited (sync actions run in
+        worker threads) and the state is persisted using the async store API.
+        NOTE: The runner holds the per-run state; use one runner per workflow run.
+        """
+        status, completion_reason = self.start_transaction(uuid4())
+        await self.store.acreate_run(
+            self.transaction_id,
+            self.working_dir,
+            self.owner,
+            status,
+            completion_reason,
+            kwargs,
+        )
+
+        curr_step: WFStep | None = self.workflow.first_step
+        return await self.arun_internal(
+            curr_step, status=status, completion_reason=completion_reason, **kwargs
+        )
+
+    def start_transaction(self, transaction_id: UUID) -> Tuple[RunStatus, str]:
+        """Setup a new transaction (and its working directory) for the run"""
         logger.info(
             f"Workflow invoked: {self.workflow.name} // {self.workflow.first_step} "
-            f"// {self.transaction_id}"
+            f"// {transaction_id}"
         )
         root_path = Path(os.getenv("WF_ROOT_DIR", os.getcwd()))
-        status = RunStatus.STARTED
-        completion_reason = "Workflow Started"
-        self.transaction_id: UUID = uuid4()
+        self.transaction_id: UUID = transaction_id
         self.working_dir = root_path / "workflows" / str(self.transaction_id)
         # self.working_dir.mkdir(parents=True, exist_ok=True)
-        self.log_run(status, completion_reason, kwargs)
-
-        curr_step: WFStep | None = self.workflow.first_step
-        return self.run_internal(
-            curr_step, status=status, completion_reason=completion_reason, **kwargs
-        )
+        return RunStatus.STARTED, "Workflow Started"
 
     def run_internal(
         self, curr_step, status, completion_reason, **kwargs
+    ) -> Dict[str, Any]:
+        try:
+            return self.run_steps(curr_step, status, completion_reason, **kwargs)
+        except BaseException:
+            # The run did not reach `update_run`; Drop the state kept by the store
+            self.store.release_run(self.transaction_id)
+            raise
+
+    def run_steps(
+        self, curr_step, status, completion_reason, **kwargs
     ) -> Dict[str, Any]:
         # Save the first step. We will need this to handle resumed workflow
-        first_step_id = curr_step.id
-        resumed_step_id = (
-            first_step_id if (first_step_id != self.workflow.first_step.id) else None
+        plan = self.workflow.plan
+        curr_index: int | None = plan.index_of(curr_step.id)
+        # NOTE: A resumed run is WAITING [the first step can wait, e.g. a delay]
+        resumed_index = curr_index if status.is_waiting() else None
+        wf_context = self.setup_context(curr_step, status, kwargs)
+
+        # Get the first step to execute
+        while curr_index is not None:
+            stopped = self.stop_outcome(wf_context)
+            if stopped:
+                status, completion_reason = stopped
+                curr_step = plan.steps[curr_index]
+                if resumed_index == curr_index:
+                    # The waiting step ends with the run [it is not resumed]
+                    result = self.stopped_result(curr_step, *stopped)
+                    self.update_step_run(curr_step, result)
+                break
+
+            resumed_step = resumed_index == curr_index
+            chain = (
+                plan.dataflow_chain(curr_index)
+                if self.dataflow and not resumed_step
+                else [curr_index]
+            )
+            if len(chain) > 1:
+                # Run the chain of steps as per their data dependencies
+                curr_index, result = self.run_chain(plan, chain, wf_context)
+                curr_step = plan.steps[curr_index]
+            else:
+                curr_step = plan.steps[curr_index]
+                result = curr_step.execute(wf_context, resumed_step=resumed_step)
+                if logger.isEnabledFor(logging.INFO):  # Avoid the repr otherwise
+                    logger.info(f"Result: {result}")
+                wf_context["variables"].update(result.outputs)  # type: ignore
+                if resumed_step:
+                    # We have resumed the workflow, and the first step has changed!
+                    # We need to update the first step and continue
+                    self.update_step_run(curr_step, result)
+                else:
+                    self.log_step_run(curr_step, result)
+
+            # Check Status, and get the next step
+            ends_run = result.status.not_successful() or result.status.is_waiting()
+            if curr_index in plan.forks and not ends_run:
+                # Run the branches in parallel, and continue from the join step
+                status, completion_reason, curr_index = self.run_fork(
+                    plan, curr_index, wf_context
+                )
+            else:
+                status, completion_reason, curr_index = self.step_outcome(
+                    plan, curr_index, result, wf_context
+                )
+
+            # End While Loop
+        self.update_run(status, completion_reason, wf_context["variables"])
+        return self.run_result(curr_step, status, completion_reason, wf_context)
+
+    async def arun_internal(
+        self, curr_step, status, completion_reason, **kwargs
+    ) -> Dict[str, Any]:
+        """Same as `run_internal`; awaits the actions and the store"""
+        try:
+            return await self.arun_steps(curr_step, status, completion_reason, **kwargs)
+        except BaseException:
+            self.store.release_run(self.transaction_id)
+            raise
+
+    async def arun_steps(
+        self, curr_step, status, completion_reason, **kwargs
+    ) -> Dict[str, Any]:
+        plan = self.workflow.plan
+        curr_index: int | None = plan.index_of(curr_step.id)
+        # NOTE: A resumed run is WAITING [the first step can wait, e.g. a delay]
+        resumed_index = curr_index if status.is_waiting() else None
+        wf_context = self.setup_context(curr_step, status, kwargs)
+
+        while curr_index is not None:
+            curr_step = plan.steps[curr_index]
+            resumed_step = resumed_index == curr_index
+            stopped = self.stop_outcome(wf_context)
+            if stopped:
+                status, completion_reason = stopped
+                if resumed_step:
+                    result = self.stopped_result(curr_step, *stopped)
+                    await self.arecord_step_run(curr_step, result, resumed=True)
+                break
+
+            result: WFResult = await curr_step.aexecute(
+                wf_context, resumed_step=resumed_step
+            )
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(f"Result: {result}")
+            wf_context["variables"].update(result.outputs)  # type: ignore
+            await self.arecord_step_run(curr_step, result, resumed=resumed_step)
+
+            ends_run = result.status.not_successful() or result.status.is_waiting()
+            if curr_index in plan.forks and not ends_run:
+                status, completion_reason, curr_index = await self.arun_fork(
+                    plan, curr_index, wf_context
+                )
+            else:
+                status, completion_reason, curr_index = self.step_outcome(
+                    plan, curr_index, result, wf_context
+                )
+
+        await self.store.aupdate_run(
+            self.transaction_id, status, completion_reason, wf_context["variables"]
         )
+        return self.run_result(curr_step, status, completion_reason, wf_context)
 
+    def setup_context(
+        self, curr_step: WFStep, status: RunStatus, kwargs: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Validate the inputs/owner, and setup the context for the run"""
         # Check if all the required inputs are available in the kwargs, parameters
         # included in definition
         missing_inputs = list(set(self.workflow.input_keys) - set(list(kwargs.keys())))
@@ -288,62 +711,89 @@ class WFRunner(BaseRunner):
         if self.owner != "abc@example.com":
             raise ValueError(f"Owner not permitted for this workflow: {self.owner}")
 
+        logger.info(
+            f"============ Executing Workflow @ {curr_step.id} [{status}] ============"
+        )
+
+        # A cancel may have been requested while the (resumed) run was in progress
+        now = time.monotonic()
+        run_state = RunState(
+            transaction_id=self.transaction_id,
+            cancel_checked_at=0.0 if status.is_waiting() else now,
+        )
+        timeout = self.workflow.timeout
+
         # Setup the context
-        wf_context = {
+        return {
             "wf_parameters": self.workflow.parameters,
             "metadata": self.metadata,
             "owner": self.owner,
             "working_dir": self.working_dir,
             "variables": kwargs,
+            "step_timeout": self.workflow.step_timeout,
+            "step_cache": (
+                default_step_cache() if self.step_cache is None else self.step_cache
+            ),
+            "deadline": now + timeout if timeout else None,
+            "run_state": run_state,
         }
 
-        logger.info(
-            f"============ Executing Workflow @ {curr_step.id} [{status}] ============"
-        )
+    def stop_outcome(self, wf_context: Dict[str, Any]) -> Tuple[RunStatus, str] | None:
+        """
+        Check (before a step) if the run has to stop; i.e. it has exceeded the
+        workflow timeout or a cancel has been requested [see `cancel`]. The store
+        is checked for the cancel at most every `CANCEL_POLL_INTERVAL` secs.
+        """
+        deadline = wf_context.get("deadline")
+        now = time.monotonic()
+        if deadline is not None and now >= deadline:
+            reason = f"Workflow timed out after {self.workflow.timeout} secs"
+            return RunStatus.KILLED, reason
+        run_state: RunState = wf_context["run_state"]
+        if (
+            not run_state.cancelled
+            and now - run_state.cancel_checked_at >= CANCEL_POLL_INTERVAL
+        ):
+            run_state.cancel_checked_at = now
+            run_state.cancelled = self.store.is_cancel_requested(
+                run_state.transaction_id
+            )
+        if run_state.cancelled:
+            return RunStatus.CANCELLED, "Workflow cancelled"
+        return None
 
-        # Get the first step to execute
-        while curr_step:
-            curr_step_id = curr_step.id
-            resumed_step = resumed_step_id == curr_step_id
-            result: WFResult = curr_step.execute(wf_context, resumed_step=resumed_step)
-            logger.info(f"Result: {result}")
-            wf_context["variables"].update(result.outputs)  # type: ignore
-            if resumed_step:
-                # We have resumed the workflow, and the first step has changed!
-                # We need to update the first step and continue
-                self.update_step_run(curr_step, result)
-            else:
-                self.log_step_run(curr_step, result)
+    def step_outcome(
+        self,
+        plan: ExecutionPlan,
+        curr_index: int,
+        result: WFResult,
+        wf_context: Dict[str, Any],
+    ) -> Tuple[RunStatus, str, int | None]:
+        """Return the run status, reason and the next step after the step result"""
+        if result.status.not_successful() or result.status.is_waiting():
+            return result.status, result.completion_reason, None
 
-            # Check Status, and get the next step
-            if result.status.not_successful():
-                status = result.status
-                completion_reason = result.completion_reason
-                curr_step = None
-            elif result.status.is_waiting():
-                status = result.status
-                completion_reason = result.completion_reason
-                curr_step = None
-            else:
-                # Get the next step [When step is COMPLETED, SKIPPED, DENIED]
-                ns_status, curr_step = self.workflow.get_next_step(
-                    curr_step, wf_context
-                )
-                status = RunStatus.COMPLETED if ns_status == "OK" else RunStatus.FAILED
-                if ns_status != "OK":
-                    completion_reason = f"Next step not found for [{curr_step_id}]"
-                    curr_step = None
-                else:
-                    completion_reason = (
-                        f"Step [{curr_step_id}] Completed"
-                        if curr_step
-                        else "Workflow Completed"
-                    )
+        # Get the next step [When step is COMPLETED, SKIPPED, DENIED]
+        curr_step_id = plan.steps[curr_index].id
+        ns_status, next_index = plan.next_index(curr_index, wf_context)
+        if ns_status != "OK":
+            return RunStatus.FAILED, f"Next step not found for [{curr_step_id}]", None
+        completion_reason = (
+            f"Step [{curr_step_id}] Completed"
+            if next_index is not None
+            else "Workflow Completed"
+        )
+        return RunStatus.COMPLETED, completion_reason, next_index
 
-            # End While Loop
-        self.update_run(status, completion_reason, wf_context["variables"])
+    def run_result(
+        self,
+        curr_step: WFStep,
+        status: RunStatus,
+        completion_reason: str,
+        wf_context: Dict[str, Any],
+    ) -> Dict[str, Any]:
         logger.info(
-            f"Workflow {self.workflow.name} / Step {curr_step_id} / "
+            f"Workflow {self.workflow.name} / Step {curr_step.id} / "
             f"{self.transaction_id} => {status} // {completion_reason}"
         )
         return {
@@ -351,3 +801,354 @@ class WFRunner(BaseRunner):
             "reason": completion_reason,
             **wf_context["variables"],  # type: ignore
         }
+
+    def run_chain(
+        self, plan: ExecutionPlan, chain: List[int], wf_context: Dict[str, Any]
+    ) -> Tuple[int, WFResult]:
+        """
+        Run a chain of steps [see `ExecutionPlan.dataflow_chain`] in parallel, as
+        per their data dependencies: a step starts once the last of the earlier
+        steps writing each of its read keys has completed. Each step sees the
+        outputs of the earlier steps completed by then [never of the later ones].
+        The results are committed (persisted and merged into the context) in the
+        chain order and the chain stops at the first step that fails or waits,
+        so the outcome is the same as running the steps one after the other.
+        NOTE: The steps must declare the variables they use [see `read_keys`]
+        Returns the last committed step and its result.
+        """
+        steps = [plan.steps[index] for index in chain]
+        depends_on: List[Set[int]] = []
+        for i, step in enumerate(steps):
+            read_keys = step.read_keys
+            if read_keys is None:  # May read any variable; waits for all the earlier
+                depends_on.append(set(range(i)))
+                continue
+            writers = {}
+            for j in range(i):
+                writers.update({key: j for key in steps[j].write_keys})
+            depends_on.append({writers[k] for k in read_keys if k in writers})
+        if logger.isEnabledFor(logging.INFO):
+            deps = [
+                (step.id, sorted(steps[j].id for j in depends))
+                for step, depends in zip(steps, depends_on)
+            ]
+            logger.info(f"Dataflow chain: {deps}")
+
+        results: Dict[int, WFResult] = {}
+        errors: Dict[int, Exception] = {}
+        running: Dict[Future, int] = {}
+        committed = 0
+        with ThreadPoolExecutor(
+            max_workers=len(chain), thread_name_prefix="wf-dataflow"
+        ) as executor:
+            while True:
+                # Start the steps whose dependencies have completed [successfully]
+                ended = [i for i in results if self.ends_chain(results[i])]
+                ended.extend(errors)
+                for i, step in enumerate(steps):
+                    if (
+                        i in results
+                        or i in errors
+                        or i in running.values()
+                        or any(j < i for j in ended)
+                        or not depends_on[i].issubset(results)
+                    ):
+                        continue
+                    variables = dict(wf_context["variables"])
+                    for j in range(committed, i):
+                        if j in results:
+                            variables.update(results[j].outputs)
+                    step_context = {**wf_context, "variables": variables}
+                    running[executor.submit(step.execute, step_context)] = i
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    try:
+                        results[i] = future.result()
+                        if logger.isEnabledFor(logging.INFO):
+                            logger.info(f"Result: {results[i]}")
+                    except Exception as e:
+                        errors[i] = e
+
+                # Commit the results in the chain order
+                while committed in results:
+                    result = results[committed]
+                    wf_context["variables"].update(result.outputs)  # type: ignore
+                    self.log_step_run(steps[committed], result)
+                    if self.ends_chain(result) or committed == len(chain) - 1:
+                        for future in running:
+                            future.cancel()
+                        return chain[committed], result
+                    committed += 1
+                if committed in errors:
+                    for future in running:
+                        future.cancel()
+                    raise errors[committed]
+
+    @staticmethod
+    def ends_chain(result: WFResult) -> bool:
+        return result.status.not_successful() or result.status.is_waiting()
+
+    def run_fork(
+        self, plan: ExecutionPlan, fork_index: int, wf_context: Dict[str, Any]
+    ) -> Tuple[RunStatus, str, int | None]:
+        """
+        Run the branches of the fork step in parallel. Each branch runs on a copy
+        of the variables till it reaches a join step [or the end of the workflow].
+        The branch step results are persisted (from this thread) as they complete,
+        and the branch outputs are merged in the branch (definition) order.
+        Returns the status, reason and the join step to continue from.
+        """
+        heads, outcome = self.fork_branches(plan, fork_index, wf_context)
+        if outcome:
+            return outcome
+
+        stop_branches = threading.Event()
+        step_results: Queue = Queue()
+        with ThreadPoolExecutor(
+            max_workers=len(heads), thread_name_prefix="wf-branch"
+        ) as executor:
+            futures = []
+            for head in heads:
+                future = executor.submit(
+                    self.run_branch, plan, head, wf_context, stop_branches, step_results
+                )
+                future.add_done_callback(lambda f: step_results.put((None, f)))
+                futures.append(future)
+
+            running = len(futures)
+            while running:
+                step, result = step_results.get()
+                if step is not None:
+                    self.log_step_run(step, result)
+                    if self.stop_outcome(wf_context):
+                        stop_branches.set()  # The run stops at the join step
+                    continue
+                running -= 1
+                branch = result.result() if not result.exception() else None
+                if branch is None or self.stops_branches(plan, branch):
+                    stop_branches.set()
+
+        branches = [future.result() for future in futures]  # Re-raise any error
+        return self.join_branches(plan, fork_index, branches, wf_context)
+
+    async def arun_fork(
+        self, plan: ExecutionPlan, fork_index: int, wf_context: Dict[str, Any]
+    ) -> Tuple[RunStatus, str, int | None]:
+        """Same as `run_fork`; the branches are run as tasks on the event loop"""
+        import asyncio
+
+        heads, outcome = self.fork_branches(plan, fork_index, wf_context)
+        if outcome:
+            return outcome
+
+        stop_branches = threading.Event()
+
+        async def run_branch(head: int) -> BranchResult:
+            try:
+                branch = await self.arun_branch(plan, head, wf_context, stop_branches)
+            except Exception:
+                stop_branches.set()
+                raise
+            if self.stops_branches(plan, branch):
+                stop_branches.set()
+            return branch
+
+        branches = await asyncio.gather(
+            *[run_branch(head) for head in heads], return_exceptions=True
+        )
+        for branch in branches:
+            if isinstance(branch, BaseException):
+                raise branch
+        return self.join_branches(plan, fork_index, branches, wf_context)
+
+    def fork_branches(
+        self, plan: ExecutionPlan, fork_index: int, wf_context: Dict[str, Any]
+    ) -> Tuple[List[int], Tuple[RunStatus, str, int | None] | None]:
+        """
+        Return the first step of each of the branches to run in parallel. If there
+        is nothing to fork, the outcome [status, reason and next step] is returned
+        """
+        fork_step = plan.steps[fork_index]
+        ns_status, heads = plan.fork_indices(fork_index, wf_context)
+        if ns_status != "OK":
+            reason = f"Next step not found for [{fork_step.id}]"
+            return [], (RunStatus.FAILED, reason, None)
+        if len(heads) < 2:
+            # Only one of the branches (or none) is to be taken. Nothing to fork
+            next_index = heads[0] if heads else None
+            reason = (
+                f"Step [{fork_step.id}] Completed" if heads else "Workflow Completed"
+            )
+            return [], (RunStatus.COMPLETED, reason, next_index)
+
+        logger.info(f"Fork [{fork_step.id}] => {[plan.steps[i].id for i in heads]}")
+        return heads, None
+
+    @staticmethod
+    def stops_branches(plan: ExecutionPlan, branch: BranchResult) -> bool:
+        """Stop the other branches on a failure or with a join for any"""
+        return (
+            branch.status.not_successful()
+            or plan.joins.get(branch.join_index) == JoinMode.ANY
+        )
+
+    def join_branches(
+        self,
+        plan: ExecutionPlan,
+        fork_index: int,
+        branches: List[BranchResult],
+        wf_context: Dict[str, Any],
+    ) -> Tuple[RunStatus, str, int | None]:
+        """Merge the branch outputs, and return the outcome of the fork"""
+        fork_step = plan.steps[fork_index]
+        for branch in branches:
+            wf_context["variables"].update(branch.outputs)
+
+        failed = [b for b in branches if b.status.not_successful()]
+        if failed:
+            return failed[0].status, failed[0].reason, None
+        waiting = [b for b in branches if b.status.is_waiting()]
+        if len(waiting) > 1:
+            # NOTE: The workflow can be resumed from only one waiting step
+            reason = f"Multiple branches of [{fork_step.id}] waiting: Not supported"
+            return RunStatus.FAILED, reason, None
+        if waiting:
+            return waiting[0].status, waiting[0].reason, None
+
+        join_indices = {b.join_index for b in branches if b.join_index is not None}
+        if len(join_indices) > 1:
+            join_ids = sorted(plan.steps[i].id for i in join_indices)
+            reason = f"Branches of [{fork_step.id}] join at different steps {join_ids}"
+            return RunStatus.FAILED, reason, None
+        if not join_indices:
+            return RunStatus.COMPLETED, "Workflow Completed", None
+        join_index = join_indices.pop()
+        return (
+            RunStatus.COMPLETED,
+            f"Branches of [{fork_step.id}] joined at [{plan.steps[join_index].id}]",
+            join_index,
+        )
+
+    def run_branch(
+        self,
+        plan: ExecutionPlan,
+        curr_index: int | None,
+        wf_context: Dict[str, Any],
+        stop_branch: threading.Event,
+        step_results: Queue,
+    ) -> BranchResult:
+        """Run the steps of a branch [in a worker thread] till a join step."""
+        variables = dict(wf_context["variables"])
+        branch_context = {**wf_context, "variables": variables}
+        outputs: Dict[str, Any] = {}
+        while curr_index is not None and curr_index not in plan.joins:
+            curr_step = plan.steps[curr_index]
+            stopped = self.branch_stopped(plan, curr_index, stop_branch, outputs)
+            if stopped:
+                return stopped
+
+            result: WFResult = curr_step.execute(branch_context)
+            logger.info(f"Branch Result: {result}")
+            variables.update(result.outputs)
+            outputs.update(result.outputs)
+            step_results.put((curr_step, result))
+
+            ended, curr_index = self.branch_step_outcome(
+                plan, curr_index, result, branch_context, outputs
+            )
+            if ended:
+                return ended
+
+        return BranchResult(
+            status=RunStatus.COMPLETED,
+            reason="Branch Completed",
+            join_index=curr_index,
+            outputs=outputs,
+        )
+
+    async def arun_branch(
+        self,
+        plan: ExecutionPlan,
+        curr_index: int | None,
+        wf_context: Dict[str, Any],
+        stop_branch: threading.Event,
+    ) -> BranchResult:
+        """Same as `run_branch`; the step results are persisted as they complete"""
+        variables = dict(wf_context["variables"])
+        branch_context = {**wf_context, "variables": variables}
+        outputs: Dict[str, Any] = {}
+        while curr_index is not None and curr_index not in plan.joins:
+            curr_step = plan.steps[curr_index]
+            if self.stop_outcome(wf_context):
+                stop_branch.set()  # The run stops at the join step
+            stopped = self.branch_stopped(plan, curr_index, stop_branch, outputs)
+            if stopped:
+                return stopped
+
+            result: WFResult = await curr_step.aexecute(branch_context)
+            logger.info(f"Branch Result: {result}")
+            variables.update(result.outputs)
+            outputs.update(result.outputs)
+            await self.arecord_step_run(curr_step, result)
+
+            ended, curr_index = self.branch_step_outcome(
+                plan, curr_index, result, branch_context, outputs
+            )
+            if ended:
+                return ended
+
+        return BranchResult(
+            status=RunStatus.COMPLETED,
+            reason="Branch Completed",
+            join_index=curr_index,
+            outputs=outputs,
+        )
+
+    @staticmethod
+    def branch_stopped(
+        plan: ExecutionPlan,
+        curr_index: int,
+        stop_branch: threading.Event,
+        outputs: Dict[str, Any],
+    ) -> BranchResult | None:
+        """Check (before running the step) if the branch has to be stopped"""
+        curr_step = plan.steps[curr_index]
+        if stop_branch.is_set():
+            reason = f"Branch stopped before [{curr_step.id}]"
+            return BranchResult(
+                status=RunStatus.COMPLETED, reason=reason, outputs=outputs
+            )
+        if curr_index in plan.forks:
+            reason = f"Nested fork [{curr_step.id}]: Not supported"
+            return BranchResult(status=RunStatus.FAILED, reason=reason, outputs=outputs)
+        return None
+
+    @staticmethod
+    def branch_step_outcome(
+        plan: ExecutionPlan,
+        curr_index: int,
+        result: WFResult,
+        branch_context: Dict[str, Any],
+        outputs: Dict[str, Any],
+    ) -> Tuple[BranchResult | None, int | None]:
+        """Return the branch result if the branch has ended, else the next step"""
+        if result.status.not_successful() or result.status.is_waiting():
+            return (
+                BranchResult(
+                    status=result.status,
+                    reason=result.completion_reason,
+                    outputs=outputs,
+                ),
+                None,
+            )
+
+        ns_status, next_index = plan.next_index(curr_index, branch_context)
+        if ns_status != "OK":
+            reason = f"Next step not found for [{plan.steps[curr_index].id}]"
+            return (
+                BranchResult(status=RunStatus.FAILED, reason=reason, outputs=outputs),
+                None,
+            )
+        return None, next_index
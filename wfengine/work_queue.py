@@ -0,0 +1,269 @@
+"""Work Queue module; a durable (Sqlite3 backed) queue of workflow run requests."""
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, List
+from uuid import UUID, uuid4
+
+from pydantic import BaseModel
+
+from wfengine.checkpoint import CheckpointCodec
+from wfengine.schema import blob_to_uuid, migrate, uuid_to_blob
+
+logger = logging.getLogger(__name__)
+
+
+class MessageAction(str, Enum):
+    """What the orchestrator is asked to do"""
+
+    CREATE = "CREATE"  # Start a new workflow run
+    CONTINUE = "CONTINUE"  # Resume a waiting workflow run
+    TIMER = "TIMER"  # Fire the timer of a waiting step [see TimerService]
+
+
+class MessageStatus(str, Enum):
+    """Status of the message in the queue"""
+
+    QUEUED = "Queued"  # Available [from `available_at`]
+    LEASED = "Leased"  # Claimed by a worker till `lease_expires_at`
+    DONE = "Done"
+    FAILED = "Failed"  # Failed `max_attempts` times [dead letter]
+
+
+class QueueMessage(BaseModel):
+    """A claimed message"""
+
+    id: int
+    action: MessageAction
+    workflow: str
+
+    transaction_id: UUID
+    """The run to create/continue. Assigned when a CREATE message is queued."""
+
+    owner: str | None = None
+    payload: Dict[str, Any] = {}
+    """The inputs for the run (or resume)"""
+
+    attempts: int
+    """The number of times the message has been claimed [including this one]"""
+
+    last_reason: str | None = None
+    """Why the previous attempt failed [if it did]"""
+
+
+class WorkQueue(object):
+    """
+    Durable queue of CREATE/CONTINUE/TIMER messages in the workflow DB. A worker
+    claims a message with a lease (visibility timeout) and extends it with
+    heartbeats while the run is in progress; the message is re-delivered if the
+    lease expires [e.g. the worker crashed]. Messages for a transaction are
+    delivered in order and never leased to two workers at the same time.
+    """
+
+    def __init__(
+        self,
+        db_file: Path | str,
+        visibility_timeout: float = 60.0,
+        max_attempts: int = 5,
+        retry_delay: float = 5.0,
+        timeout: float = 30.0,
+    ) -> None:
+        self.db_file = str(db_file)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.codec = CheckpointCodec()
+
+        # Autocommit mode; the multi statement operations use BEGIN IMMEDIATE
+        # NOTE: Used by the heartbeat thread as well [serialized by the lock]
+        self._conn = sqlite3.connect(
+            self.db_file, timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        migrate(self._conn)
+        self._lock = threading.Lock()
+
+    def enqueue(
+        self,
+        action: MessageAction,
+        workflow: str,
+        payload: Dict[str, Any],
+        transaction_id: UUID | str | None = None,
+        owner: str | None = None,
+        delay: float = 0.0,
+        conn: sqlite3.Connection | None = None,
+    ) -> QueueMessage:
+        """
+        Queue a message. A CREATE message is assigned a new transaction ID. With
+        `conn` (a connection to the same DB), the message is inserted using it,
+        e.g. in the transaction of the caller [see TimerService].
+        """
+        action = MessageAction(action)
+        if action == MessageAction.CREATE:
+            transaction_id = transaction_id or uuid4()
+        elif not transaction_id:
+            raise ValueError(f"Transaction ID must be provided for {action.value}")
+        transaction_id = blob_to_uuid(uuid_to_blob(transaction_id))
+
+        sql = """
+            INSERT INTO wf_queue
+                (action, workflow, wf_id, owner, payload, available_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+        params = [
+            action.value,
+            workflow,
+            uuid_to_blob(transaction_id),
+            owner,
+            self.codec.encode(payload),
+            time.time() + delay,
+        ]
+        if conn is not None:
+            cursor = conn.execute(sql, params)
+        else:
+            with self._lock:
+                cursor = self._conn.execute(sql, params)
+        logger.info(f"Queued {action.value} [{workflow}] for {transaction_id}")
+        return QueueMessage(
+            id=cursor.lastrowid,
+            action=action,
+            workflow=workflow,
+            transaction_id=transaction_id,
+            owner=owner,
+            payload=payload,
+            attempts=0,
+        )
+
+    def claim(self, worker_id: str) -> QueueMessage | None:
+        """
+        Lease the next available message [or one whose lease has expired]. A
+        message is skipped if an earlier message for the same transaction is
+        still pending, so that a transaction is only worked on by one worker.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT id, action, workflow, wf_id, owner, payload, attempts,
+                        result
+                    FROM wf_queue AS q
+                    WHERE (
+                        (q.status = 'Queued' AND q.available_at <= :now)
+                        OR (q.status = 'Leased' AND q.lease_expires_at < :now)
+                    )
+                    AND NOT EXISTS (
+                        SELECT 1 FROM wf_queue AS e
+                        WHERE e.wf_id = q.wf_id AND e.id < q.id
+                        AND e.status IN ('Queued', 'Leased')
+                    )
+                    ORDER BY q.id
+                    LIMIT 1
+                    """,
+                    {"now": now},
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    """
+                    UPDATE wf_queue
+                    SET status = 'Leased', attempts = attempts + 1,
+                        lease_owner = ?, lease_expires_at = ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                    """,
+                    [worker_id, now + self.visibility_timeout, row[0]],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+        message = QueueMessage(
+            id=row[0],
+            action=MessageAction(row[1]),
+            workflow=row[2],
+            transaction_id=blob_to_uuid(row[3]),
+            owner=row[4],
+            payload=self.codec.decode(row[5]),
+            attempts=row[6] + 1,
+            last_reason=json.loads(row[7]).get("reason") if row[7] else None,
+        )
+        logger.debug(f"Worker {worker_id} claimed message {message.id}")
+        return message
+
+    def heartbeat(self, message_id: int, worker_id: str) -> bool:
+        """Extend the lease. Returns False if the lease has been lost."""
+        return self.update_leased(
+            message_id,
+            worker_id,
+            "lease_expires_at = ?",
+            [time.time() + self.visibility_timeout],
+        )
+
+    def ack(self, message_id: int, worker_id: str, result: Dict[str, Any]) -> bool:
+        """Mark the message as done [with the status/reason of the run]"""
+        return self.update_leased(
+            message_id,
+            worker_id,
+            "status = 'Done', lease_owner = NULL, lease_expires_at = NULL, result = ?",
+            [json.dumps(result, default=str)],
+        )
+
+    def fail(
+        self, message: QueueMessage, worker_id: str, reason: str, retry=True
+    ) -> bool:
+        """Re-queue the message after `retry_delay` [or mark it as failed]"""
+        if not retry or message.attempts >= self.max_attempts:
+            logger.error(f"Message {message.id} failed [{message.attempts}]: {reason}")
+            return self.update_leased(
+                message.id,
+                worker_id,
+                "status = 'Failed', lease_owner = NULL, lease_expires_at = NULL"
+                ", result = ?",
+                [json.dumps({"reason": reason})],
+            )
+        return self.update_leased(
+            message.id,
+            worker_id,
+            "status = 'Queued', lease_owner = NULL, lease_expires_at = NULL"
+            ", available_at = ?, result = ?",
+            [time.time() + self.retry_delay, json.dumps({"reason": reason})],
+        )
+
+    def update_leased(
+        self, message_id: int, worker_id: str, assignments: str, params: List[Any]
+    ) -> bool:
+        """Update the message only if it is still leased by the worker."""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE wf_queue SET {assignments}, updated_at = CURRENT_TIMESTAMP "
+                "WHERE id = ? AND status = 'Leased' AND lease_owner = ?",
+                [*params, message_id, worker_id],
+            )
+        if cursor.rowcount != 1:
+            logger.warning(f"Worker {worker_id} lost the lease on {message_id}")
+            return False
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """Number of messages by status"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM wf_queue GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
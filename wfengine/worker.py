@@ -0,0 +1,249 @@
+"""Worker module; process the work queue messages in multiple worker processes."""
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List
+
+from wfengine.base_runner import RunStatus
+from wfengine.commit_policy import CommitMode, CommitPolicy
+from wfengine.stores import SqlitePool
+from wfengine.timers import TimerAction
+from wfengine.wf_runner import WFRunner
+from wfengine.work_queue import MessageAction, QueueMessage, WorkQueue
+
+logger = logging.getLogger(__name__)
+
+
+class Worker(object):
+    """
+    Claims the messages from the work queue and runs (or resumes) the workflows.
+    The lease on the message is extended by a heartbeat thread while the run is
+    in progress. The workflow definitions are loaded once per worker.
+    """
+
+    def __init__(
+        self,
+        db_file: Path | str,
+        worker_id: str,
+        commit_policy: Dict[str, Any] | None = None,
+        poll_interval: float = 0.5,
+        queue_options: Dict[str, Any] | None = None,
+        **kwargs,
+    ) -> None:
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval
+        self.queue = WorkQueue(db_file, **(queue_options or {}))
+        self.kwargs = kwargs  # Parameters for the runners [e.g. `dataflow`]
+        policy = CommitPolicy(**(commit_policy or {}))
+        if policy.mode == CommitMode.RUN:
+            # NOTE: The write lock is held for the whole run [the DB is shared]
+            logger.warning(
+                "The RUN commit mode serializes the workers on the DB; Use STEP"
+            )
+        self.pool = SqlitePool(db_file, policy)
+        self.runners: Dict[str, WFRunner] = {}
+        self.stopping = False
+
+    def stop(self) -> None:
+        """Stop after the current message [safe to call from a signal handler]"""
+        self.stopping = True
+
+    def run(self) -> None:
+        """Process the messages till the worker is stopped."""
+        logger.info(f"Worker {self.worker_id} started [pid = {os.getpid()}]")
+        try:
+            while not self.stopping:
+                try:
+                    message = self.queue.claim(self.worker_id)
+                except sqlite3.Error as e:  # e.g. Locked; Tried again after a while
+                    logger.warning(f"Worker {self.worker_id} claim failed: {e}")
+                    message = None
+                if message is None:
+                    time.sleep(self.poll_interval)
+                    continue
+                self.process(message)
+        finally:
+            self.queue.close()
+            self.pool.close()
+            logger.info(f"Worker {self.worker_id} stopped")
+
+    def process(self, message: QueueMessage) -> None:
+        """Run the message [with heartbeats], and ack/fail it."""
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self.heartbeat_loop,
+            args=(message, done),
+            name=f"wf-heartbeat-{message.id}",
+            daemon=True,
+        )
+        heartbeat.start()
+        try:
+            runner = self.runner_for(message)
+            stored_run = (
+                self.stored_run(runner, message)
+                if message.action == MessageAction.CREATE and message.attempts > 1
+                else None
+            )
+            if stored_run is not None:
+                if RunStatus(stored_run["status"]) == RunStatus.STARTED:
+                    # The run was started by a worker that crashed (or lost the
+                    # lease). It cannot be safely re-run; needs a manual check
+                    reason = f"Run {message.transaction_id} was interrupted"
+                    if message.last_reason:
+                        reason += f" [{message.last_reason}]"
+                    self.queue.fail(message, self.worker_id, reason, retry=False)
+                    return
+                # The run has ended (or is waiting); Only the ack was lost
+                result = stored_run
+            elif message.action == MessageAction.CREATE:
+                result = runner.run_transaction(
+                    message.transaction_id, **message.payload
+                )
+            elif message.action == MessageAction.TIMER:
+                result = runner.fire_timer(
+                    str(message.transaction_id),
+                    message.payload["step_id"],
+                    TimerAction(message.payload["action"]),
+                )
+            else:
+                result = runner.resume(
+                    transaction_id=str(message.transaction_id), **message.payload
+                )
+            # The run state must be committed before the message is done
+            runner.store.flush()
+            self.queue.ack(
+                message.id,
+                self.worker_id,
+                {"status": result["status"], "reason": result["reason"]},
+            )
+        except Exception as e:
+            logger.error(f"Message {message.id} [{message.action.value}] failed: {e}")
+            self.pool.flush()  # Release the write lock [for a partially saved run]
+            # A ValueError (e.g. invalid inputs or owner) fails again on a retry
+            retry = not isinstance(e, ValueError)
+            self.queue.fail(message, self.worker_id, str(e), retry=retry)
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def heartbeat_loop(self, message: QueueMessage, done: threading.Event) -> None:
+        interval = self.queue.visibility_timeout / 3
+        while not done.wait(interval):
+            try:
+                leased = self.queue.heartbeat(message.id, self.worker_id)
+            except sqlite3.Error as e:  # e.g. Locked; Tried again in the next beat
+                logger.warning(f"Heartbeat failed for message {message.id}: {e}")
+                continue
+            if not leased:
+                # NOTE: The run cannot be safely interrupted; it completes but
+                # the message may have been re-delivered to another worker.
+                logger.error(f"Lost the lease on message {message.id}")
+                return
+
+    def runner_for(self, message: QueueMessage) -> WFRunner:
+        """A (new) runner for the message, sharing the loaded workflow and store."""
+        template = self.runners.get(message.workflow)
+        if template is None:
+            template = WFRunner.from_file(
+                message.workflow,
+                self.pool,
+                owner=message.owner or "unknown",
+                metadata={"source": "queue"},
+                **self.kwargs,
+            )
+            self.runners[message.workflow] = template
+        return template.model_copy(
+            update={
+                "transaction_id": None,
+                "working_dir": None,
+                "owner": message.owner or template.owner,
+            }
+        )
+
+    @staticmethod
+    def stored_run(runner: WFRunner, message: QueueMessage) -> Dict[str, Any] | None:
+        """The run of a CREATE message, if it has been started [else None]"""
+        try:
+            return runner.store.get_run(message.transaction_id)
+        except ValueError:
+            return None
+
+
+def worker_main(db_file: str, worker_id: str, options: Dict[str, Any]) -> None:
+    """Entry point for the worker processes."""
+    worker = Worker(db_file, worker_id, **options)
+    # The daemon handles Ctrl-C and stops the workers [after their current run]
+    # NOTE: Only flags are set in the handlers; locks are not signal safe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.run()
+
+
+class WorkerDaemon(object):
+    """Runs (and re-spawns, if they die) N worker processes on the work queue."""
+
+    def __init__(
+        self, db_file: Path | str, processes: int | None = None, **options
+    ) -> None:
+        self.db_file = str(db_file)
+        self.num_processes = processes or os.cpu_count() or 1
+        self.options = options
+        self.stopping = False
+        self.processes: List[multiprocessing.Process | None] = [
+            None
+        ] * self.num_processes
+
+    def stop(self, *_) -> None:
+        self.stopping = True
+
+    def spawn(self, index: int) -> None:
+        worker_id = f"{os.uname().nodename}:{os.getpid()}:{index}"
+        process = multiprocessing.Process(
+            target=worker_main,
+            args=(self.db_file, worker_id, self.options),
+            name=f"wf-worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    def serve(self) -> None:
+        """Run the workers till SIGINT/SIGTERM."""
+        # Setup the schema before the workers start
+        WorkQueue(self.db_file).close()
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        logger.info(f"Starting {self.num_processes} workers on {self.db_file}")
+        for index in range(self.num_processes):
+            self.spawn(index)
+
+        while not self.stopping:
+            time.sleep(1.0)
+            for index, process in enumerate(self.processes):
+                if process and not process.is_alive() and not self.stopping:
+                    logger.warning(
+                        f"Worker {process.name} died [{process.exitcode}]: Restarting"
+                    )
+                    self.spawn(index)
+
+        logger.info("Stopping the workers")
+        for process in self.processes:
+            if process and process.is_alive():
+                process.terminate()  # SIGTERM; the worker completes the current run
+        for process in self.processes:
+            if process:
+                process.join()
+        logger.info("All workers stopped")
+
+
+def serve(db_file: Path | str, processes: int | None = None, **options) -> None:
+    """Run the worker daemon [see WorkerDaemon]"""
+    WorkerDaemon(db_file, processes, **options).serve()
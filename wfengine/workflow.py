@@ -2,17 +2,77 @@
 from __future__ import annotations
 
 import ast
+import builtins
 import logging
+import os
+import threading
+import time
+
+from concurrent.futures import Future, wait
+from dataclasses import dataclass
+from enum import Enum
 
 # from string import Formatter
-from typing import Any, Dict, List, Tuple
+from typing import Any, Callable, Dict, FrozenSet, List, Mapping, Set, Tuple
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, model_validator
 
 from wfengine.base_runner import BaseRunner, RunStatus
+from wfengine.context import LayeredContext
+from wfengine.safe_eval import compile_safe, referenced_names
+from wfengine.spill import SpillResolvingView, resolve_spilled, spill_outputs
 
 logger = logging.getLogger(__name__)
 
+EVAL_GLOBALS = {"__builtins__": builtins}
+"""Globals for the eval'ed conditions; the variables are passed as the locals"""
+
+
+class EvalMode(str, Enum):
+    """How the condition expressions are evaluated"""
+
+    EVAL = "eval"  # Python eval on the compiled code object [with builtins]
+    SAFE = "safe"  # Whitelist-only AST evaluator [no builtins, no attributes]
+
+
+DEFAULT_EVAL_MODE = EvalMode(os.getenv("WF_CONDITION_MODE", EvalMode.EVAL.value))
+"""The default evaluation mode for the conditions [WF_CONDITION_MODE]"""
+
+DEFAULT_STEP_TIMEOUT = float(os.getenv("WF_STEP_TIMEOUT", "0")) or None
+"""The default max. secs a step's action may run [WF_STEP_TIMEOUT; 0: no limit]"""
+
+
+class StepTimeoutError(TimeoutError):
+    """The action did not complete within the step timeout"""
+
+
+def call_with_timeout(func: Callable[..., Any], timeout: float, **kwargs) -> Any:
+    """
+    Call the function in a (daemon) thread and wait for up to `timeout` secs. On a
+    timeout, StepTimeoutError is raised and the call is abandoned; Python threads
+    cannot be killed, so the action keeps running in the background.
+    """
+    future: Future = Future()
+
+    def target() -> None:
+        try:
+            future.set_result(func(**kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, name="wf-step", daemon=True).start()
+    done, _ = wait([future], timeout=timeout)
+    if not done:
+        raise StepTimeoutError(f"Timed out after {timeout} secs")
+    return future.result()
+
+
+class JoinMode(str, Enum):
+    """When a join step runs after the parallel branches of a fork"""
+
+    ALL = "all"  # Wait for all the branches to reach the join step
+    ANY = "any"  # Continue with the first branch; the others stop at the next step
+
 
 class Condition(BaseModel):
     """A Generic Condition that can be validated"""
@@ -20,40 +80,86 @@ class Condition(BaseModel):
     expression_template: str
     """The expression template to check"""
 
+    mode: EvalMode = DEFAULT_EVAL_MODE
+    """How the expression is evaluated"""
+
+    # Compiled once when the condition is validated [or unpickled]
+    _code: Any = PrivateAttr(default=None)
+    _evaluator: Any = PrivateAttr(default=None)
+    _names: FrozenSet[str] = PrivateAttr(default=frozenset())
+
+    @model_validator(mode="after")
+    def compile_expression(self) -> Condition:
+        # Formatting the string with the context enables us to ensure that variable
+        # substition happens before we do the ast.parse, compile, eval. Probably
+        # more secure this way. But format is limited compared to the 'eval/globals'
+        # expression = self.expression_template.format(**kwargs)
+        expression = self.expression_template
+        try:
+            self._names = frozenset(referenced_names(expression))
+            if self.mode == EvalMode.SAFE:
+                self._evaluator = compile_safe(expression)
+            else:
+                code = ast.parse(expression, mode="eval")
+                self._code = compile(code, "<condition>", "eval")
+        except SyntaxError as se:
+            logger.error(f"Syntax error ast.parse/compile: {se}")
+            raise ValueError(f"Invalid condition [{expression}]: {se}") from se
+        return self
+
+    @property
+    def names(self) -> FrozenSet[str]:
+        """The names of the variables referenced in the condition."""
+        return self._names
+
+    def __getstate__(self) -> Dict[Any, Any]:
+        # Code objects and closures cannot be pickled; they are compiled again
+        state = super().__getstate__()
+        state["__pydantic_private__"] = None
+        return state
+
+    def __setstate__(self, state: Dict[Any, Any]) -> None:
+        super().__setstate__(state)
+        private = {k: v.get_default() for k, v in self.__private_attributes__.items()}
+        object.__setattr__(self, "__pydantic_private__", private)
+        self.compile_expression()
+
     def evaluate(self, wf_context, step_name, step_parameters) -> bool:
-        kwargs = {
-            **wf_context["wf_parameters"],
-            **step_parameters,
-            **wf_context["metadata"],
-            **wf_context["variables"],
-            "owner": wf_context["owner"],
-            "step_name": step_name,
-            "working_dir": wf_context["working_dir"],
-        }
+        # Read-only view with the same precedence as merging the dicts in order
+        kwargs = LayeredContext(
+            wf_context["wf_parameters"],
+            step_parameters,
+            wf_context["metadata"],
+            SpillResolvingView(wf_context["variables"], wf_context["working_dir"]),
+            {
+                "owner": wf_context["owner"],
+                "step_name": step_name,
+                "working_dir": wf_context["working_dir"],
+            },
+        )
 
-        try:
-            # Formatting the string with the context enables us to ensure that variable
-            # substition happens before we do the ast.parse, compile, eval. Probably
-            # more secure this way. But format is limited compared to the 'eval/globals'
-            # expression = self.expression_template.format(**kwargs)
-            expression = self.expression_template
-            code = ast.parse(expression, mode="eval")
-            codeobj = compile(code, "<string>", "eval")
-            expr_result = eval(codeobj, kwargs)  # nosec
+        if self._evaluator is not None:
+            expr_result = self._evaluator(kwargs)
+        else:
+            try:
+                expr_result = eval(self._code, EVAL_GLOBALS, kwargs)  # nosec
+            except NameError:
+                # Nested scopes (comprehensions/lambdas) cannot see the locals
+                # mapping; So, fallback to a merged dict as the globals.
+                expr_result = eval(self._code, {**EVAL_GLOBALS, **kwargs})  # nosec
+        if logger.isEnabledFor(logging.DEBUG):  # Avoid formatting in the hot path
             logger.debug(
                 f"== Condition = {self.expression_template}; Result = {expr_result}"
             )
-            return bool(expr_result)
-        except KeyError as ke:
-            logger.error(f"Key error while doing a format: {ke}")
-            raise ke
-        except SyntaxError as se:
-            logger.error(f"Syntax error ast.parse/compile/eval: {se}")
-            raise se
+        return bool(expr_result)
 
 
-class WFResult(BaseModel):
-    """The result of a step execution"""
+@dataclass(slots=True)
+class WFResult:
+    """
+    The result of a step execution; A runtime record [created for every step, so
+    not a (validated) pydantic model]
+    """
 
     step_id: str
     """The Step ID"""
@@ -62,7 +168,7 @@ class WFResult(BaseModel):
     """The Step Action"""
 
     inputs: Dict[str, Any]
-    """The inputs to the action"""
+    """The effective inputs to the action [the step parameters and mapped inputs]"""
 
     outputs: Dict[str, Any]
     """The outputs from the action"""
@@ -73,6 +179,12 @@ class WFResult(BaseModel):
     completion_reason: str
     """The Completion reason"""
 
+    resume_at: float | None = None
+    """Epoch time at which the waiting step is resumed [e.g. after a delay]"""
+
+    timeout_at: float | None = None
+    """Epoch time at which the run is killed if the step is still waiting"""
+
 
 class WFStep(BaseModel):
 
@@ -110,6 +222,31 @@ class WFStep(BaseModel):
     The mapping of workflow context variables to the action output keys for each step
     """
 
+    variable_keys: List[Tuple[str, str]] | None = None
+    """
+    The (workflow variable, action input key) pairs passed to the action; from the
+    input keys, the input mapping and the action's `context_keys` [None: all]
+    """
+
+    fork: bool = False
+    """Follow all the (satisfied) transitions from this step in parallel branches"""
+
+    join: JoinMode | None = None
+    """Wait for all/any of the parallel branches before executing this step"""
+
+    cache: bool | None = None
+    """
+    Reuse the (successful) outputs of the action for the same inputs [default:
+    the `cacheable` flag of the action; see StepCache]
+    """
+
+    timeout: float | None = None
+    """
+    Max. secs the action may run, else the step is KILLED [default: the workflow
+    `step_timeout`]. NOTE: The `timeout` parameter of an approval is how long it
+    may wait; this limits the execution of the action.
+    """
+
     @model_validator(mode="before")
     def set_input_values(cls, values: Dict[str, Any]) -> Dict[str, Any]:
         if not values.get("id"):
@@ -121,7 +258,7 @@ class WFStep(BaseModel):
         if not action_key:
             raise ValueError("Action for the step must be specified")
 
-        action_info = BaseRunner.actions.get(action_key)
+        action_info = BaseRunner.get_action_info(action_key)
         if not action_info:
             raise ValueError(f"Specified Action {action_key} not found")
         action = action_info["class"]()
@@ -141,6 +278,18 @@ class WFStep(BaseModel):
         values["reverse_input_mapping"] = {
             value: key for key, value in values.get("input_mapping", {}).items()
         }
+        context_keys = action.context_keys(values.get("parameters", {}))
+        if context_keys is not None:
+            input_mapping = values.get("input_mapping", {})
+            variables = {
+                *values["input_keys"],
+                *input_mapping.values(),
+                *(input_mapping.get(k, k) for k in context_keys),
+            }
+            values["variable_keys"] = [
+                (name, values["reverse_input_mapping"].get(name, name))
+                for name in sorted(variables)
+            ]
 
         logger.debug(
             f"{values['id']}: Input Keys = {values['input_keys']}"
@@ -158,14 +307,44 @@ class WFStep(BaseModel):
 
         return values
 
-    def input_mapped_context(self, **kwargs) -> Dict[str, Any]:
-        """Create the workflow context for the step with the input mapping."""
+    def input_mapped_context(self, variables: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        Create the workflow context for the step with the input mapping; only the
+        variables read by the step [`variable_keys`] are projected.
+        """
+        if self.variable_keys is None:
+            reverse_mapping = self.reverse_input_mapping
+            pairs = [(key, reverse_mapping.get(key, key)) for key in variables]
+        else:
+            pairs = self.variable_keys
         inputs = {}
-        for input_key in kwargs:
-            mapped_input_key = self.reverse_input_mapping.get(input_key, input_key)
-            inputs[mapped_input_key] = kwargs.get(input_key)
+        for variable_key, input_key in pairs:
+            if variable_key in variables:
+                inputs[input_key] = variables[variable_key]
         return inputs
 
+    def step_inputs(
+        self, wf_context: Dict[str, Any], mapped_inputs: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        The effective inputs of the step [recorded in its step run]: the values of
+        the step parameters and the mapped inputs, as resolved for the action;
+        Not the whole context [see `context_seq` in the step run for that].
+        """
+        kwargs = LayeredContext(
+            wf_context["wf_parameters"],
+            self.parameters,
+            wf_context["metadata"],
+            mapped_inputs,
+        )
+        if self.variable_keys is None:
+            input_keys = list(mapped_inputs)
+        else:
+            input_keys = [input_key for _, input_key in self.variable_keys]
+        return {
+            key: kwargs[key] for key in (*self.parameters, *input_keys) if key in kwargs
+        }
+
     def output_mapped_context(self, **kwargs) -> Dict[str, Any]:
         """Create the workflow context for the step with the output mapping."""
         outputs = {}
@@ -174,47 +353,210 @@ class WFStep(BaseModel):
             outputs[mapped_output_key] = kwargs.get(output_key)
         return outputs
 
+    @property
+    def read_keys(self) -> Set[str] | None:
+        """
+        The workflow variables read by the step [inputs, the variables passed to
+        the action & exec_if conditions]; None if the action may read any of them
+        """
+        if self.variable_keys is None:
+            return None
+        names = set(self.input_keys)
+        names.update(name for name, _ in self.variable_keys)
+        for condition in self.exec_if:
+            names.update(condition.names)
+        return names
+
+    @property
+    def write_keys(self) -> Set[str]:
+        """The workflow variables written by the step"""
+        return set(self.output_keys) | set(self.output_mapping.values())
+
     def execute(self, wf_context: Dict[str, Any], resumed_step=False) -> WFResult:
         """Execute the step using the BaseRunner defined for the step."""
-        should_exec_step = all(
+        mapped_inputs = self.input_mapped_context(wf_context["variables"])
+        inputs = self.step_inputs(wf_context, mapped_inputs)
+        if not self.should_execute(wf_context):
+            return self.skipped_result(inputs)
+
+        logger.info(f"Executing Step: {self.id} // {self.action.name}")
+        exec_func = self.action.resume if resumed_step else self.action.run
+        kwargs = self.action_kwargs(wf_context, mapped_inputs)
+        cache_key = None if resumed_step else self.cache_key(wf_context, kwargs)
+        if cache_key:
+            outputs = self.cached_outputs(wf_context, cache_key)
+            if outputs is not None:
+                return self.step_result(inputs, outputs, wf_context)
+
+        timeout = self.exec_timeout(wf_context)
+        if timeout is None:
+            outputs = exec_func(**kwargs)
+        elif timeout <= 0:  # The run deadline has passed; do not start the action
+            return self.killed_result(inputs, 0.0)
+        else:
+            started = time.monotonic()
+            try:
+                outputs = call_with_timeout(exec_func, timeout, **kwargs)
+            except StepTimeoutError:
+                return self.killed_result(inputs, time.monotonic() - started)
+        if cache_key:
+            self.cache_outputs(wf_context, cache_key, outputs)
+        return self.step_result(inputs, outputs, wf_context)
+
+    async def aexecute(
+        self, wf_context: Dict[str, Any], resumed_step=False
+    ) -> WFResult:
+        """Execute the step [async] using the BaseRunner defined for the step."""
+        mapped_inputs = self.input_mapped_context(wf_context["variables"])
+        inputs = self.step_inputs(wf_context, mapped_inputs)
+        if not self.should_execute(wf_context):
+            return self.skipped_result(inputs)
+
+        logger.info(f"Executing Step: {self.id} // {self.action.name}")
+        exec_func = self.action.aresume if resumed_step else self.action.arun
+        kwargs = self.action_kwargs(wf_context, mapped_inputs)
+        cache_key = None if resumed_step else self.cache_key(wf_context, kwargs)
+        if cache_key:
+            outputs = self.cached_outputs(wf_context, cache_key)
+            if outputs is not None:
+                return self.step_result(inputs, outputs, wf_context)
+
+        timeout = self.exec_timeout(wf_context)
+        if timeout is None:
+            outputs = await exec_func(**kwargs)
+        elif timeout <= 0:  # The run deadline has passed; do not start the action
+            return self.killed_result(inputs, 0.0)
+        else:
+            import asyncio
+
+            started = time.monotonic()
+            task = asyncio.ensure_future(exec_func(**kwargs))
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if not done:
+                task.cancel()
+                return self.killed_result(inputs, time.monotonic() - started)
+            outputs = task.result()
+        if cache_key:
+            self.cache_outputs(wf_context, cache_key, outputs)
+        return self.step_result(inputs, outputs, wf_context)
+
+    def cache_key(
+        self, wf_context: Dict[str, Any], kwargs: Mapping[str, Any]
+    ) -> str | None:
+        """The step cache key for the action arguments [None: not to be cached]"""
+        step_cache = wf_context.get("step_cache")
+        cacheable = self.action.cacheable if self.cache is None else self.cache
+        if step_cache is None or not cacheable:
+            return None
+        cache_inputs = self.action.cache_inputs(**kwargs)
+        if cache_inputs is None:
+            return None
+        return step_cache.key(self.action.name, cache_inputs, type(self.action))
+
+    def cached_outputs(
+        self, wf_context: Dict[str, Any], cache_key: str
+    ) -> Dict[str, Any] | None:
+        outputs = wf_context["step_cache"].get(cache_key)
+        if outputs is None:
+            return None
+        logger.info(f"Step cache hit: {self.id} // {self.action.name}")
+        if "status" in outputs:
+            outputs["status"] = RunStatus(outputs["status"])
+        return outputs
+
+    def cache_outputs(
+        self, wf_context: Dict[str, Any], cache_key: str, outputs: Dict[str, Any]
+    ) -> None:
+        """Cache the outputs, unless the action failed or is waiting"""
+        status = RunStatus(outputs.get("status", RunStatus.UNKNOWN))
+        if not status.not_successful() and not status.is_waiting():
+            wf_context["step_cache"].put(cache_key, outputs)
+
+    def exec_timeout(self, wf_context: Dict[str, Any]) -> float | None:
+        """The secs the action may run [the step timeout, within the run deadline]"""
+        timeout = self.timeout or wf_context.get("step_timeout")
+        deadline = wf_context.get("deadline")
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0.0)
+            timeout = min(timeout, remaining) if timeout else remaining
+        return timeout
+
+    def should_execute(self, wf_context: Dict[str, Any]) -> bool:
+        """Return True if the step execution conditions are satisfied."""
+        return all(
             condition.evaluate(wf_context, self.id, self.parameters)
             for condition in self.exec_if
         )
-        inputs = wf_context["variables"]
-        if should_exec_step:
-            logger.info(f"Executing Step: {self.id} // {self.action.name}")
-            exec_func = self.action.resume if resumed_step else self.action.run
-            mapped_inputs = self.input_mapped_context(**inputs)
-            outputs = exec_func(
-                **wf_context["wf_parameters"],
-                **self.parameters,
-                **wf_context["metadata"],
-                **mapped_inputs,
-                owner=wf_context["owner"],
-            )
-            status = outputs.pop("status", RunStatus.UNKNOWN)
-            reason = outputs.pop("reason", f"Step [{status.value}]")
-            outputs = self.output_mapped_context(**outputs)
-            step_response = WFResult(
-                step_id=self.id,
-                action=self.action.name,
-                inputs=inputs,
-                outputs=outputs,
-                status=status,
-                completion_reason=reason,
-            )
-        else:
-            logger.info(f"Skipping Step: {self.id} // {self.action.name}")
-            step_response = WFResult(
-                step_id=self.id,
-                action=self.action.name,
-                inputs=inputs,
-                outputs={},
-                status=RunStatus.SKIPPED,
-                completion_reason="Skipping step: condition not met",
-            )
 
-        return step_response
+    def action_kwargs(
+        self, wf_context: Dict[str, Any], mapped_inputs: Dict[str, Any] | None = None
+    ) -> LayeredContext:
+        """
+        The arguments for the action [parameters, metadata and mapped inputs]; A
+        layered view, with the same precedence as merging them in order, that is
+        only materialized by the `**` of the action call. The spilled outputs of
+        the earlier steps are read lazily [see spill].
+        """
+        if mapped_inputs is None:
+            mapped_inputs = self.input_mapped_context(wf_context["variables"])
+        return LayeredContext(
+            wf_context["wf_parameters"],
+            self.parameters,
+            wf_context["metadata"],
+            resolve_spilled(mapped_inputs, wf_context["working_dir"]),
+            {
+                "owner": wf_context["owner"],
+                "working_dir": str(wf_context["working_dir"] or ""),
+            },
+        )
+
+    def step_result(
+        self,
+        inputs: Dict[str, Any],
+        outputs: Dict[str, Any],
+        wf_context: Dict[str, Any] | None = None,
+    ) -> WFResult:
+        """The step result; the large outputs are spilled to the working dir"""
+        status = RunStatus(outputs.pop("status", RunStatus.UNKNOWN))
+        reason = outputs.pop("reason", f"Step [{status.value}]")
+        resume_at = outputs.pop("resume_at", None)
+        timeout_at = outputs.pop("timeout_at", None)
+        outputs = self.output_mapped_context(**outputs)
+        if wf_context is not None:
+            spill_outputs(outputs, wf_context["working_dir"], self.id)
+        return WFResult(
+            step_id=self.id,
+            action=self.action.name,
+            inputs=inputs,
+            outputs=outputs,
+            status=status,
+            completion_reason=reason,
+            resume_at=resume_at,
+            timeout_at=timeout_at,
+        )
+
+    def killed_result(self, inputs: Dict[str, Any], elapsed: float) -> WFResult:
+        reason = f"Step [{self.id}] timed out after {elapsed:.2f} secs"
+        logger.warning(f"{reason} // {self.action.name}")
+        return WFResult(
+            step_id=self.id,
+            action=self.action.name,
+            inputs=inputs,
+            outputs={},
+            status=RunStatus.KILLED,
+            completion_reason=reason,
+        )
+
+    def skipped_result(self, inputs: Dict[str, Any]) -> WFResult:
+        logger.info(f"Skipping Step: {self.id} // {self.action.name}")
+        return WFResult(
+            step_id=self.id,
+            action=self.action.name,
+            inputs=inputs,
+            outputs={},
+            status=RunStatus.SKIPPED,
+            completion_reason="Skipping step: condition not met",
+        )
 
 
 class WFTransition(BaseModel):
@@ -274,6 +616,17 @@ class Workflow(BaseModel):
     transitions: List[WFTransition] = []
     """The transitions between the steps."""
 
+    step_timeout: float | None = DEFAULT_STEP_TIMEOUT
+    """The default `timeout` of the steps"""
+
+    timeout: float | None = None
+    """
+    Max. secs for a run (or resume) of the workflow; the step in progress is KILLED
+    when exceeded [and the run stops at the next step boundary]
+    """
+
+    _plan: ExecutionPlan | None = PrivateAttr(default=None)
+
     @model_validator(mode="before")
     def set_input_values(cls, values: Dict[str, Any]) -> Dict[str, Any]:
         # Convert from step names to WFStep classes
@@ -308,6 +661,18 @@ class Workflow(BaseModel):
 
         return values
 
+    @model_validator(mode="after")
+    def build_plan(self) -> Workflow:
+        # NOTE: Re-run when a (cached) instance is passed to a model; Compiled once
+        if self._plan is None:
+            self._plan = ExecutionPlan.compile(self)
+        return self
+
+    @property
+    def plan(self) -> ExecutionPlan:
+        """The execution plan for the workflow."""
+        return self._plan
+
     def get_step(self, step_id: str) -> WFStep | None:
         """Get the step with the given ID."""
         return self.steps.get(step_id)
@@ -316,18 +681,162 @@ class Workflow(BaseModel):
         self, curr_step: WFStep, wf_context: Dict[str, Any]
     ) -> Tuple[str, WFStep | None]:
         """Get the next step to be executed."""
-        transitions = [x for x in self.transitions if x.from_step == curr_step.id]
+        plan = self.plan
+        status, next_index = plan.next_index(plan.index_of(curr_step.id), wf_context)
+        return status, (None if next_index is None else plan.steps[next_index])
+
+
+Edge = Tuple[int, Tuple[Condition, ...]]
+"""An outgoing transition: (index of the next step, conditions)"""
+
+
+class ExecutionPlan(BaseModel):
+    """
+    The workflow lowered for execution. The steps are integer indexed and each
+    step has its outgoing transitions (in definition order) precomputed, so that
+    finding the next step does not need a scan of all the transitions.
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    steps: Tuple[WFStep, ...]
+    """The steps in definition order"""
+
+    step_index: Dict[str, int]
+    """Step ID -> Index in `steps`"""
+
+    first_index: int
+    """Index of the first step"""
+
+    edges: Tuple[Tuple[Edge, ...], ...]
+    """Outgoing transitions for each step [indexed like `steps`]"""
+
+    unreachable: Tuple[str, ...] = ()
+    """Steps that cannot be reached from the first step"""
+
+    forks: FrozenSet[int] = frozenset()
+    """Indices of the steps whose transitions are followed in parallel"""
+
+    joins: Dict[int, JoinMode] = {}
+    """Index -> Join Mode for the steps where the parallel branches join"""
+
+    @staticmethod
+    def compile(workflow: Workflow) -> ExecutionPlan:
+        """Lower the validated workflow into the execution plan."""
+        steps = tuple(workflow.steps.values())
+        step_index = {step.id: idx for idx, step in enumerate(steps)}
+
+        edges: List[List[Edge]] = [[] for _ in steps]
+        for transition in workflow.transitions:
+            for step_id in [transition.from_step, transition.to_step]:
+                if step_id not in step_index:
+                    raise ValueError(
+                        f"Transition [{transition.from_step} -> {transition.to_step}]"
+                        f": Step [{step_id}] not found"
+                    )
+            edges[step_index[transition.from_step]].append(
+                (step_index[transition.to_step], tuple(transition.conditions))
+            )
+
+        # Find the steps that are not reachable from the first step
+        first_index = step_index[workflow.first_step.id]
+        reachable = {first_index}
+        pending = [first_index]
+        while pending:
+            for next_index, _ in edges[pending.pop()]:
+                if next_index not in reachable:
+                    reachable.add(next_index)
+                    pending.append(next_index)
+        unreachable = tuple(s.id for i, s in enumerate(steps) if i not in reachable)
+        if unreachable:
+            logger.warning(f"Workflow {workflow.name}: Unreachable steps {unreachable}")
+
+        # Fork steps need multiple outgoing transitions, Join steps multiple incoming
+        incoming = [0] * len(steps)
+        for step_edges in edges:
+            for next_index, _ in step_edges:
+                incoming[next_index] += 1
+        for idx, step in enumerate(steps):
+            if step.fork and len(edges[idx]) < 2:
+                raise ValueError(f"Fork Step [{step.id}] needs multiple transitions")
+            if step.join and incoming[idx] < 2:
+                raise ValueError(f"Join Step [{step.id}] needs multiple transitions")
+
+        return ExecutionPlan(
+            steps=steps,
+            step_index=step_index,
+            first_index=first_index,
+            edges=tuple(tuple(step_edges) for step_edges in edges),
+            unreachable=unreachable,
+            forks=frozenset(idx for idx, step in enumerate(steps) if step.fork),
+            joins={idx: step.join for idx, step in enumerate(steps) if step.join},
+        )
+
+    def index_of(self, step_id: str) -> int:
+        return self.step_index[step_id]
+
+    def next_index(
+        self, index: int, wf_context: Dict[str, Any]
+    ) -> Tuple[str, int | None]:
+        """
+        Return the index of the next step to be executed [the first transition
+        whose conditions are satisfied]. The status is "ERROR" if a condition
+        could not be evaluated.
+        """
+        step = self.steps[index]
         try:
-            for transition in transitions:
-                if not transition.conditions:
-                    return "OK", self.steps.get(transition.to_step)
+            for next_index, conditions in self.edges[index]:
                 if all(
-                    condition.evaluate(wf_context, curr_step.id, curr_step.parameters)
-                    for condition in transition.conditions
+                    condition.evaluate(wf_context, step.id, step.parameters)
+                    for condition in conditions
                 ):
-                    return "OK", self.steps.get(transition.to_step)
+                    return "OK", next_index
         except Exception as e:
-            logger.error(f"Error getting next step for [{curr_step.id}]: {e}")
+            logger.error(f"Error getting next step for [{step.id}]: {e}")
             return "ERROR", None
 
         return "OK", None
+
+    def dataflow_chain(self, index: int) -> List[int]:
+        """
+        Return the chain of steps starting at `index` whose order is known before
+        any of them run: each step (except the last) has a single unconditional
+        transition to the next. The chain ends at a fork, before a join and before
+        a step that may wait [which runs only after the earlier steps].
+        """
+        chain = [index]
+        while (
+            len(self.edges[index]) == 1
+            and not self.edges[index][0][1]
+            and index not in self.forks
+        ):
+            index = self.edges[index][0][0]
+            if (
+                index in chain
+                or index in self.joins
+                or self.steps[index].action.may_wait
+            ):
+                break
+            chain.append(index)
+        return chain
+
+    def fork_indices(
+        self, index: int, wf_context: Dict[str, Any]
+    ) -> Tuple[str, List[int]]:
+        """
+        Return the indices of the steps starting the parallel branches of a fork
+        step [all the transitions whose conditions are satisfied].
+        """
+        step = self.steps[index]
+        try:
+            return "OK", [
+                next_index
+                for next_index, conditions in self.edges[index]
+                if all(
+                    condition.evaluate(wf_context, step.id, step.parameters)
+                    for condition in conditions
+                )
+            ]
+        except Exception as e:
+            logger.error(f"Error getting the branches for [{step.id}]: {e}")
+            return "ERROR", []